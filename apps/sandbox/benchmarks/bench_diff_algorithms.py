@@ -0,0 +1,95 @@
+"""
+Benchmark the block diff engines on large synthetic Markdown blocks.
+
+Run from apps/sandbox:
+
+    python benchmarks/bench_diff_algorithms.py
+    python benchmarks/bench_diff_algorithms.py --sizes 10000 100000 --edits 20
+"""
+
+import argparse
+import random
+import time
+
+from sandbox.core.diff_algorithms import DIFF_CACHE, diff_tokens, get_diff_algorithm
+from sandbox.core.markdown_ast import tokenize_markdown
+
+VOCABULARY = [
+    "the", "model", "results", "climate", "species", "data", "analysis",
+    "**significant**", "[source](https://example.org)", "`code`", "of",
+    "and", "in", "observed", "sampling", "methods", "table", "increase",
+]
+
+# difflib is quadratic on these inputs; skip it above this token count.
+DIFFLIB_MAX_TOKENS = 30_000
+
+
+def make_block(rng: random.Random, token_count: int) -> str:
+    words = []
+    for i in range(token_count // 2):
+        words.append(rng.choice(VOCABULARY) + str(rng.randint(0, 500)))
+        if i % 40 == 39:
+            words.append("\n\n- ")
+    return " ".join(words)
+
+
+def mutate(rng: random.Random, text: str, edits: int) -> str:
+    words = text.split(" ")
+    for _ in range(edits):
+        pos = rng.randrange(len(words))
+        op = rng.choice(["insert", "delete", "replace"])
+        if op == "insert":
+            words.insert(pos, "inserted")
+        elif op == "delete":
+            del words[pos]
+        else:
+            words[pos] = "replaced"
+    return " ".join(words)
+
+
+def bench(name: str, old_tokens: list[str], new_tokens: list[str]) -> float:
+    engine = get_diff_algorithm(name, len(old_tokens), len(new_tokens))
+    start = time.perf_counter()
+    engine.opcodes(old_tokens, new_tokens)
+    return time.perf_counter() - start
+
+
+def bench_two_tier(old_text: str, new_text: str) -> float:
+    diff_tokens(old_text, new_text, "auto", two_tier=False)  # warm the token cache
+    DIFF_CACHE.clear()
+    start = time.perf_counter()
+    diff_tokens(old_text, new_text, "auto", two_tier=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 30_000, 100_000])
+    parser.add_argument("--edits", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'tokens':>8}  {'difflib':>10}  {'myers':>10}  {'histogram':>10}  {'two-tier':>10}")
+    for size in args.sizes:
+        old_text = make_block(rng, size)
+        new_text = mutate(rng, old_text, args.edits)
+        old_tokens = tokenize_markdown(old_text)
+        new_tokens = tokenize_markdown(new_text)
+
+        timings = {}
+        for name in ("difflib", "myers", "histogram"):
+            if name == "difflib" and len(old_tokens) > DIFFLIB_MAX_TOKENS:
+                timings[name] = "skipped"
+                continue
+            timings[name] = f"{bench(name, old_tokens, new_tokens) * 1000:.1f}ms"
+        timings["two-tier"] = f"{bench_two_tier(old_text, new_text) * 1000:.1f}ms"
+
+        print(
+            f"{len(old_tokens):>8}  {timings['difflib']:>10}  "
+            f"{timings['myers']:>10}  {timings['histogram']:>10}  {timings['two-tier']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Measure context prompt tokens with the full and compact encodings.
+
+The corpus mimics Convex reports: 32-character document IDs, a few
+dozen sections and paragraph, list and table blocks. Run from apps/sandbox:
+
+    python benchmarks/bench_prompt_encoding.py
+    python benchmarks/bench_prompt_encoding.py --blocks 50 500 --counter tiktoken
+"""
+
+import argparse
+import random
+import string
+
+from sandbox.core.prompt_builder import _build_compact_context_prompt, _build_context_prompt, compact_aliases
+from sandbox.core.token_counter import get_token_counter
+
+VOCABULARY = ["species", "richness", "increased", "across", "the", "sampled", "sites", "**bold**", "data", "in", "2020"]
+BLOCK_TYPES = ["paragraph"] * 6 + ["list", "table"]
+ID_ALPHABET = string.ascii_lowercase + string.digits
+
+
+def convex_id(rng: random.Random, table_prefix: str) -> str:
+    return table_prefix + "".join(rng.choice(ID_ALPHABET) for _ in range(29))
+
+
+def make_context(rng: random.Random, blocks: int, words: int) -> dict:
+    sections = [
+        {"id": convex_id(rng, "k17"), "title": f"Section {i}"} for i in range(max(blocks // 12, 1))
+    ]
+    return {
+        "sections": sections,
+        "blocks": [
+            {
+                "id": convex_id(rng, "j97"),
+                "type": rng.choice(BLOCK_TYPES),
+                "content": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(words // 2, words * 3 // 2))),
+                "section_id": sections[i * len(sections) // blocks]["id"],
+            }
+            for i in range(blocks)
+        ],
+        "artifacts": [],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--blocks", type=int, nargs="+", default=[50, 500, 2000])
+    parser.add_argument("--words", type=int, default=40, help="mean words per block")
+    parser.add_argument("--counter", default=None, help="approximate | tiktoken (default: auto)")
+    args = parser.parse_args()
+
+    counter = get_token_counter(args.counter)
+    rng = random.Random(0)
+    print(f"counter: {counter.name}, ~{args.words} words per block")
+    print(f"{'blocks':>7}  {'full':>9}  {'compact':>9}  {'saved':>6}")
+    for size in args.blocks:
+        context = make_context(rng, size, args.words)
+        full = counter.count(_build_context_prompt(context))
+        compact = counter.count(_build_compact_context_prompt(context, compact_aliases(context)))
+        print(f"{size:>7}  {full:>9}  {compact:>9}  {1 - compact / full:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark the Markdown tokenizer against the previous re.split version.
+
+Run from apps/sandbox:
+
+    python benchmarks/bench_tokenizer.py
+"""
+
+import random
+import re
+import time
+
+from sandbox.core.markdown_ast import tokenize_markdown
+
+LEGACY_PATTERN = r'(\s+|```|`|#{1,6}\s|^\s*[-*+]\s|^\s*\d+\.\s|\[.*?\]\(.*?\)|\*\*|__|\*|_|~~)'
+
+# The legacy tokenizer is quadratic on adversarial input; cap its input size.
+LEGACY_MAX_CHARS = 40_000
+
+
+def legacy_tokenize(text: str) -> list[str]:
+    return [part for part in re.split(LEGACY_PATTERN, text, flags=re.MULTILINE) if part]
+
+
+def prose(rng: random.Random, words: int, links: bool = True) -> str:
+    vocabulary = ["results", "**bold**", "`code`", "_em_", "data"]
+    if links:
+        vocabulary.append("[ref](https://example.org)")
+    lines = []
+    for i in range(0, words, 12):
+        prefix = rng.choice(["", "- ", "1. ", "## "])
+        lines.append(prefix + " ".join(rng.choice(vocabulary) for _ in range(12)))
+    return "\n".join(lines)
+
+
+def timed(func, text: str) -> tuple[float, list[str]]:
+    start = time.perf_counter()
+    tokens = func(text)
+    return time.perf_counter() - start, tokens
+
+
+def main():
+    rng = random.Random(0)
+    corpora = {
+        "prose 100k words": prose(rng, 100_000, links=False),
+        "prose+links 100k": prose(rng, 100_000),
+        "brackets 10k": "[a " * 10_000,
+        "brackets 100k": "[a " * 100_000,
+        "link-ish 50k": "[x](" * 50_000,
+    }
+
+    print(f"{'input':<18} {'chars':>9} {'legacy':>10} {'scanner':>10}")
+    for name, text in corpora.items():
+        scanner_time, tokens = timed(tokenize_markdown, text)
+        if len(text) <= LEGACY_MAX_CHARS or not name.startswith(("brackets", "link")):
+            legacy_time, legacy_tokens = timed(legacy_tokenize, text)
+            assert legacy_tokens == tokens, name
+            legacy = f"{legacy_time * 1000:.1f}ms"
+        else:
+            legacy = "skipped"
+        print(f"{name:<18} {len(text):>9} {legacy:>10} {scanner_time * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark truncate_context against the previous json.dumps-per-block version.
+
+Run from apps/sandbox:
+
+    python benchmarks/bench_truncate_context.py
+    python benchmarks/bench_truncate_context.py --blocks 5000 --max-tokens 200000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from sandbox.core.prompt_builder import truncate_context
+from sandbox.core.token_counter import TOKEN_COUNT_CACHE, get_token_counter
+
+VOCABULARY = ["species", "richness", "increased", "across", "the", "sampled", "sites", "**bold**", "data"]
+
+# The legacy version is quadratic in block count; skip it above this size.
+LEGACY_MAX_BLOCKS = 2000
+
+
+def legacy_truncate_context(context: dict, max_tokens: int = 8000) -> dict:
+    max_chars = max_tokens * 4
+    truncated = {"sections": context.get("sections", []), "blocks": [], "artifacts": context.get("artifacts", [])}
+    current_size = len(json.dumps(truncated))
+    for block in context.get("blocks", []):
+        block_copy = block.copy()
+        content = block_copy.get("content", "")
+        remaining_space = max_chars - current_size
+        if remaining_space <= 0:
+            break
+        if len(content) > remaining_space:
+            block_copy["content"] = content[:remaining_space] + "...[truncated]"
+        truncated["blocks"].append(block_copy)
+        current_size = len(json.dumps(truncated))
+    return truncated
+
+
+def make_context(rng: random.Random, blocks: int) -> dict:
+    return {
+        "sections": [{"id": f"sec-{i}", "title": f"Section {i}"} for i in range(blocks // 50 + 1)],
+        "blocks": [
+            {
+                "id": f"block-{i}",
+                "type": "paragraph",
+                "content": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(20, 120))),
+            }
+            for i in range(blocks)
+        ],
+        "artifacts": [],
+    }
+
+
+def timed(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--blocks", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--max-tokens", type=int, default=10**7)
+    parser.add_argument("--counter", default=None, help="approximate | tiktoken (default: auto)")
+    args = parser.parse_args()
+
+    counter = get_token_counter(args.counter)
+    rng = random.Random(0)
+    print(f"counter: {counter.name}")
+    print(f"{'blocks':>7}  {'legacy':>10}  {'cold':>10}  {'warm':>10}")
+    for size in args.blocks:
+        context = make_context(rng, size)
+        if size <= LEGACY_MAX_BLOCKS:
+            legacy = f"{timed(legacy_truncate_context, context, args.max_tokens) * 1000:.1f}ms"
+        else:
+            legacy = "skipped"
+        TOKEN_COUNT_CACHE.clear()
+        cold = timed(truncate_context, context, args.max_tokens, counter)
+        warm = timed(truncate_context, context, args.max_tokens, counter)
+        print(f"{size:>7}  {legacy:>10}  {cold * 1000:>8.1f}ms  {warm * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,56 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
+import asyncio
+import json
+import os
+import time
+from typing import NamedTuple
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import httpx
+from pydantic import BaseModel, model_validator
+
+from sandbox.core.artifact_ingest import (
+    ARTIFACT_TOKEN_BUDGET,
+    digest_artifact,
+    open_artifact,
+    resolve_local_artifact,
+)
+from sandbox.core.bm25_index import BM25Index, get_project_index
+from sandbox.core.content_cache import content_hash
+from sandbox.core.dense_index import DenseIndex, get_project_dense_index
+from sandbox.core.diff_engine import compute_span_diff, encode_span_diff, resolve_edit_text
+from sandbox.core.document_store import DocumentResyncRequired, get_document_store
+from sandbox.core.fan_out import PartResult, fan_out_concurrency, gather_limited, merge_results, split_context
+from sandbox.core.history import HistoryWindow, get_history_manager
+from sandbox.core.llm_client import BaseLLMClient
+from sandbox.core.llm_pool import get_llm_registry
+from sandbox.core.prompt_builder import build_agent_prompt, compact_aliases, expand_aliases
+from sandbox.core.reply_stream import AgentReplyParser
+from sandbox.core.single_flight import IdempotencyKeyReused, SingleFlight, get_idempotency_store
 
 router = APIRouter()
 
+# Shared by conversation history and document context; history may use up to its own cap.
+PROMPT_TOKEN_BUDGET = 8000
+HISTORY_TOKEN_BUDGET = 3000
+# Split between all attached artifacts; each gets at most ARTIFACT_TOKEN_BUDGET.
+ARTIFACTS_TOKEN_BUDGET = 2000
+
+# Seconds a request waits for a run with its Idempotency-Key held by another worker.
+IDEMPOTENCY_WAIT = 120.0
+IDEMPOTENCY_POLL_INTERVAL = 0.25
+
+_runs = SingleFlight()
+
 
 class Block(BaseModel):
     id: str
     markdown_text: str
+    section_id: str | None = None
+    # Convex v.number(): fractional orders place a block between two others.
+    order: float | None = None
+    content_hash: str | None = None
 
 
 class Section(BaseModel):
@@ -14,9 +58,19 @@ class Section(BaseModel):
     title: str
 
 
+class Artifact(BaseModel):
+    id: str
+    name: str
+    file_type: str | None = None
+    path: str | None = None
+    url: str | None = None
+
+
 class Context(BaseModel):
     sections: list[Section]
     blocks: list[Block]
+    revision: str | None = None
+    artifacts: list[Artifact] = []
 
 
 class Message(BaseModel):
@@ -24,10 +78,31 @@ class Message(BaseModel):
     content: str
 
 
+class ContextDelta(BaseModel):
+    base_revision: str
+    revision: str
+    upserted_blocks: list[Block] = []
+    removed_block_ids: list[str] = []
+    sections: list[Section] | None = None
+    document_hash: str | None = None
+    artifacts: list[Artifact] = []
+
+
 class AgentRunRequest(BaseModel):
     thread_id: str
     messages: list[Message]
-    context: Context
+    context: Context | None = None
+    delta: ContextDelta | None = None
+    project_id: str | None = None
+    anchor_section_id: str | None = None
+    # Prompt each section separately and merge the results.
+    fan_out: bool = False
+
+    @model_validator(mode="after")
+    def _check_context_or_delta(self):
+        if (self.context is None) == (self.delta is None):
+            raise ValueError("Provide exactly one of context or delta")
+        return self
 
 
 class ProposedEdit(BaseModel):
@@ -38,11 +113,455 @@ class ProposedEdit(BaseModel):
 class AgentRunResponse(BaseModel):
     agent_message: str
     proposed_edits: list[ProposedEdit]
+    document_revision: str | None = None
+
+
+def get_llm_client() -> BaseLLMClient:
+    return get_llm_registry().get()
+
+
+@router.get("/llm/pool/stats")
+async def llm_pool_stats():
+    """Connection pool limits and usage of the shared LLM clients in this process."""
+    return get_llm_registry().stats()
+
+
+@router.get("/llm/cache/stats")
+async def llm_cache_stats():
+    """Hit counters and sizes of the completion cache, or null when it is off."""
+    cache = get_llm_registry().cache
+    return cache.stats() if cache is not None else None
 
 
 @router.post("/agent/run", response_model=AgentRunResponse)
-async def agent_run(request: AgentRunRequest):
+async def agent_run(
+    request: AgentRunRequest,
+    llm: BaseLLMClient = Depends(get_llm_client),
+    idempotency_key: str | None = Header(None),
+):
+    """
+    Run the agent once per distinct request.
+
+    Concurrent requests with the same body share one run. An
+    Idempotency-Key header is reserved for the thread on arrival: a
+    request reusing it gets the response of the first request with that
+    key, waiting for it if that run is still going, and reusing a key for
+    a different body is a 422.
+    """
+    fingerprint = content_hash(request.model_dump_json())
+    if idempotency_key is None:
+        return await _runs.do(fingerprint, lambda: _agent_run(request, llm))
+    return await _idempotent_run(request, llm, idempotency_key, fingerprint)
+
+
+async def _idempotent_run(
+    request: AgentRunRequest, llm: BaseLLMClient, key: str, fingerprint: str
+) -> AgentRunResponse:
+    store = get_idempotency_store()
+    scope = request.thread_id
+    flight_key = f"{scope}\0{key}"
+
+    async def run() -> AgentRunResponse:
+        try:
+            response = await _runs.do(fingerprint, lambda: _agent_run(request, llm))
+        except Exception:
+            await store.release(scope, key)
+            raise
+        await store.finish(scope, key, response.model_dump_json())
+        return response
+
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    while True:
+        try:
+            state, stored = await store.reserve(scope, key, fingerprint)
+        except IdempotencyKeyReused:
+            raise HTTPException(
+                status_code=422, detail="Idempotency-Key was already used for a different request"
+            )
+        if state == "done":
+            return AgentRunResponse.model_validate_json(stored)
+        if state == "reserved":
+            return await _runs.do(flight_key, run)
+        # Pending: the run holding the key is in this process, or in another worker.
+        flight = _runs.in_flight(flight_key)
+        if flight is not None:
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                continue
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail={
+                    "code": "idempotency_key_in_progress",
+                    "reason": "A run with this Idempotency-Key is still going",
+                },
+            )
+        await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+
+async def _agent_run(request: AgentRunRequest, llm: BaseLLMClient) -> AgentRunResponse:
+    run = await _prepare_run(request, llm)
+    parts = _fan_out_parts(request, run)
+    if len(parts) > 1:
+        message, edits = await _run_fan_out(llm, run, parts)
+    else:
+        result = await _run_prompt(llm, run, run.context, run.block_texts, None, *_project_indexes(request))
+        message, edits = result.message, result.edits
+    return _response(message, edits, run.revision)
+
+
+@router.post("/agent/run/stream")
+async def agent_run_stream(request: AgentRunRequest, llm: BaseLLMClient = Depends(get_llm_client)):
+    """
+    Run the agent and stream Server-Sent Events.
+
+    "message" events carry the agent message as the model writes it
+    ({"text"}). An "edit" event is sent as soon as each proposed edit is
+    complete, with the block's new text and a span diff against its
+    current text ({"block_id", "new_markdown_text", "diff"}); a later edit
+    to the same block supersedes it. A final "result" event carries the
+    AgentRunResponse, including full-text retries of failed patches.
+    Errors raised once the stream has started arrive as an "error" event
+    ({"detail"}). Fan-out runs send only the result.
+    """
+    run = await _prepare_run(request, llm)
+    parts = _fan_out_parts(request, run)
+
+    async def events():
+        try:
+            if len(parts) > 1:
+                message, edits = await _run_fan_out(llm, run, parts)
+            else:
+                aliases, messages = await run_in_threadpool(_prompt, run, run.context, *_project_indexes(request))
+                parser = AgentReplyParser()
+                streamed: dict[str, str] = {}
+                async for chunk in llm.stream(messages):
+                    for event in parser.feed(chunk):
+                        if event.kind == "message":
+                            yield _sse("message", {"text": event.value})
+                            continue
+                        update = await _streamed_edit(event.value, aliases, run.block_texts, streamed)
+                        if update:
+                            yield _sse("edit", update)
+                result = await _finish_prompt(llm, messages, parser.text, aliases, run.block_texts, None)
+                message, edits = result.message, result.edits
+            yield _sse("result", _response(message, edits, run.revision).model_dump())
+        except Exception as exc:
+            # The 200 status line is already sent; report the failure in-band.
+            yield _sse("error", {"detail": str(exc)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class _PreparedRun(NamedTuple):
+    revision: str | None
+    sections: list[dict]
+    context: dict
+    block_texts: dict[str, str]
+    history: HistoryWindow
+    context_budget: int
+    compact: bool
+    scope: str  # project, else thread; scopes memoized prompts
+
+
+async def _prepare_run(request: AgentRunRequest, llm: BaseLLMClient) -> _PreparedRun:
+    """Resolve the document, digest artifacts and window the history for a run."""
+    revision, sections, blocks = _resolve_document(request)
+    context = {
+        "sections": sections,
+        "blocks": [
+            {"id": block["id"], "type": "markdown", "content": block["markdown_text"], "section_id": block["section_id"]}
+            for block in blocks
+        ],
+        "artifacts": await _digest_artifacts(request.context.artifacts if request.context else request.delta.artifacts),
+        "anchor_section_id": request.anchor_section_id,
+        "revision": revision,
+    }
+    history = await get_history_manager().window(
+        request.thread_id, [message.model_dump() for message in request.messages], llm, HISTORY_TOKEN_BUDGET
+    )
+    return _PreparedRun(
+        revision=revision,
+        sections=sections,
+        context=context,
+        block_texts={block["id"]: block["markdown_text"] for block in blocks},
+        history=history,
+        context_budget=max(PROMPT_TOKEN_BUDGET - history.tokens, 0),
+        compact=os.getenv("PROMPT_ENCODING", "full") == "compact",
+        scope=request.project_id or request.thread_id,
+    )
+
+
+def _project_indexes(request: AgentRunRequest) -> tuple[BM25Index | None, DenseIndex | None]:
+    if not request.project_id:
+        return None, None
+    return get_project_index(request.project_id), get_project_dense_index(request.project_id)
+
+
+def _fan_out_parts(request: AgentRunRequest, run: _PreparedRun) -> list[dict]:
+    # A quarter of the budget is left for section titles, block headers and artifacts.
+    return split_context(run.context, run.context_budget * 3 // 4) if request.fan_out else []
+
+
+async def _run_fan_out(llm: BaseLLMClient, run: _PreparedRun, parts: list[dict]) -> tuple[str, dict[str, str]]:
+    # Parts are prompted without the project indexes: syncing them to
+    # one part would evict the rest of the report.
+    titles = {section["id"]: section["title"] for section in run.sections}
+    results = await gather_limited(
+        [
+            lambda part=part: _run_prompt(
+                llm, run, part, {block["id"]: run.block_texts[block["id"]] for block in part["blocks"]},
+                titles.get(part["anchor_section_id"]),
+            )
+            for part in parts
+        ],
+        fan_out_concurrency(),
+    )
+    return merge_results(results)
+
+
+def _prompt(
+    run: _PreparedRun, context: dict, index: BM25Index | None = None, dense_index: DenseIndex | None = None
+) -> tuple[dict[str, str], list[dict]]:
+    """
+    Return the compact aliases (empty unless enabled) and the prompt messages for context.
+
+    Syncing and searching the project indexes is CPU-bound, so callers
+    run this in the threadpool.
+    """
+    aliases = compact_aliases(context) if run.compact else {}
+    messages = build_agent_prompt(
+        run.history.messages,
+        context,
+        max_context_tokens=run.context_budget,
+        history_summary=run.history.summary,
+        index=index,
+        dense_index=dense_index,
+        compact=run.compact,
+        cache_scope=run.scope,
+    )
+    return aliases, messages
+
+
+async def _run_prompt(
+    llm: BaseLLMClient,
+    run: _PreparedRun,
+    context: dict,
+    block_texts: dict[str, str],
+    title: str | None,
+    index: BM25Index | None = None,
+    dense_index: DenseIndex | None = None,
+) -> PartResult:
+    """Prompt the LLM about context and resolve its edits to blocks in block_texts."""
+    aliases, messages = await run_in_threadpool(_prompt, run, context, index, dense_index)
+    return await _finish_prompt(llm, messages, await llm.complete(messages), aliases, block_texts, title)
+
+
+async def _finish_prompt(
+    llm: BaseLLMClient,
+    messages: list[dict],
+    reply: str,
+    aliases: dict[str, str],
+    block_texts: dict[str, str],
+    title: str | None,
+) -> PartResult:
+    """
+    Parse a reply and resolve its edits to blocks in block_texts.
+
+    Patches that do not apply cleanly fall back to one request for full texts.
+    Replies are accepted into the completion cache only when they are a
+    JSON object and, for the first reply, every edit applied.
+    """
+    data = parse_agent_response(reply)
+    edits, failed = _resolve_edits(expand_aliases(data["proposedEdits"], aliases), block_texts)
+    if not failed and _reply_object(reply) is not None:
+        await llm.accept(messages, reply)
+
+    if failed:
+        messages = messages + [
+            {"role": "assistant", "content": reply},
+            {"role": "user", "content": _full_text_retry_prompt([aliases.get(block_id, block_id) for block_id in failed])},
+        ]
+        retry_reply = await llm.complete(messages)
+        if _reply_object(retry_reply) is not None:
+            await llm.accept(messages, retry_reply)
+        retry = parse_agent_response(retry_reply)
+        retry_edits = [
+            edit for edit in expand_aliases(retry["proposedEdits"], aliases)
+            if edit.get("id") in failed and isinstance(edit.get("content"), str)
+        ]
+        resolved, _ = _resolve_edits(retry_edits, block_texts)
+        edits.update(resolved)
+
+    return PartResult(title, data["message"], edits)
+
+
+def _response(message: str, edits: dict[str, str], revision: str | None) -> AgentRunResponse:
     return AgentRunResponse(
-        agent_message="I'm ready to help you with your report. This is a stub response for now.",
-        proposed_edits=[],
+        agent_message=message,
+        proposed_edits=[
+            ProposedEdit(block_id=block_id, new_markdown_text=text)
+            for block_id, text in edits.items()
+        ],
+        document_revision=revision,
+    )
+
+
+async def _streamed_edit(
+    edit: dict, aliases: dict[str, str], block_texts: dict[str, str], streamed: dict[str, str]
+) -> dict | None:
+    """Resolve one streamed edit on top of earlier ones and diff it; None if it does not apply yet."""
+    [edit] = expand_aliases([edit], aliases)
+    block_id = edit.get("id")
+    if block_id not in block_texts:
+        return None
+    texts, _ = _resolve_edits([edit], {block_id: streamed.get(block_id, block_texts[block_id])})
+    if block_id not in texts:
+        return None
+    streamed[block_id] = texts[block_id]
+    diff = await run_in_threadpool(compute_span_diff, block_texts[block_id], texts[block_id])
+    return {"block_id": block_id, "new_markdown_text": texts[block_id], "diff": encode_span_diff(diff)}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _resolve_document(request: AgentRunRequest) -> tuple[str | None, list[dict], list[dict]]:
+    """
+    Return (revision, sections, blocks) for the request.
+
+    A full context with a revision is stored so later turns can send a
+    delta; a delta is applied to the stored document, and a 409 with
+    code "need_full_resync" tells the caller to send the full context.
+    """
+    store = get_document_store()
+    key = request.project_id or request.thread_id
+
+    if request.delta is None:
+        context = request.context
+        sections = [section.model_dump() for section in context.sections]
+        blocks = [block.model_dump() for block in context.blocks]
+        if context.revision is None:
+            return None, sections, blocks
+        try:
+            document = store.put(key, context.revision, sections, blocks)
+        except DocumentResyncRequired as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+    else:
+        delta = request.delta
+        try:
+            document = store.apply_delta(
+                key,
+                delta.base_revision,
+                delta.revision,
+                [block.model_dump() for block in delta.upserted_blocks],
+                delta.removed_block_ids,
+                [section.model_dump() for section in delta.sections] if delta.sections is not None else None,
+                delta.document_hash,
+            )
+        except DocumentResyncRequired as exc:
+            raise HTTPException(status_code=409, detail={"code": "need_full_resync", "reason": str(exc)})
+
+    return document.revision, document.sections, document.ordered_blocks()
+
+
+async def _digest_artifacts(artifacts: list[Artifact]) -> list[dict]:
+    """
+    Summarize attached artifacts for the prompt.
+
+    Local paths must lie under ARTIFACT_ROOT; URLs are downloaded in
+    chunks. Digesting runs in the threadpool. An artifact without a path
+    or URL is listed by name only; one that cannot be read is a 422.
+    """
+    if not artifacts:
+        return []
+    budget = min(ARTIFACT_TOKEN_BUDGET, ARTIFACTS_TOKEN_BUDGET // len(artifacts))
+    digested = []
+    for artifact in artifacts:
+        summary = None
+        if artifact.path or artifact.url:
+            try:
+                if artifact.path:
+                    path = resolve_local_artifact(artifact.path)
+                    summary = await run_in_threadpool(digest_artifact, path, artifact.file_type, budget)
+                else:
+                    async with open_artifact(artifact.url) as path:
+                        summary = await run_in_threadpool(digest_artifact, path, artifact.file_type, budget)
+            except (OSError, ValueError, ImportError, httpx.HTTPError) as exc:
+                raise HTTPException(status_code=422, detail=f"Could not read artifact '{artifact.id}': {exc}")
+        digested.append({"id": artifact.id, "name": artifact.name, "summary": summary})
+    return digested
+
+
+def parse_agent_response(reply: str) -> dict:
+    """
+    Parse the model's JSON reply into {"message": str, "proposedEdits": list}.
+
+    Markdown code fences around the JSON are ignored. A reply that is not
+    a JSON object is treated as a plain message without edits.
+    """
+    data = _reply_object(reply)
+    if data is None:
+        return {"message": reply, "proposedEdits": []}
+
+    edits = data.get("proposedEdits")
+    return {
+        "message": str(data.get("message", "")),
+        "proposedEdits": [edit for edit in edits if isinstance(edit, dict)] if isinstance(edits, list) else [],
+    }
+
+
+def _reply_object(reply: str) -> dict | None:
+    """Return the reply's JSON object, or None if it is not one."""
+    text = reply.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _resolve_edits(raw_edits: list[dict], block_texts: dict[str, str]) -> tuple[dict[str, str], list[str]]:
+    """
+    Turn block patch/update edits into full new texts, keyed by block ID.
+
+    Edits to unknown blocks and section-level edits are skipped. Several
+    edits to one block apply in order. Returns the texts and the IDs of
+    blocks whose patches did not apply and had no full content.
+    """
+    texts: dict[str, str] = {}
+    failed: list[str] = []
+    for edit in raw_edits:
+        block_id = edit.get("id")
+        if edit.get("type", "block") != "block" or edit.get("action", "update") not in ("patch", "update"):
+            continue
+        if block_id not in block_texts or block_id in failed:
+            continue
+
+        text = resolve_edit_text(texts.get(block_id, block_texts[block_id]), edit)
+        if text is None:
+            texts.pop(block_id, None)
+            failed.append(block_id)
+        else:
+            texts[block_id] = text
+    return texts, failed
+
+
+def _full_text_retry_prompt(block_ids: list[str]) -> str:
+    return (
+        "These patch edits did not apply because their search text was not found "
+        f"exactly once: {', '.join(block_ids)}. Return an \"update\" edit with the "
+        "complete new content for each of these blocks, in the same JSON format."
     )
@@ -0,0 +1,132 @@
+import json
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict
+from pydantic.alias_generators import to_camel
+
+from sandbox.core.batch_diff import get_batch_diff_runner
+from sandbox.core.diff_algorithms import DIFF_ALGORITHMS
+from sandbox.core.diff_engine import diff_cache_stats
+from sandbox.core.merge import merge_three_way
+from sandbox.core.version_diff import diff_snapshots
+
+router = APIRouter()
+
+
+class DiffPair(BaseModel):
+    old_text: str
+    new_text: str
+
+
+class DiffBatchRequest(BaseModel):
+    pairs: list[DiffPair]
+    algorithm: str = "auto"
+    output: Literal["operations", "spans"] = "operations"
+
+
+class SnapshotBlock(BaseModel):
+    """Block as stored in reportVersions snapshots (camelCase on the wire)."""
+
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    block_id: str
+    block_type: str = "paragraph"
+    order: float = 0
+    markdown_text: str
+    content_hash: str | None = None
+
+
+class SnapshotSection(BaseModel):
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    section_id: str
+    heading_text: str = ""
+    heading_level: int = 1
+    order: float = 0
+    blocks: list[SnapshotBlock] = []
+
+
+class Snapshot(BaseModel):
+    sections: list[SnapshotSection]
+
+
+class VersionDiffRequest(BaseModel):
+    old_snapshot: Snapshot
+    new_snapshot: Snapshot
+    algorithm: str = "auto"
+    output: Literal["operations", "spans"] = "spans"
+
+
+class MergeRequest(BaseModel):
+    base_text: str
+    human_text: str
+    agent_text: str
+    algorithm: str = "auto"
+
+
+class MergeConflict(BaseModel):
+    offset: int
+    base: str
+    human: str
+    agent: str
+
+
+class MergeResponse(BaseModel):
+    merged_text: str
+    clean: bool
+    conflicts: list[MergeConflict]
+
+
+def _validate_algorithm(algorithm: str) -> None:
+    if algorithm != "auto" and algorithm not in DIFF_ALGORITHMS:
+        raise HTTPException(status_code=422, detail=f"Unknown diff algorithm '{algorithm}'")
+
+
+@router.post("/diff/batch")
+async def diff_batch(request: DiffBatchRequest):
+    """Stream one NDJSON line per pair, in request order: {"index", "diff"}."""
+    _validate_algorithm(request.algorithm)
+    runner = get_batch_diff_runner()
+    pairs = [(pair.old_text, pair.new_text) for pair in request.pairs]
+
+    async def lines():
+        index = 0
+        async for diff in runner.run(pairs, request.algorithm, request.output):
+            yield json.dumps({"index": index, "diff": diff}) + "\n"
+            index += 1
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/diff/versions")
+def diff_versions(request: VersionDiffRequest):
+    """
+    Stream one NDJSON line per section comparing two version snapshots.
+
+    The generator is synchronous, so Starlette iterates it in a worker
+    thread and the event loop stays free while blocks are diffed.
+    """
+    _validate_algorithm(request.algorithm)
+    old_snapshot = request.old_snapshot.model_dump(by_alias=True, exclude_none=True)
+    new_snapshot = request.new_snapshot.model_dump(by_alias=True, exclude_none=True)
+
+    def lines():
+        for section in diff_snapshots(old_snapshot, new_snapshot, request.algorithm, request.output):
+            yield json.dumps(section) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/diff/merge", response_model=MergeResponse)
+def diff_merge(request: MergeRequest):
+    """Rebase an agent proposal (written against base_text) onto human_text."""
+    _validate_algorithm(request.algorithm)
+    return merge_three_way(request.base_text, request.human_text, request.agent_text, request.algorithm)
+
+
+@router.get("/diff/cache/stats")
+async def diff_cache_stats_endpoint():
+    """Cache counters for this worker process (pool workers keep their own)."""
+    return diff_cache_stats()
@@ -0,0 +1,493 @@
+"""
+Streaming ingestion of report artifacts (CSV, HTML, PDF, plain text).
+
+Files are never read into memory whole. CSVs contribute a schema, per-
+column statistics and sample rows: statistics are gathered row by row
+from buffered reads, capped at STATS_MAX_ROWS, and the total row count
+comes from counting newlines over a memory map. HTML is fed to a parser
+in chunks and text extraction stops once the token budget is filled;
+PDFs are read page by page. Digests are cached by file content hash.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+import csv
+import hashlib
+from html.parser import HTMLParser
+import io
+import json
+import mmap
+import os
+import tempfile
+from typing import AsyncIterator, BinaryIO
+
+try:
+    import fcntl
+except ImportError:  # Windows: an open file cannot be deleted there anyway
+    fcntl = None
+
+import httpx
+
+from .content_cache import ContentCache
+from .token_counter import BaseTokenCounter, get_token_counter
+
+ARTIFACT_TOKEN_BUDGET = 1000
+STATS_MAX_ROWS = 100_000
+SAMPLE_ROWS = 5
+DISTINCT_CAP = 1000
+CHUNK_BYTES = 1 << 20
+HTML_CHUNK_CHARS = 64 * 1024
+MAX_ARTIFACT_BYTES = 512 * 1024 * 1024
+MAX_REDIRECTS = 5
+ARTIFACT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+DIGEST_CACHE = ContentCache(max_entries=512, max_bytes=16 * 1024 * 1024)
+FILE_HASH_CACHE = ContentCache(max_entries=4096, max_bytes=4096 * 200)
+
+_KINDS = {
+    ".csv": "csv", ".tsv": "csv",
+    ".html": "html", ".htm": "html",
+    ".pdf": "pdf",
+    ".txt": "text", ".md": "text", ".markdown": "text",
+}
+
+
+def artifact_kind(path: str, file_type: str | None = None) -> str:
+    """Map a MIME type or file extension to "csv", "html", "pdf" or "text"."""
+    if file_type:
+        lowered = file_type.lower()
+        for marker, kind in (("csv", "csv"), ("tab-separated", "csv"), ("html", "html"), ("pdf", "pdf")):
+            if marker in lowered:
+                return kind
+        if lowered.startswith("text/"):
+            return "text"
+    return _KINDS.get(os.path.splitext(path)[1].lower(), "text")
+
+
+def resolve_local_artifact(path: str) -> str:
+    """Resolve path against ARTIFACT_ROOT, refusing paths outside it or when it is unset."""
+    root = os.getenv("ARTIFACT_ROOT")
+    if not root:
+        raise ValueError("ARTIFACT_ROOT is not configured; local artifact paths are disabled")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"Artifact path '{path}' is outside ARTIFACT_ROOT")
+    return resolved
+
+
+def check_artifact_url(url: httpx.URL) -> None:
+    """
+    Refuse URLs that are not http(s) to a host listed in ARTIFACT_HOSTS.
+
+    ARTIFACT_HOSTS is comma-separated; an entry starting with "." also
+    matches its subdomains. URL artifacts are disabled when it is unset.
+    """
+    if url.scheme not in ("http", "https"):
+        raise ValueError(f"Artifact URL scheme '{url.scheme}' is not allowed")
+    hosts = [host.strip().lower() for host in os.getenv("ARTIFACT_HOSTS", "").split(",") if host.strip()]
+    if not hosts:
+        raise ValueError("ARTIFACT_HOSTS is not configured; artifact URLs are disabled")
+    host = url.host.lower()
+    if not any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in hosts):
+        raise ValueError(f"Artifact host '{url.host}' is not in ARTIFACT_HOSTS")
+
+
+def max_artifact_bytes() -> int:
+    return int(os.getenv("ARTIFACT_MAX_BYTES") or MAX_ARTIFACT_BYTES)
+
+
+async def fetch_artifact(url: str, cache_dir: str | None = None) -> str:
+    """Download an artifact (see open_artifact) and return its path."""
+    async with open_artifact(url, cache_dir) as path:
+        return path
+
+
+@asynccontextmanager
+async def open_artifact(url: str, cache_dir: str | None = None) -> AsyncIterator[str]:
+    """
+    Download an artifact to a local file in CHUNK_BYTES pieces and yield its path.
+
+    Every redirect hop is checked against ARTIFACT_HOSTS, and downloads
+    larger than ARTIFACT_MAX_BYTES (default MAX_ARTIFACT_BYTES) are
+    refused. Downloads are cached per URL with the response's ETag and
+    Last-Modified: a cached file is revalidated with a conditional
+    request and only re-downloaded when it changed (or when the server
+    sent neither validator). The cache directory is pruned to
+    ARTIFACT_CACHE_MAX_BYTES, oldest files first; the file is held with a
+    shared lock until the block exits, so no worker prunes it meanwhile.
+    """
+    cache_dir = cache_dir or os.getenv("ARTIFACT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "sandbox-artifacts")
+    path = os.path.join(cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest())
+    handle, validators = await asyncio.to_thread(_open_cached, cache_dir, path)
+    try:
+        handle = await _fetch(url, path, handle, validators)
+        yield path
+    finally:
+        if handle is not None:
+            handle.close()
+
+
+async def _fetch(url: str, path: str, cached: BinaryIO | None, validators: dict) -> BinaryIO:
+    """Revalidate or download path; return the locked handle of the file now there."""
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    request_url = httpx.URL(url)
+    async with httpx.AsyncClient(follow_redirects=False, timeout=60.0) as client:
+        for _ in range(MAX_REDIRECTS + 1):
+            check_artifact_url(request_url)
+            async with client.stream("GET", request_url, headers=headers) as response:
+                if response.status_code == 304 and headers:
+                    await asyncio.to_thread(os.utime, path)
+                    return cached
+                if response.is_redirect and "location" in response.headers:
+                    request_url = request_url.join(response.headers["location"])
+                    continue
+                response.raise_for_status()
+                downloaded = await _download(response, path)
+                break
+        else:
+            raise ValueError(f"Artifact URL '{url}' redirects more than {MAX_REDIRECTS} times")
+
+    if cached is not None:
+        cached.close()
+    return downloaded
+
+
+async def _download(response: httpx.Response, path: str) -> BinaryIO:
+    max_bytes = max_artifact_bytes()
+    length = response.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ValueError(f"Artifact is larger than {max_bytes} bytes")
+    fd, partial = await asyncio.to_thread(
+        tempfile.mkstemp, dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".part"
+    )
+    handle = os.fdopen(fd, "w+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_SH)  # a new file: never blocks
+        received = 0
+        async for chunk in response.aiter_bytes(CHUNK_BYTES):
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f"Artifact is larger than {max_bytes} bytes")
+            await asyncio.to_thread(handle.write, chunk)
+        validators = {"etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified")}
+        await asyncio.to_thread(_commit, handle, partial, path, validators)
+    except BaseException:
+        handle.close()
+        try:
+            os.remove(partial)
+        except FileNotFoundError:
+            pass
+        raise
+    return handle
+
+
+def _commit(handle: BinaryIO, partial: str, path: str, validators: dict) -> None:
+    handle.flush()
+    os.replace(partial, path)
+    _replace(path + ".json", json.dumps(validators).encode("utf-8"))
+    _prune_cache(os.path.dirname(path), keep=path)
+
+
+def _replace(path: str, data: bytes) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _open_cached(cache_dir: str, path: str) -> tuple[BinaryIO | None, dict]:
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    handle = _lock_shared(path)
+    if handle is None:
+        return None, {}
+    return handle, _read_validators(path)
+
+
+def _lock_shared(path: str) -> BinaryIO | None:
+    """Open path with a shared lock, or return None if it is not there."""
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    if fcntl is not None:
+        fcntl.flock(handle, fcntl.LOCK_SH)
+        try:
+            current = os.stat(path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(handle.fileno()).st_ino:
+            # Pruned or replaced before the lock was granted.
+            handle.close()
+            return _lock_shared(path) if current is not None else None
+    return handle
+
+
+def _read_validators(path: str) -> dict:
+    try:
+        with open(path + ".json") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def _prune_cache(cache_dir: str, keep: str) -> None:
+    max_bytes = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES") or ARTIFACT_CACHE_MAX_BYTES)
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith((".json", ".part")) or not entry.is_file():
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, entry.path, stat.st_size))
+        total += stat.st_size
+    for _, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep or not _remove_unused(path):
+            continue
+        try:
+            os.remove(path + ".json")
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _remove_unused(path: str) -> bool:
+    """Delete path unless a reader holds its lock; return whether it is gone."""
+    try:
+        handle = open(path, "rb")
+    except FileNotFoundError:
+        return True
+    with handle:
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        try:
+            if os.stat(path).st_ino != os.fstat(handle.fileno()).st_ino:
+                return False  # replaced by a new download meanwhile
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:  # Windows: still open elsewhere
+            return False
+    return True
+
+
+def file_hash(path: str) -> str:
+    """Return the content hash of a file, re-reading it only when its size or mtime changed."""
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    return FILE_HASH_CACHE.get_or_compute(key, lambda: _hash_file(path), lambda digest: 200)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def digest_artifact(
+    path: str,
+    file_type: str | None = None,
+    max_tokens: int = ARTIFACT_TOKEN_BUDGET,
+    token_counter: BaseTokenCounter | None = None,
+) -> str:
+    """
+    Return a prompt-ready digest of an artifact within max_tokens.
+
+    Cached by (content hash, kind, max_tokens). The hash itself is kept
+    per (path, size, mtime), so re-attaching an unchanged file costs a stat.
+    """
+    counter = token_counter or get_token_counter()
+    kind = artifact_kind(path, file_type)
+    key = (file_hash(path), kind, max_tokens, counter.name)
+
+    def compute() -> str:
+        if kind == "csv":
+            text = _digest_csv(path, "\t" if path.lower().endswith(".tsv") or "tab-separated" in (file_type or "") else ",")
+        elif kind == "html":
+            text = _digest_html(path, max_tokens)
+        elif kind == "pdf":
+            text = _digest_pdf(path, max_tokens, counter)
+        else:
+            text = _digest_text(path, max_tokens)
+        return counter.truncate(text, max_tokens)
+
+    return DIGEST_CACHE.get_or_compute(key, compute, len)
+
+
+class _ColumnStats:
+    __slots__ = ("count", "empty", "numeric", "total", "minimum", "maximum", "distinct", "max_length")
+
+    def __init__(self):
+        self.count = 0
+        self.empty = 0
+        self.numeric = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.distinct: set[str] | None = set()
+        self.max_length = 0
+
+    def add(self, value: str) -> None:
+        self.count += 1
+        value = value.strip()
+        if not value:
+            self.empty += 1
+            return
+        self.max_length = max(self.max_length, len(value))
+        if self.distinct is not None:
+            self.distinct.add(value)
+            if len(self.distinct) > DISTINCT_CAP:
+                self.distinct = None
+        try:
+            number = float(value)
+        except ValueError:
+            return
+        self.numeric += 1
+        self.total += number
+        self.minimum = number if self.minimum is None else min(self.minimum, number)
+        self.maximum = number if self.maximum is None else max(self.maximum, number)
+
+    def describe(self) -> str:
+        filled = self.count - self.empty
+        distinct = f"{DISTINCT_CAP}+" if self.distinct is None else str(len(self.distinct))
+        if filled and self.numeric == filled:
+            return (
+                f"numeric, min {self.minimum:g}, max {self.maximum:g}, mean {self.total / self.numeric:g}, "
+                f"{distinct} distinct, {self.empty} empty"
+            )
+        return f"text, {distinct} distinct, max length {self.max_length}, {self.empty} empty"
+
+
+def _count_lines(path: str) -> int:
+    size = os.path.getsize(path)
+    if not size:
+        return 0
+    with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        lines = 0
+        for start in range(0, size, CHUNK_BYTES):
+            lines += mapped[start:start + CHUNK_BYTES].count(b"\n")
+        if mapped[size - 1:size] != b"\n":
+            lines += 1
+        return lines
+
+
+def _digest_csv(path: str, delimiter: str) -> str:
+    with open(path, newline="", encoding="utf-8", errors="replace", buffering=CHUNK_BYTES) as handle:
+        reader = csv.reader(handle, delimiter=delimiter)
+        header = next(reader, None)
+        if header is None:
+            return "Empty CSV file."
+
+        stats = [_ColumnStats() for _ in header]
+        samples = []
+        scanned = 0
+        for row in reader:
+            if scanned >= STATS_MAX_ROWS:
+                break
+            scanned += 1
+            if len(samples) < SAMPLE_ROWS:
+                samples.append(row)
+            for column, value in zip(stats, row):
+                column.add(value)
+
+    total_rows = max(_count_lines(path) - 1, scanned)
+    approximate = "about " if scanned < total_rows else ""
+    lines = [f"CSV with {len(header)} columns and {approximate}{total_rows} rows."]
+    if scanned < total_rows:
+        lines.append(f"Statistics cover the first {scanned} rows.")
+    lines.append("Columns:")
+    lines.extend(f"- {name}: {column.describe()}" for name, column in zip(header, stats))
+    lines.append("Sample rows:")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(samples)
+    lines.append(buffer.getvalue().rstrip("\n"))
+    return "\n".join(lines)
+
+
+class _TextExtractor(HTMLParser):
+    _SKIP = {"script", "style", "noscript", "template", "svg"}
+    _BLOCKS = {"p", "div", "li", "tr", "br", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "table"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.chars = 0
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip_depth += 1
+        elif tag in self._BLOCKS:
+            self.parts.append("\n")
+            if tag[0] == "h" and tag[1:].isdigit():
+                self.parts.append("#" * int(tag[1:]) + " ")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        text = " ".join(data.split())
+        if text:
+            self.parts.append(text + " ")
+            self.chars += len(text) + 1
+
+
+def _digest_html(path: str, max_tokens: int) -> str:
+    # Stop reading once the extracted text comfortably exceeds the budget.
+    char_limit = max_tokens * 8
+    parser = _TextExtractor()
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        for chunk in iter(lambda: handle.read(HTML_CHUNK_CHARS), ""):
+            parser.feed(chunk)
+            if parser.chars >= char_limit:
+                break
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _digest_pdf(path: str, max_tokens: int, counter: BaseTokenCounter) -> str:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportError("pypdf package is required for PDF artifacts. Install with: pip install pypdf")
+
+    reader = PdfReader(path)
+    parts = [f"PDF with {len(reader.pages)} pages."]
+    used = counter.count(parts[0])
+    for number, page in enumerate(reader.pages, start=1):
+        text = " ".join((page.extract_text() or "").split())
+        if not text:
+            continue
+        parts.append(f"[page {number}] {text}")
+        used += counter.count(parts[-1])
+        if used >= max_tokens:
+            break
+    return "\n".join(parts)
+
+
+def _digest_text(path: str, max_tokens: int) -> str:
+    char_limit = max_tokens * 8
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        return handle.read(char_limit)
@@ -0,0 +1,105 @@
+"""
+Batch block diffing that keeps CPU-heavy pairs off the event loop.
+
+Small pairs are diffed inline until the batch has spent inline_max_chars
+of inline work; larger pairs and the rest of the batch are sent to a
+process pool, so neither a burst of large diffs nor a long batch of small
+ones can stall other requests.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Iterable
+
+from .diff_engine import compute_block_diff, compute_span_diff, encode_span_diff
+
+DEFAULT_INLINE_MAX_CHARS = 20_000
+
+
+def diff_pair(old_text: str, new_text: str, algorithm: str = "auto", output: str = "operations") -> dict[str, Any]:
+    """Diff one pair and return a JSON-serialisable result."""
+    if output == "spans":
+        return encode_span_diff(compute_span_diff(old_text, new_text, algorithm))
+    return compute_block_diff(old_text, new_text, algorithm)
+
+
+class BatchDiffRunner:
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        inline_max_chars: int = DEFAULT_INLINE_MAX_CHARS,
+    ):
+        self.max_workers = max_workers
+        self.inline_max_chars = inline_max_chars
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # spawn rather than fork: the server process runs threads, which
+        # must not be copied into worker processes mid-flight.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(
+        self,
+        pairs: Iterable[tuple[str, str]],
+        algorithm: str = "auto",
+        output: str = "operations",
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Diff every (old_text, new_text) pair and yield results in input order.
+
+        Pairs beyond the inline budget are submitted to the pool up front
+        so they run while earlier results are being yielded.
+        """
+        pairs = list(pairs)
+        pending: dict[int, Future] = {}
+        inline_chars = 0
+        for index, (old_text, new_text) in enumerate(pairs):
+            size = len(old_text) + len(new_text)
+            if inline_chars + size <= self.inline_max_chars:
+                inline_chars += size
+            else:
+                pending[index] = self._get_executor().submit(
+                    diff_pair, old_text, new_text, algorithm, output
+                )
+
+        try:
+            for index, (old_text, new_text) in enumerate(pairs):
+                future = pending.pop(index, None)
+                if future is not None:
+                    yield await asyncio.wrap_future(future)
+                else:
+                    yield diff_pair(old_text, new_text, algorithm, output)
+                    await asyncio.sleep(0)
+        finally:
+            for future in pending.values():
+                future.cancel()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_runner: BatchDiffRunner | None = None
+
+
+def get_batch_diff_runner() -> BatchDiffRunner:
+    global _runner
+    if _runner is None:
+        max_workers = os.getenv("DIFF_POOL_WORKERS")
+        _runner = BatchDiffRunner(max_workers=int(max_workers) if max_workers else None)
+    return _runner
+
+
+def shutdown_batch_diff_runner() -> None:
+    global _runner
+    if _runner is not None:
+        _runner.shutdown()
+        _runner = None
@@ -0,0 +1,246 @@
+"""
+Document-level block alignment for restructured reports.
+
+match_blocks pairs old blocks with new blocks even when they were moved or
+rewritten, so a reordered report shows up as moves and edits rather than
+mass deletes and inserts. Identical texts are paired by hash; the rest
+are compared through MinHash signatures of word shingles, vectorised with
+NumPy so 1,000 x 1,000 blocks needs no pairwise text comparisons.
+"""
+
+from bisect import bisect_left
+import re
+import zlib
+from typing import Any
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 64
+DEFAULT_THRESHOLD = 0.5
+
+# Upper bounds on temporary array sizes (elements) while hashing and comparing.
+_HASH_CHUNK_ELEMENTS = 4_000_000
+_COMPARE_CHUNK_ELEMENTS = 8_000_000
+
+_WORD_PATTERN = re.compile(r"\w+")
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_EMPTY = np.iinfo(np.uint32).max
+
+
+def match_blocks(
+    old_blocks: list[dict],
+    new_blocks: list[dict],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> dict[str, Any]:
+    """
+    Align old and new blocks by content.
+
+    Blocks are dicts with "blockId" and "markdownText", as in apply_diff.
+
+    Returns:
+    {
+        "matches": [
+            {"old_index", "new_index", "old_block_id", "new_block_id",
+             "similarity", "moved": bool, "rewritten": bool}
+        ],
+        "deleted": [old_index, ...],
+        "inserted": [new_index, ...],
+        "near_duplicates": [{"old_index", "new_index", "similarity"}]
+    }
+
+    similarity is an estimated Jaccard similarity of word shingles (1.0
+    for identical text). A match is "moved" when it falls outside the
+    longest run of matches that keep their relative order. near_duplicates
+    gives, for each block left unmatched, the best pair above threshold
+    it lost in the one-to-one assignment.
+    """
+    pairs = _match_identical(old_blocks, new_blocks)
+    matched_old = {i for i, _, _ in pairs}
+    matched_new = {j for _, j, _ in pairs}
+    remaining_old = [i for i in range(len(old_blocks)) if i not in matched_old]
+    remaining_new = [j for j in range(len(new_blocks)) if j not in matched_new]
+
+    near_duplicates = []
+    if remaining_old and remaining_new:
+        similarity = similarity_matrix(
+            [old_blocks[i]["markdownText"] for i in remaining_old],
+            [new_blocks[j]["markdownText"] for j in remaining_new],
+        )
+        assigned, extra = _assign(similarity, threshold, old_blocks, new_blocks, remaining_old, remaining_new)
+        pairs.extend(assigned)
+        near_duplicates = extra
+
+    pairs.sort()
+    in_order = _longest_increasing_run([j for _, j, _ in pairs])
+
+    matches = []
+    for position, (i, j, score) in enumerate(pairs):
+        matches.append({
+            "old_index": i,
+            "new_index": j,
+            "old_block_id": old_blocks[i].get("blockId"),
+            "new_block_id": new_blocks[j].get("blockId"),
+            "similarity": round(score, 3),
+            "moved": position not in in_order,
+            "rewritten": old_blocks[i]["markdownText"] != new_blocks[j]["markdownText"],
+        })
+
+    matched_old = {i for i, _, _ in pairs}
+    matched_new = {j for _, j, _ in pairs}
+    return {
+        "matches": matches,
+        "deleted": [i for i in range(len(old_blocks)) if i not in matched_old],
+        "inserted": [j for j in range(len(new_blocks)) if j not in matched_new],
+        "near_duplicates": near_duplicates,
+    }
+
+
+def minhash_signatures(texts: list[str]) -> np.ndarray:
+    """
+    Return a (len(texts), NUM_PERMUTATIONS) uint32 MinHash signature matrix.
+
+    Texts without any words get an all-max signature, which never agrees
+    with a real one.
+    """
+    shingle_hashes = [_shingle_hashes(text) for text in texts]
+    signatures = np.full((len(texts), NUM_PERMUTATIONS), _EMPTY, dtype=np.uint32)
+
+    chunk_start = 0
+    while chunk_start < len(texts):
+        chunk_end = chunk_start
+        chunk_size = 0
+        while chunk_end < len(texts) and (
+            chunk_end == chunk_start
+            or (chunk_size + len(shingle_hashes[chunk_end])) * NUM_PERMUTATIONS <= _HASH_CHUNK_ELEMENTS
+        ):
+            chunk_size += len(shingle_hashes[chunk_end])
+            chunk_end += 1
+
+        rows = [r for r in range(chunk_start, chunk_end) if shingle_hashes[r]]
+        if rows:
+            lengths = np.array([len(shingle_hashes[r]) for r in rows])
+            values = np.fromiter(
+                (h for r in rows for h in shingle_hashes[r]), dtype=np.uint64, count=int(lengths.sum())
+            )
+            # Multiply-shift hashing: uint64 arithmetic wraps, the top 32 bits are the hash.
+            hashed = ((_PERM_A[:, None] * values[None, :] + _PERM_B[:, None]) >> np.uint64(32)).astype(np.uint32)
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            signatures[rows] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        chunk_start = chunk_end
+
+    return signatures
+
+
+def similarity_matrix(old_texts: list[str], new_texts: list[str]) -> np.ndarray:
+    """Estimated Jaccard similarity of every old text against every new text."""
+    old_signatures = minhash_signatures(old_texts)
+    new_signatures = minhash_signatures(new_texts)
+    result = np.zeros((len(old_texts), len(new_texts)), dtype=np.float32)
+    if not old_texts or not new_texts:
+        return result
+
+    valid_new = new_signatures[:, 0] != _EMPTY
+    rows_per_chunk = max(1, _COMPARE_CHUNK_ELEMENTS // (len(new_texts) * NUM_PERMUTATIONS))
+    for start in range(0, len(old_texts), rows_per_chunk):
+        chunk = old_signatures[start:start + rows_per_chunk]
+        agree = (chunk[:, None, :] == new_signatures[None, :, :]).sum(axis=2)
+        result[start:start + rows_per_chunk] = agree / NUM_PERMUTATIONS
+    result[:, ~valid_new] = 0
+    result[old_signatures[:, 0] == _EMPTY, :] = 0
+    return result
+
+
+def _shingle_hashes(text: str) -> list[int]:
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = [" ".join(words[k:k + SHINGLE_SIZE]) for k in range(len(words) - SHINGLE_SIZE + 1)]
+    return list({zlib.crc32(shingle.encode("utf-8")) for shingle in shingles})
+
+
+def _match_identical(old_blocks: list[dict], new_blocks: list[dict]) -> list[tuple[int, int, float]]:
+    """Pair blocks with identical text, preferring the same blockId, then document order."""
+    by_text: dict[str, list[int]] = {}
+    for i, block in enumerate(old_blocks):
+        by_text.setdefault(block["markdownText"], []).append(i)
+
+    pairs = []
+    for j, block in enumerate(new_blocks):
+        candidates = by_text.get(block["markdownText"])
+        if not candidates:
+            continue
+        chosen = next(
+            (i for i in candidates if old_blocks[i].get("blockId") == block.get("blockId")),
+            candidates[0],
+        )
+        candidates.remove(chosen)
+        pairs.append((chosen, j, 1.0))
+    return pairs
+
+
+def _assign(similarity, threshold, old_blocks, new_blocks, old_indexes, new_indexes):
+    """Greedy one-to-one assignment, highest similarity first."""
+    rows, cols = np.nonzero(similarity >= threshold)
+    scores = similarity[rows, cols]
+    codes: dict = {}
+
+    def id_codes(blocks, indexes):
+        return np.array([codes.setdefault(blocks[i].get("blockId"), len(codes)) for i in indexes], dtype=np.int64)
+
+    same_id = id_codes(old_blocks, old_indexes)[rows] == id_codes(new_blocks, new_indexes)[cols]
+    order = np.lexsort((cols, rows, ~same_id, -scores))
+
+    used_rows: set[int] = set()
+    used_cols: set[int] = set()
+    assigned = []
+    # The first pair a block loses is its best one; keep only that, per block.
+    lost_by_row: dict[int, int] = {}
+    lost_by_col: dict[int, int] = {}
+    for k in order:
+        r, c = int(rows[k]), int(cols[k])
+        if r in used_rows or c in used_cols:
+            if r not in used_rows:
+                lost_by_row.setdefault(r, k)
+            if c not in used_cols:
+                lost_by_col.setdefault(c, k)
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        assigned.append((old_indexes[r], new_indexes[c], float(scores[k])))
+
+    # A block may lose a pair and still be matched later; report only blocks left unmatched.
+    lost = {k for r, k in lost_by_row.items() if r not in used_rows}
+    lost.update(k for c, k in lost_by_col.items() if c not in used_cols)
+    extra = [
+        {"old_index": old_indexes[int(rows[k])], "new_index": new_indexes[int(cols[k])],
+         "similarity": round(float(scores[k]), 3)}
+        for k in sorted(lost, key=lambda k: (int(rows[k]), int(cols[k])))
+    ]
+    return assigned, extra
+
+
+def _longest_increasing_run(values: list[int]) -> set[int]:
+    """Positions of one longest strictly increasing subsequence of values."""
+    tails: list[int] = []
+    tail_positions: list[int] = []
+    previous = [-1] * len(values)
+    for position, value in enumerate(values):
+        k = bisect_left(tails, value)
+        if k == len(tails):
+            tails.append(value)
+            tail_positions.append(position)
+        else:
+            tails[k] = value
+            tail_positions[k] = position
+        previous[position] = tail_positions[k - 1] if k else -1
+
+    result = set()
+    position = tail_positions[-1] if tail_positions else -1
+    while position != -1:
+        result.add(position)
+        position = previous[position]
+    return result
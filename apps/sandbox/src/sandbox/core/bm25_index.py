@@ -0,0 +1,140 @@
+"""
+In-process BM25 index over report blocks, one per project.
+
+Each block is indexed with its section title, so a question about "the
+conclusion" finds blocks under that heading even when their text never
+says so. sync() re-tokenizes only blocks whose content hash changed,
+keeping per-request upkeep proportional to what was edited.
+"""
+
+from collections import Counter, OrderedDict
+import math
+import re
+import threading
+
+from .content_cache import content_hash
+
+K1 = 1.2
+B = 0.75
+SECTION_TITLE_WEIGHT = 2
+MAX_PROJECT_INDEXES = 64
+
+_TERM_PATTERN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were will with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [term for term in _TERM_PATTERN.findall(text.lower()) if term not in _STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self):
+        self._docs: dict[str, tuple[str, Counter]] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._lengths: dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, block_id: str) -> bool:
+        return block_id in self._docs
+
+    def upsert(self, block_id: str, text: str, section_title: str = "") -> bool:
+        """Index a block; returns False if it was already indexed with this content."""
+        digest = content_hash(f"{section_title}\n{text}")
+        with self._lock:
+            current = self._docs.get(block_id)
+            if current is not None and current[0] == digest:
+                return False
+            if current is not None:
+                self._remove(block_id)
+
+            terms = Counter(tokenize(text))
+            for term in tokenize(section_title):
+                terms[term] += SECTION_TITLE_WEIGHT
+            self._docs[block_id] = (digest, terms)
+            length = sum(terms.values())
+            self._lengths[block_id] = length
+            self._total_length += length
+            for term, frequency in terms.items():
+                self._postings.setdefault(term, {})[block_id] = frequency
+            return True
+
+    def remove(self, block_id: str) -> None:
+        with self._lock:
+            if block_id in self._docs:
+                self._remove(block_id)
+
+    def sync(self, blocks: list[dict]) -> int:
+        """
+        Make the index hold exactly these blocks.
+
+        Blocks are dicts {id, content, section_title?}. Returns the number
+        of blocks that were (re)indexed or removed.
+        """
+        changed = 0
+        for block in blocks:
+            changed += self.upsert(block["id"], block.get("content", ""), block.get("section_title", ""))
+
+        live = {block["id"] for block in blocks}
+        with self._lock:
+            stale = [block_id for block_id in self._docs if block_id not in live]
+        for block_id in stale:
+            self.remove(block_id)
+            changed += 1
+        return changed
+
+    def scores(self, query: str) -> dict[str, float]:
+        """BM25 score of every block sharing at least one term with query."""
+        with self._lock:
+            count = len(self._docs)
+            if not count:
+                return {}
+            average_length = self._total_length / count
+
+            result: dict[str, float] = {}
+            for term, query_frequency in Counter(tokenize(query)).items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for block_id, frequency in postings.items():
+                    norm = K1 * (1 - B + B * self._lengths[block_id] / average_length)
+                    weight = idf * frequency * (K1 + 1) / (frequency + norm)
+                    result[block_id] = result.get(block_id, 0.0) + weight * query_frequency
+            return result
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        ranked = sorted(self.scores(query).items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def _remove(self, block_id: str) -> None:
+        _, terms = self._docs.pop(block_id)
+        self._total_length -= self._lengths.pop(block_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[block_id]
+            if not postings:
+                del self._postings[term]
+
+
+_project_indexes: OrderedDict[str, BM25Index] = OrderedDict()
+_project_lock = threading.Lock()
+
+
+def get_project_index(project_id: str) -> BM25Index:
+    """Return the index for a project, evicting the least recently used beyond MAX_PROJECT_INDEXES."""
+    with _project_lock:
+        index = _project_indexes.get(project_id)
+        if index is None:
+            index = _project_indexes[project_id] = BM25Index()
+            while len(_project_indexes) > MAX_PROJECT_INDEXES:
+                _project_indexes.popitem(last=False)
+        else:
+            _project_indexes.move_to_end(project_id)
+        return index
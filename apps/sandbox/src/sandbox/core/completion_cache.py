@@ -0,0 +1,331 @@
+"""
+Completion cache in front of BaseLLMClient.complete.
+
+Re-running a request on the same document revision (a retry, a forked
+thread, a second tab) sends the same prompt again. Completions are cached
+under a hash of the canonical JSON of the model, messages and request
+parameters, in two tiers: a ContentCache LRU in memory and a SQLite
+table on disk that survives restarts. Entries expire after a TTL, and the
+disk tier drops its least recently used entries beyond max_bytes.
+
+With normalize=True a second key, computed with whitespace runs in the
+message contents collapsed, also matches prompts that differ only in
+whitespace.
+"""
+
+import asyncio
+from contextlib import contextmanager
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from hashlib import sha256
+from typing import Any, AsyncIterator, Dict, Iterator
+
+from .content_cache import ContentCache
+from .llm_client import BaseLLMClient
+
+COMPLETION_CACHE_TTL = 24 * 60 * 60
+COMPLETION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def completion_key(
+    model: str, messages: list[Dict[str, Any]], params: dict | None = None, normalize: bool = False
+) -> str:
+    """Return the SHA-256 of the canonical JSON of a completion request."""
+    if normalize:
+        messages = [{**m, "content": _WHITESPACE.sub(" ", m["content"]).strip()} for m in messages]
+    canonical = json.dumps(
+        {"model": model, "messages": messages, "params": params or {}, "normalized": normalize},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return sha256(canonical.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Two-tier cache of completion texts with a TTL.
+
+    path is the SQLite file of the disk tier, or None to keep completions
+    in memory only. The disk tier keeps a running byte total in a row of
+    its own, updated in the same transaction as each store, so neither a
+    lookup nor a store scans the table and every worker sharing the file
+    enforces the same max_bytes. get and put work synchronously;
+    async callers use lookup and store, which run disk access in a
+    worker thread.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        ttl: float = COMPLETION_CACHE_TTL,
+        max_bytes: int = COMPLETION_CACHE_MAX_BYTES,
+        memory: ContentCache | None = None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory = memory or ContentCache(max_entries=512, max_bytes=32 * 1024 * 1024)
+        self.disk_hits = 0
+        self.disk_bytes = 0
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if path:
+            self._db = open_private_db(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_created ON completions (created)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS completion_totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            with _transaction(self._db):
+                self._db.execute(
+                    "INSERT OR IGNORE INTO completion_totals (name, value)"
+                    " SELECT 'bytes', COALESCE(SUM(size), 0) FROM completions"
+                )
+                self.disk_bytes = self._total_bytes()
+
+    def get(self, key: str) -> str | None:
+        text = self._memory_get(key)
+        if text is None and self._db is not None:
+            text = self._disk_get(key)
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        now = time.time()
+        self.memory.put(key, (text, now), _sizeof(text))
+        if self._db is not None:
+            self._disk_put(key, text, now)
+
+    async def lookup(self, key: str) -> str | None:
+        text = self._memory_get(key)
+        if text is None and self._db is not None:
+            text = await asyncio.to_thread(self._disk_get, key)
+        return text
+
+    async def store(self, key: str, text: str) -> None:
+        now = time.time()
+        self.memory.put(key, (text, now), _sizeof(text))
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_put, key, text, now)
+
+    def _memory_get(self, key: str) -> str | None:
+        entry = self.memory.get(key)
+        if entry is not None and time.time() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def _disk_get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT text, created FROM completions WHERE key = ? AND created > ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+            self.disk_hits += 1
+        text, created = row
+        self.memory.put(key, (text, created), _sizeof(text))
+        return text
+
+    def _disk_put(self, key: str, text: str, now: float) -> None:
+        size = _sizeof(text)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._db is None:
+                return
+            with _transaction(self._db):
+                previous = self._db.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions (key, text, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, text, size, now, now),
+                )
+                self._add_bytes(size - (previous[0] if previous else 0))
+                self._evict(now)
+                self.disk_bytes = self._total_bytes()
+
+    def _total_bytes(self) -> int:
+        (total,) = self._db.execute("SELECT value FROM completion_totals WHERE name = 'bytes'").fetchone()
+        return total
+
+    def _add_bytes(self, delta: int) -> None:
+        if delta:
+            self._db.execute("UPDATE completion_totals SET value = value + ? WHERE name = 'bytes'", (delta,))
+
+    def _evict(self, now: float) -> None:
+        # Runs in the store's write transaction, so the total is the one every worker sees.
+        # Both passes walk an index and stop early; neither scans the whole table.
+        cutoff = now - self.ttl
+        (expired,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM completions WHERE created <= ?", (cutoff,)
+        ).fetchone()
+        if expired:
+            self._db.execute("DELETE FROM completions WHERE created <= ?", (cutoff,))
+            self._add_bytes(-expired)
+        excess = self._total_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM completions ORDER BY accessed"):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM completions WHERE key = ?", stale)
+        self._add_bytes(-(self._total_bytes() - self.max_bytes - excess))
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self._db is not None:
+            with self._lock, _transaction(self._db):
+                self._db.execute("DELETE FROM completions")
+                self._db.execute("UPDATE completion_totals SET value = 0 WHERE name = 'bytes'")
+                self.disk_bytes = 0
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        disk = {"entries": 0, "bytes": self.disk_bytes}
+        if self._db is not None:
+            with self._lock:
+                (disk["entries"],) = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()
+                disk["bytes"] = self.disk_bytes = self._total_bytes()
+        return {
+            "memory": self.memory.stats(),
+            "disk": {**disk, "max_bytes": self.max_bytes, "hits": self.disk_hits, "enabled": self._db is not None},
+            "ttl": self.ttl,
+        }
+
+
+def _sizeof(text: str) -> int:
+    return len(text) + 64
+
+
+@contextmanager
+def _transaction(db: sqlite3.Connection) -> Iterator[None]:
+    """Run the block in one write transaction, taking the database's write lock up front."""
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+class CachedLLMClient(BaseLLMClient):
+    """
+    Serve completions of client from a CompletionCache.
+
+    A lookup tries the exact key, then the normalized key when normalize
+    is set. Completions are stored, under both keys, only once the caller
+    accepts them (see BaseLLMClient.accept), so a reply the caller could
+    not use is generated afresh next time rather than replayed. Streams
+    from the cache yield the whole completion at once.
+    """
+
+    def __init__(self, client: BaseLLMClient, cache: CompletionCache, normalize: bool = False):
+        self.client = client
+        self.cache = cache
+        self.normalize = normalize
+        self.model = f"{type(client).__name__}:{getattr(client, 'model', '')}"
+
+    def _keys(self, messages: list[Dict[str, Any]]) -> list[str]:
+        keys = [completion_key(self.model, messages)]
+        if self.normalize:
+            keys.append(completion_key(self.model, messages, normalize=True))
+        return keys
+
+    async def _lookup(self, keys: list[str]) -> str | None:
+        for key in keys:
+            text = await self.cache.lookup(key)
+            if text is not None:
+                return text
+        return None
+
+    async def _store(self, keys: list[str], text: str) -> None:
+        for key in keys:
+            await self.cache.store(key, text)
+
+    async def complete(self, messages: list[Dict[str, str]]) -> str:
+        keys = self._keys(messages)
+        text = await self._lookup(keys)
+        if text is None:
+            text = await self.client.complete(messages)
+        return text
+
+    async def stream(self, messages: list[Dict[str, str]]) -> AsyncIterator[str]:
+        keys = self._keys(messages)
+        text = await self._lookup(keys)
+        if text is not None:
+            yield text
+            return
+        async for chunk in self.client.stream(messages):
+            yield chunk
+
+    async def accept(self, messages: list[Dict[str, str]], reply: str) -> None:
+        await self._store(self._keys(messages), reply)
+        await self.client.accept(messages, reply)
+
+
+def completion_cache_dir() -> str:
+    return os.getenv("COMPLETION_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "sandbox-completion-cache")
+
+
+def open_private_db(path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database in WAL mode, readable by this user only.
+
+    The databases hold document text, so the directory is created 0700
+    and the file 0600; SQLite gives its WAL files the same mode.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)  # makedirs leaves an existing directory's mode alone
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(path, 0o600)
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+def completion_cache_from_env() -> CompletionCache | None:
+    """
+    Build the cache configured by COMPLETION_CACHE ("disk", the default, "memory" or "off").
+
+    The disk tier lives in COMPLETION_CACHE_DIR; COMPLETION_CACHE_TTL
+    (seconds) and COMPLETION_CACHE_MAX_BYTES bound it.
+    """
+    mode = os.getenv("COMPLETION_CACHE", "disk")
+    if mode == "off":
+        return None
+    path = os.path.join(completion_cache_dir(), "completions.sqlite3") if mode == "disk" else None
+    ttl = os.getenv("COMPLETION_CACHE_TTL")
+    max_bytes = os.getenv("COMPLETION_CACHE_MAX_BYTES")
+    return CompletionCache(
+        path,
+        ttl=float(ttl) if ttl else COMPLETION_CACHE_TTL,
+        max_bytes=int(max_bytes) if max_bytes else COMPLETION_CACHE_MAX_BYTES,
+    )
+
+
+def normalize_enabled() -> bool:
+    return os.getenv("COMPLETION_CACHE_NORMALIZE") == "1"
@@ -0,0 +1,88 @@
+"""
+Bounded in-memory caches keyed by content hashes.
+
+Convex re-sends the same block texts on every turn, so derived data
+(tokens, diffs) is cached under a hash of the text rather than an ID.
+"""
+
+from collections import OrderedDict
+from hashlib import blake2b
+from typing import Any, Callable, Hashable
+import threading
+
+
+def content_hash(text: str) -> str:
+    """Return a short, stable hex digest of text."""
+    return blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class ContentCache:
+    """
+    Thread-safe LRU cache bounded by entry count and estimated byte size.
+
+    Callers pass the size of each value when storing it; values bigger
+    than max_bytes on their own are not cached.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], Any], sizeof: Callable[[Any], int]
+    ) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, sizeof(value))
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
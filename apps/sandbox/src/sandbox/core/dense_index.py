@@ -0,0 +1,359 @@
+"""
+Local dense retrieval over blocks, complementing the BM25 index.
+
+Texts are embedded without a model: character n-grams are hashed and
+projected onto EMBEDDING_DIM dimensions with a sparse random projection
+(each n-gram adds a signed weight to a few hashed dimensions), so
+inflections and partial rewordings ("declined" / "decline in") still
+land close together. Vectors are unit length and are persisted per
+project as a float32 matrix with a JSON sidecar of IDs and content
+hashes, so a restarted sandbox only re-embeds blocks that changed.
+
+The vectors file is append-only: a flush appends the rows that changed
+since the last one and rewrites the sidecar, which maps each ID to its
+row in the file. Once dead rows outnumber live ones the file is
+compacted into a new file that is renamed into place. Workers sharing
+DENSE_INDEX_DIR each keep a private copy in memory and flush under a
+file lock; a worker that finds the file was compacted by another one
+compacts its own copy in turn, so the sidecar only names rows that
+exist.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Iterator
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: flushes are still atomic per file, but not paired
+    fcntl = None
+
+import numpy as np
+
+from .content_cache import content_hash
+
+EMBEDDING_DIM = 256  # a power of two, at most 2**8 for PROJECTIONS_PER_NGRAM = 4
+NGRAM_SIZES = (3, 4, 5)
+PROJECTIONS_PER_NGRAM = 4
+DENSE_WEIGHT = 0.5
+MAX_PROJECT_INDEXES = 64
+
+# Bump when the embedding changes so persisted vectors are rebuilt.
+EMBEDDING_VERSION = 1
+
+_NON_WORD = re.compile(r"[\W_]+")
+_DIM_BITS = EMBEDDING_DIM.bit_length() - 1
+_rng = np.random.default_rng(0xD15C)
+_PROJ_A = _rng.integers(1, 2**63, dtype=np.uint64) | np.uint64(1)
+_PROJ_B = _rng.integers(0, 2**63, dtype=np.uint64)
+_GRAM_BASE = np.uint64(1_000_003)
+_INITIAL_CAPACITY = 64
+_ROW_BYTES = EMBEDDING_DIM * 4
+# Dead rows tolerated in the vectors file beyond one per live row.
+_COMPACT_SLACK = 256
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """Return a (len(texts), EMBEDDING_DIM) float32 matrix of unit vectors (zero for empty text)."""
+    grams = [_ngram_hashes(text) for text in texts]
+    lengths = np.fromiter((len(g) for g in grams), dtype=np.intp, count=len(texts))
+    flat = np.zeros(len(texts) * EMBEDDING_DIM, dtype=np.float64)
+    if lengths.sum():
+        # One multiply-shift hash per n-gram; its top 32 bits give the
+        # PROJECTIONS_PER_NGRAM dimensions and the next bits their signs.
+        hashed = np.concatenate(grams) * _PROJ_A + _PROJ_B
+        high = (hashed >> np.uint64(32)).astype(np.uint32)
+        low = hashed.astype(np.uint32)
+        row_offsets = np.repeat(np.arange(len(texts), dtype=np.intp) * EMBEDDING_DIM, lengths)
+        for k in range(PROJECTIONS_PER_NGRAM):
+            indexes = row_offsets + ((high >> np.uint32(_DIM_BITS * k)) & np.uint32(EMBEDDING_DIM - 1))
+            signs = np.where(low & np.uint32(1 << (31 - k)), -1.0, 1.0)
+            flat += np.bincount(indexes, weights=signs, minlength=flat.size)
+
+    vectors = flat.reshape(len(texts), EMBEDDING_DIM).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def combine_scores(lexical: dict[str, float], dense: dict[str, float], dense_weight: float = DENSE_WEIGHT) -> dict[str, float]:
+    """
+    Blend BM25 and cosine scores into one ranking score per ID.
+
+    BM25 scores are scaled by their maximum so both lie in [0, 1];
+    negative cosines count as 0.
+    """
+    top = max(lexical.values(), default=0.0) or 1.0
+    return {
+        item_id: (1 - dense_weight) * lexical.get(item_id, 0.0) / top
+        + dense_weight * max(dense.get(item_id, 0.0), 0.0)
+        for item_id in lexical.keys() | dense.keys()
+    }
+
+
+class DenseIndex:
+    def __init__(self, path: str | None = None):
+        """
+        Create an index, loading it from path if it was persisted there.
+
+        Without a path the vectors are kept in memory only.
+        """
+        self.path = path
+        self._ids: list[str] = []
+        self._hashes: list[str] = []
+        self._rows: dict[str, int] = {}
+        # Row in the vectors file of each ID whose current vector was flushed.
+        self._file_rows: dict[str, int] = {}
+        self._generation: str | None = None
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((_INITIAL_CAPACITY, EMBEDDING_DIM), dtype=np.float32)
+        if path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._rows
+
+    def sync(self, items: list[dict]) -> int:
+        """
+        Make the index hold exactly these items.
+
+        Items are dicts {id, content, section_title?}, as for BM25Index.sync.
+        Only new or changed items are embedded, in one batch. Returns the
+        number of items embedded or removed; the index is persisted when
+        that is non-zero.
+        """
+        texts = {item["id"]: f"{item.get('section_title', '')}\n{item.get('content', '')}" for item in items}
+        hashes = {item_id: content_hash(text) for item_id, text in texts.items()}
+
+        embedded: dict[str, np.ndarray] = {}
+        while True:
+            # What to change is decided under the lock that applies it, so
+            # concurrent syncs never remove or embed an item twice.
+            with self._lock:
+                changed = [
+                    item_id for item_id, digest in hashes.items()
+                    if item_id not in self._rows or self._hashes[self._rows[item_id]] != digest
+                ]
+                missing = [item_id for item_id in changed if item_id not in embedded]
+                if not missing:
+                    stale = [item_id for item_id in self._ids if item_id not in hashes]
+                    self._apply(stale, changed, embedded, hashes)
+                    return len(changed) + len(stale)
+            embedded.update(zip(missing, embed_texts([texts[item_id] for item_id in missing])))
+
+    def _apply(
+        self, stale: list[str], changed: list[str], vectors: dict[str, np.ndarray], hashes: dict[str, str]
+    ) -> None:
+        for item_id in stale:
+            self._remove(item_id)
+        for item_id in changed:
+            row = self._rows.get(item_id)
+            if row is None:
+                row = len(self._ids)
+                self._reserve(row + 1)
+                self._ids.append(item_id)
+                self._hashes.append("")
+                self._rows[item_id] = row
+            self._vectors[row] = vectors[item_id]
+            self._hashes[row] = hashes[item_id]
+            self._file_rows.pop(item_id, None)
+        if (changed or stale) and self.path:
+            self._flush()
+
+    def scores(self, query: str) -> dict[str, float]:
+        """Cosine similarity of query to every item."""
+        [result] = self.search_batch([query], limit=None)
+        return dict(result)
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        return self.search_batch([query], limit)[0]
+
+    def search_batch(self, queries: list[str], limit: int | None = 10) -> list[list[tuple[str, float]]]:
+        """Top-limit (id, cosine) pairs per query, best first; limit=None returns all items."""
+        query_vectors = embed_texts(queries)
+        with self._lock:
+            count = len(self._ids)
+            similarities = query_vectors @ self._vectors[:count].T
+            ids = list(self._ids)
+
+        k = count if limit is None else min(limit, count)
+        results = []
+        for row in similarities:
+            if k < count:
+                top = np.argpartition(-row, k - 1)[:k]
+            else:
+                top = np.arange(count)
+            top = top[np.argsort(-row[top], kind="stable")]
+            results.append([(ids[i], float(row[i])) for i in top])
+        return results
+
+    def _remove(self, item_id: str) -> None:
+        # Keep rows dense by moving the last row into the freed slot.
+        row = self._rows.pop(item_id, None)
+        if row is None:
+            return
+        self._file_rows.pop(item_id, None)
+        last = len(self._ids) - 1
+        if row != last:
+            moved = self._ids[last]
+            self._vectors[row] = self._vectors[last]
+            self._ids[row] = moved
+            self._hashes[row] = self._hashes[last]
+            self._rows[moved] = row
+        self._ids.pop()
+        self._hashes.pop()
+
+    def _reserve(self, rows: int) -> None:
+        capacity = len(self._vectors)
+        if rows <= capacity:
+            return
+        while capacity < rows:
+            capacity *= 2
+        grown = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+        grown[:len(self._ids)] = self._vectors[:len(self._ids)]
+        self._vectors = grown
+
+    def _load(self) -> None:
+        vectors_path = os.path.join(self.path, "vectors.f32")
+        with _file_lock(self.path, exclusive=False):
+            meta = _read_meta(os.path.join(self.path, "meta.json"))
+            try:
+                file_length = os.path.getsize(vectors_path) // _ROW_BYTES
+            except OSError:
+                return
+            if meta is None or not meta["ids"]:
+                return
+            file_rows = meta.get("rows") or list(range(len(meta["ids"])))
+            if len(file_rows) != len(meta["ids"]) or max(file_rows) >= file_length:
+                return
+            stored = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(file_length, EMBEDDING_DIM))
+            self._vectors = np.array(stored[file_rows])
+            del stored
+        self._ids = list(meta["ids"])
+        self._hashes = list(meta["hashes"])
+        self._rows = {item_id: row for row, item_id in enumerate(self._ids)}
+        self._file_rows = dict(zip(self._ids, file_rows))
+        self._generation = meta.get("generation")
+
+    def _flush(self) -> None:
+        """Append rows changed since the last flush, compacting the file when it is mostly dead rows."""
+        vectors_path = os.path.join(self.path, "vectors.f32")
+        meta_path = os.path.join(self.path, "meta.json")
+        with _file_lock(self.path, exclusive=True):
+            stored = _read_meta(meta_path)
+            try:
+                file_length = os.path.getsize(vectors_path) // _ROW_BYTES
+            except OSError:
+                file_length = 0
+            if (
+                stored is None
+                or self._generation is None
+                or stored.get("generation") != self._generation
+                or file_length > 2 * len(self._ids) + _COMPACT_SLACK
+            ):
+                self._generation = uuid.uuid4().hex
+                _replace(vectors_path, self._vectors[:len(self._ids)].tobytes())
+                self._file_rows = {item_id: row for row, item_id in enumerate(self._ids)}
+            else:
+                dirty = [row for row, item_id in enumerate(self._ids) if item_id not in self._file_rows]
+                with open(vectors_path, "r+b") as handle:
+                    # Seek rather than append, overwriting any torn row a crash left behind.
+                    handle.seek(file_length * _ROW_BYTES)
+                    handle.write(self._vectors[dirty].tobytes())
+                for offset, row in enumerate(dirty):
+                    self._file_rows[self._ids[row]] = file_length + offset
+            meta = {
+                "version": EMBEDDING_VERSION,
+                "dim": EMBEDDING_DIM,
+                "generation": self._generation,
+                "ids": self._ids,
+                "hashes": self._hashes,
+                "rows": [self._file_rows[item_id] for item_id in self._ids],
+            }
+            _replace(meta_path, json.dumps(meta).encode("utf-8"))
+
+
+def _read_meta(path: str) -> dict | None:
+    try:
+        with open(path) as handle:
+            meta = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != EMBEDDING_VERSION or meta.get("dim") != EMBEDDING_DIM:
+        return None
+    return meta
+
+
+@contextmanager
+def _file_lock(directory: str, exclusive: bool) -> Iterator[None]:
+    """Hold a lock on directory's lock file across processes (where fcntl exists)."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "lock"), "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _replace(path: str, data: bytes) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _ngram_hashes(text: str) -> np.ndarray:
+    normalized = f" {_NON_WORD.sub(' ', text.lower()).strip()} "
+    if len(normalized) <= 2:
+        return np.empty(0, dtype=np.uint64)
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+    grams = []
+    for size in NGRAM_SIZES:
+        count = len(codes) - size + 1
+        if count <= 0:
+            continue
+        hashed = np.full(count, size, dtype=np.uint64)
+        for offset in range(size):
+            hashed = hashed * _GRAM_BASE + codes[offset:offset + count]
+        grams.append(hashed)
+    return np.concatenate(grams) if grams else np.empty(0, dtype=np.uint64)
+
+
+def default_index_dir() -> str:
+    return os.getenv("DENSE_INDEX_DIR") or os.path.join(tempfile.gettempdir(), "sandbox-dense-index")
+
+
+_project_indexes: OrderedDict[str, DenseIndex] = OrderedDict()
+_project_lock = threading.Lock()
+
+
+def get_project_dense_index(project_id: str) -> DenseIndex:
+    """Return the persisted index for a project, evicting the least recently used beyond MAX_PROJECT_INDEXES."""
+    with _project_lock:
+        index = _project_indexes.get(project_id)
+        if index is None:
+            path = os.path.join(default_index_dir(), content_hash(project_id))
+            index = _project_indexes[project_id] = DenseIndex(path)
+            while len(_project_indexes) > MAX_PROJECT_INDEXES:
+                _project_indexes.popitem(last=False)
+        else:
+            _project_indexes.move_to_end(project_id)
+        return index
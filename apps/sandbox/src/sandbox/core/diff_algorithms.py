@@ -0,0 +1,433 @@
+"""
+Sequence diff algorithms used by the diff engine.
+
+Every algorithm takes two sequences of hashable items (usually Markdown
+tokens) and returns SequenceMatcher-style opcodes, so callers can swap
+engines without changing how they consume the result. diff_tokens
+tokenizes two Markdown texts and diffs them, caching the opcodes; the
+diff engine and the three-way merge both build on it.
+"""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Hashable, Sequence
+import difflib
+
+from .content_cache import ContentCache, content_hash
+from .markdown_ast import parse_markdown
+
+Opcode = tuple[str, int, int, int, int]
+MatchingBlock = tuple[int, int, int]
+
+# Inputs with at most this many items (old + new) are diffed with Myers,
+# which gives minimal edit scripts; anything larger goes to histogram diff.
+AUTO_MYERS_MAX_ITEMS = 4000
+
+# Texts with more tokens than this (old + new) are diffed line-first.
+TWO_TIER_MIN_TOKENS = 2000
+
+# Rough per-item overhead used to size cache entries in bytes.
+_OPCODE_OVERHEAD_BYTES = 120
+
+DIFF_CACHE = ContentCache(max_entries=4096, max_bytes=32 * 1024 * 1024)
+
+
+class BaseDiffAlgorithm(ABC):
+    name: str = ""
+
+    @abstractmethod
+    def matching_blocks(
+        self, a: Sequence[Hashable], b: Sequence[Hashable]
+    ) -> list[MatchingBlock]:
+        """Return sorted, non-overlapping (i, j, size) runs where a and b agree."""
+        pass
+
+    def opcodes(self, a: Sequence[Hashable], b: Sequence[Hashable]) -> list[Opcode]:
+        """Return (tag, i1, i2, j1, j2) opcodes, as difflib.SequenceMatcher does."""
+        return opcodes_from_matching_blocks(self.matching_blocks(a, b), len(a), len(b))
+
+
+class SequenceMatcherDiff(BaseDiffAlgorithm):
+    """
+    difflib.SequenceMatcher, kept for comparison and as a fallback.
+
+    autojunk is disabled: with it on, frequent tokens such as single spaces
+    are silently ignored once a block passes 200 tokens, which produces
+    poor alignments.
+    """
+
+    name = "difflib"
+
+    def matching_blocks(self, a, b):
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+        return [tuple(block) for block in matcher.get_matching_blocks() if block.size]
+
+
+class MyersDiff(BaseDiffAlgorithm):
+    """
+    Myers' O(ND) diff with the linear-space middle-snake refinement.
+
+    Produces a minimal edit script. When a sub-problem needs more than
+    max_edit_cost edits it is treated as a plain replacement, which bounds
+    the running time on completely unrelated inputs.
+    """
+
+    name = "myers"
+
+    def __init__(self, max_edit_cost: int = 2000):
+        self.max_edit_cost = max_edit_cost
+
+    def matching_blocks(self, a, b):
+        blocks: list[MatchingBlock] = []
+        stack = [(0, len(a), 0, len(b))]
+
+        while stack:
+            a_lo, a_hi, b_lo, b_hi = stack.pop()
+            a_lo, a_hi, b_lo, b_hi = _strip_common(a, b, a_lo, a_hi, b_lo, b_hi, blocks)
+            if a_lo == a_hi or b_lo == b_hi:
+                continue
+
+            split = _bisect(a, b, a_lo, a_hi, b_lo, b_hi, self.max_edit_cost)
+            if split is None:
+                continue
+
+            x, y = split
+            stack.append((a_lo, x, b_lo, y))
+            stack.append((x, a_hi, y, b_hi))
+
+        return merge_matching_blocks(blocks)
+
+
+class HistogramDiff(BaseDiffAlgorithm):
+    """
+    Histogram diff, as used by git and JGit.
+
+    Anchors each region on the rarest items shared by both sides, which
+    keeps common tokens (whitespace, punctuation) from driving the
+    alignment and runs in roughly linear time on typical edits. Regions
+    whose shared items are all more frequent than max_chain fall back to
+    Myers.
+    """
+
+    name = "histogram"
+
+    def __init__(self, max_chain: int = 64, fallback: MyersDiff | None = None):
+        self.max_chain = max_chain
+        self.fallback = fallback or MyersDiff()
+
+    def matching_blocks(self, a, b):
+        blocks: list[MatchingBlock] = []
+        stack = [(0, len(a), 0, len(b))]
+
+        while stack:
+            a_lo, a_hi, b_lo, b_hi = stack.pop()
+            a_lo, a_hi, b_lo, b_hi = _strip_common(a, b, a_lo, a_hi, b_lo, b_hi, blocks)
+            if a_lo == a_hi or b_lo == b_hi:
+                continue
+
+            anchor = self._find_anchor(a, b, a_lo, a_hi, b_lo, b_hi)
+            if anchor is None:
+                continue
+            if anchor == "fallback":
+                for i, j, size in self.fallback.matching_blocks(a[a_lo:a_hi], b[b_lo:b_hi]):
+                    blocks.append((a_lo + i, b_lo + j, size))
+                continue
+
+            i, j, size = anchor
+            blocks.append(anchor)
+            stack.append((a_lo, i, b_lo, j))
+            stack.append((i + size, a_hi, j + size, b_hi))
+
+        return merge_matching_blocks(blocks)
+
+    def _find_anchor(self, a, b, a_lo, a_hi, b_lo, b_hi):
+        positions: dict[Hashable, list[int]] = {}
+        for i in range(a_lo, a_hi):
+            positions.setdefault(a[i], []).append(i)
+
+        best = None
+        best_count = self.max_chain + 1
+        best_size = 0
+        has_common = False
+
+        j = b_lo
+        while j < b_hi:
+            next_j = j + 1
+            occurrences = positions.get(b[j])
+            if occurrences is not None:
+                has_common = True
+                if len(occurrences) <= best_count:
+                    for i in occurrences:
+                        start_a, start_b = i, j
+                        count = len(occurrences)
+                        while (
+                            start_a > a_lo
+                            and start_b > b_lo
+                            and a[start_a - 1] == b[start_b - 1]
+                        ):
+                            start_a -= 1
+                            start_b -= 1
+                            count = min(count, len(positions[a[start_a]]))
+                        end_a, end_b = i + 1, j + 1
+                        while end_a < a_hi and end_b < b_hi and a[end_a] == b[end_b]:
+                            count = min(count, len(positions[a[end_a]]))
+                            end_a += 1
+                            end_b += 1
+
+                        size = end_a - start_a
+                        if count < best_count or (count == best_count and size > best_size):
+                            best = (start_a, start_b, size)
+                            best_count = count
+                            best_size = size
+                        next_j = max(next_j, end_b)
+            j = next_j
+
+        if best is not None:
+            return best
+        if has_common:
+            return "fallback"
+        return None
+
+
+DIFF_ALGORITHMS: dict[str, type[BaseDiffAlgorithm]] = {
+    SequenceMatcherDiff.name: SequenceMatcherDiff,
+    MyersDiff.name: MyersDiff,
+    HistogramDiff.name: HistogramDiff,
+}
+
+
+def get_diff_algorithm(
+    name: str = "auto", old_size: int = 0, new_size: int = 0
+) -> BaseDiffAlgorithm:
+    """
+    Look up a diff algorithm by name.
+
+    "auto" picks Myers for small inputs and histogram diff for large ones,
+    based on the combined number of items being compared.
+    """
+    if name == "auto":
+        name = MyersDiff.name if old_size + new_size <= AUTO_MYERS_MAX_ITEMS else HistogramDiff.name
+
+    algorithm_cls = DIFF_ALGORITHMS.get(name)
+    if algorithm_cls is None:
+        raise ValueError(
+            f"Unknown diff algorithm '{name}'. "
+            f"Expected one of: auto, {', '.join(sorted(DIFF_ALGORITHMS))}"
+        )
+    return algorithm_cls()
+
+
+def opcodes_from_matching_blocks(
+    blocks: list[MatchingBlock], a_len: int, b_len: int
+) -> list[Opcode]:
+    opcodes: list[Opcode] = []
+    i = j = 0
+    for a_start, b_start, size in blocks + [(a_len, b_len, 0)]:
+        if i < a_start and j < b_start:
+            opcodes.append(("replace", i, a_start, j, b_start))
+        elif i < a_start:
+            opcodes.append(("delete", i, a_start, j, b_start))
+        elif j < b_start:
+            opcodes.append(("insert", i, a_start, j, b_start))
+        if size:
+            opcodes.append(("equal", a_start, a_start + size, b_start, b_start + size))
+        i, j = a_start + size, b_start + size
+    return opcodes
+
+
+def _strip_common(a, b, a_lo, a_hi, b_lo, b_hi, blocks):
+    """Record the common prefix and suffix of a region and return what is left."""
+    start = a_lo
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        a_lo += 1
+        b_lo += 1
+    if a_lo > start:
+        blocks.append((start, b_lo - (a_lo - start), a_lo - start))
+
+    end = a_hi
+    while a_hi > a_lo and b_hi > b_lo and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+    if a_hi < end:
+        blocks.append((a_hi, b_hi, end - a_hi))
+
+    return a_lo, a_hi, b_lo, b_hi
+
+
+def _bisect(a, b, a_lo, a_hi, b_lo, b_hi, max_edit_cost):
+    """
+    Find the middle snake of a[a_lo:a_hi] vs b[b_lo:b_hi].
+
+    Returns the absolute (x, y) split point, or None when no split is found
+    within max_edit_cost edits.
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_d = min((n + m + 1) // 2, max_edit_cost)
+    v_offset = max_d + 1
+    v_length = 2 * v_offset + 1
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    k1_start = k1_end = k2_start = k2_end = 0
+
+    for d in range(max_d):
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return a_lo + x1, b_lo + y1
+
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return a_lo + x1, b_lo + y1
+
+    return None
+
+
+def merge_matching_blocks(blocks: list[MatchingBlock]) -> list[MatchingBlock]:
+    merged: list[MatchingBlock] = []
+    for i, j, size in sorted(blocks):
+        if merged:
+            last_i, last_j, last_size = merged[-1]
+            if last_i + last_size == i and last_j + last_size == j:
+                merged[-1] = (last_i, last_j, last_size + size)
+                continue
+        merged.append((i, j, size))
+    return merged
+
+
+def diff_tokens(
+    old_text: str, new_text: str, algorithm: str, two_tier: bool | None = None
+) -> tuple[tuple[str, ...], tuple[str, ...], tuple[Opcode, ...]]:
+    """
+    Tokenize both texts and diff them, reusing cached results.
+
+    Both caches are keyed by content hashes, so repeated (old, new) pairs
+    skip tokenizing and diffing entirely.
+    """
+    old_hash = content_hash(old_text)
+    new_hash = content_hash(new_text)
+    old_tokens = _cached_tokens(old_text, old_hash)
+    new_tokens = _cached_tokens(new_text, new_hash)
+    if two_tier is None:
+        two_tier = len(old_tokens) + len(new_tokens) > TWO_TIER_MIN_TOKENS
+
+    def compute_opcodes():
+        old_ids, new_ids = _intern_tokens(old_tokens, new_tokens)
+        if two_tier:
+            blocks = _two_tier_matching_blocks(
+                old_text, new_text, old_tokens, new_tokens, old_ids, new_ids, algorithm
+            )
+            return tuple(opcodes_from_matching_blocks(blocks, len(old_ids), len(new_ids)))
+        engine = get_diff_algorithm(algorithm, len(old_ids), len(new_ids))
+        return tuple(engine.opcodes(old_ids, new_ids))
+
+    opcodes = DIFF_CACHE.get_or_compute(
+        (old_hash, new_hash, algorithm, two_tier),
+        compute_opcodes,
+        lambda opcodes: _OPCODE_OVERHEAD_BYTES * (len(opcodes) + 1),
+    )
+    return old_tokens, new_tokens, opcodes
+
+
+def _two_tier_matching_blocks(
+    old_text: str,
+    new_text: str,
+    old_tokens: Sequence[str],
+    new_tokens: Sequence[str],
+    old_ids: list[int],
+    new_ids: list[int],
+    algorithm: str,
+) -> list[MatchingBlock]:
+    """
+    Match tokens by diffing lines first, then words inside changed hunks.
+
+    Unchanged lines become token anchors when the tokens inside them line
+    up exactly (whitespace runs can straddle line breaks, so edge tokens
+    are left to the word-level pass). Only the gaps between anchors are
+    diffed token by token.
+    """
+    old_lines = old_text.splitlines(keepends=True)
+    new_lines = new_text.splitlines(keepends=True)
+    old_line_ids, new_line_ids = _intern_tokens(old_lines, new_lines)
+    line_engine = get_diff_algorithm(algorithm, len(old_line_ids), len(new_line_ids))
+
+    old_line_offsets = list(accumulate(map(len, old_lines), initial=0))
+    new_line_offsets = list(accumulate(map(len, new_lines), initial=0))
+    old_offsets = list(accumulate(map(len, old_tokens), initial=0))
+    new_offsets = list(accumulate(map(len, new_tokens), initial=0))
+
+    anchors: list[MatchingBlock] = []
+    for line_i, line_j, size in line_engine.matching_blocks(old_line_ids, new_line_ids):
+        i1 = bisect_left(old_offsets, old_line_offsets[line_i])
+        i2 = bisect_right(old_offsets, old_line_offsets[line_i + size]) - 1
+        j1 = bisect_left(new_offsets, new_line_offsets[line_j])
+        j2 = bisect_right(new_offsets, new_line_offsets[line_j + size]) - 1
+        if i2 > i1 and i2 - i1 == j2 - j1 and old_ids[i1:i2] == new_ids[j1:j2]:
+            anchors.append((i1, j1, i2 - i1))
+
+    blocks: list[MatchingBlock] = []
+    i = j = 0
+    for anchor_i, anchor_j, size in anchors + [(len(old_ids), len(new_ids), 0)]:
+        if anchor_i > i and anchor_j > j:
+            engine = get_diff_algorithm(algorithm, anchor_i - i, anchor_j - j)
+            for bi, bj, bsize in engine.matching_blocks(old_ids[i:anchor_i], new_ids[j:anchor_j]):
+                blocks.append((i + bi, j + bj, bsize))
+        if size:
+            blocks.append((anchor_i, anchor_j, size))
+        i, j = anchor_i + size, anchor_j + size
+
+    return merge_matching_blocks(blocks)
+
+
+def _cached_tokens(text: str, text_hash: str) -> tuple[str, ...]:
+    return parse_markdown(text, text_hash).tokens
+
+
+def _intern_tokens(*token_lists: Sequence[str]) -> list[list[int]]:
+    """
+    Map tokens to small integer ids shared across all the given lists.
+
+    Diff engines then compare and hash ints instead of strings.
+    """
+    ids: dict[str, int] = {}
+    return [[ids.setdefault(token, len(ids)) for token in tokens] for tokens in token_lists]
@@ -1,12 +1,43 @@
-from typing import List, Dict, Any
-import difflib
-import re
+from itertools import accumulate
+from typing import List, Dict, Any, NamedTuple, Optional
 
+from .diff_algorithms import DIFF_CACHE, TWO_TIER_MIN_TOKENS, diff_tokens
+from .markdown_ast import MARKDOWN_CACHE
+from .merge import MergeConflictError, merge_three_way
 
-def compute_block_diff(old_text: str, new_text: str) -> Dict[str, Any]:
+SPAN_WIRE_CODES = {"keep": "=", "delete": "-", "add": "+"}
+SPAN_WIRE_TYPES = {code: span_type for span_type, code in SPAN_WIRE_CODES.items()}
+
+# Tokens are kept with the rest of each text's parsed Markdown.
+TOKEN_CACHE = MARKDOWN_CACHE
+
+
+class DiffSpan(NamedTuple):
+    """A run of consecutive tokens with the same operation, as character offsets."""
+
+    type: str
+    old_start: int
+    old_end: int
+    new_start: int
+    new_end: int
+
+
+def compute_block_diff(
+    old_text: str,
+    new_text: str,
+    algorithm: str = "auto",
+    two_tier: bool | None = None,
+) -> Dict[str, Any]:
     """
     Compute word-level diff between old and new text.
     
+    algorithm selects the diff engine ("myers", "histogram", "difflib");
+    "auto" picks one based on the number of tokens.
+    
+    two_tier diffs lines first and words only inside changed lines, so
+    cost follows the size of the change rather than the block. None
+    enables it for blocks above TWO_TIER_MIN_TOKENS tokens.
+    
     Returns:
     {
         "old_text": str,
@@ -18,14 +49,11 @@ def compute_block_diff(old_text: str, new_text: str) -> Dict[str, Any]:
     
     Preserves markdown structure (headings, lists, code blocks).
     """
-    old_tokens = _tokenize_markdown(old_text)
-    new_tokens = _tokenize_markdown(new_text)
-    
-    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens)
+    old_tokens, new_tokens, opcodes = diff_tokens(old_text, new_text, algorithm, two_tier)
     operations = []
     position = 0
     
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == 'equal':
             for token in old_tokens[i1:i2]:
                 operations.append({
@@ -73,31 +101,209 @@ def compute_block_diff(old_text: str, new_text: str) -> Dict[str, Any]:
     }
 
 
+def compute_span_diff(
+    old_text: str,
+    new_text: str,
+    algorithm: str = "auto",
+    two_tier: bool | None = None,
+) -> Dict[str, Any]:
+    """
+    Compute word-level diff between old and new text as runs of spans.
+    
+    Same tokenization and engines as compute_block_diff, but each run of
+    kept, deleted or added tokens becomes one DiffSpan pointing into
+    old_text/new_text instead of one dict per token.
+    
+    Returns:
+    {
+        "old_text": str,
+        "new_text": str,
+        "spans": [DiffSpan(type, old_start, old_end, new_start, new_end)]
+    }
+    """
+    old_tokens, new_tokens, opcodes = diff_tokens(old_text, new_text, algorithm, two_tier)
+    old_offsets = list(accumulate(map(len, old_tokens), initial=0))
+    new_offsets = list(accumulate(map(len, new_tokens), initial=0))
+    spans = []
+    
+    for tag, i1, i2, j1, j2 in opcodes:
+        old_start, old_end = old_offsets[i1], old_offsets[i2]
+        new_start, new_end = new_offsets[j1], new_offsets[j2]
+        if tag == 'equal':
+            spans.append(DiffSpan("keep", old_start, old_end, new_start, new_end))
+            continue
+        if tag in ('delete', 'replace'):
+            spans.append(DiffSpan("delete", old_start, old_end, new_start, new_start))
+        if tag in ('insert', 'replace'):
+            spans.append(DiffSpan("add", old_end, old_end, new_start, new_end))
+    
+    return {
+        "old_text": old_text,
+        "new_text": new_text,
+        "spans": spans
+    }
+
+
+def diff_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Hit/miss/size counters for the tokenization and diff caches."""
+    return {
+        "tokens": TOKEN_CACHE.stats(),
+        "diffs": DIFF_CACHE.stats()
+    }
+
+
+def encode_span_diff(diff: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Encode a span diff into its compact wire format.
+    
+    Offsets are implied by the order of the spans, so each span is sent
+    as [code, length] with code "=" (keep), "-" (delete) or "+" (add).
+    """
+    spans = []
+    for span in diff["spans"]:
+        length = span.old_end - span.old_start if span.type != "add" else span.new_end - span.new_start
+        spans.append([SPAN_WIRE_CODES[span.type], length])
+    
+    return {
+        "old_text": diff["old_text"],
+        "new_text": diff["new_text"],
+        "spans": spans
+    }
+
+
+def decode_span_diff(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild DiffSpan offsets from the wire format produced by encode_span_diff."""
+    spans = []
+    old_pos = new_pos = 0
+    
+    for code, length in payload["spans"]:
+        span_type = SPAN_WIRE_TYPES.get(code)
+        if span_type is None:
+            raise ValueError(f"Unknown span code '{code}'")
+        old_len = length if span_type != "add" else 0
+        new_len = length if span_type != "delete" else 0
+        spans.append(DiffSpan(span_type, old_pos, old_pos + old_len, new_pos, new_pos + new_len))
+        old_pos += old_len
+        new_pos += new_len
+    
+    if old_pos != len(payload["old_text"]) or new_pos != len(payload["new_text"]):
+        raise ValueError("Span lengths do not match old_text/new_text")
+    
+    return {
+        "old_text": payload["old_text"],
+        "new_text": payload["new_text"],
+        "spans": spans
+    }
+
+
 def apply_diff(original_blocks: List[Dict], proposed_edits: List[Dict]) -> List[Dict]:
     """
     Apply proposed edits to original blocks.
     
     Args:
         original_blocks: List of block dicts {blockId, markdownText, ...}
-        proposed_edits: List of {blockId, newMarkdownText}
+        proposed_edits: List of {blockId, newMarkdownText?, patches?, baseMarkdownText?}
     
     Returns:
         Updated blocks list
     
-    Validates that blockIds exist before applying.
+    Validates that blockIds exist before applying. When an edit carries
+    the baseMarkdownText it was written against and the block has changed
+    since, the edit is rebased with a three-way merge; MergeConflictError
+    is raised if the changes overlap. Edits may give patches (see
+    apply_edit_patch) instead of, or ahead of, newMarkdownText; they are
+    applied to the text the edit was written against, falling back to
+    newMarkdownText if they do not apply. No block is modified if any
+    edit fails.
     """
     blocks_map = {block["blockId"]: block for block in original_blocks}
+    new_texts = {}
     
     for edit in proposed_edits:
         block_id = edit.get("blockId")
         if block_id not in blocks_map:
             raise ValueError(f"Block ID '{block_id}' not found in original blocks")
         
-        blocks_map[block_id]["markdownText"] = edit["newMarkdownText"]
+        current_text = new_texts.get(block_id, blocks_map[block_id]["markdownText"])
+        base_text = edit.get("baseMarkdownText")
+        new_text = edit.get("newMarkdownText")
+        if edit.get("patches"):
+            target = current_text if base_text is None else base_text
+            try:
+                new_text = apply_edit_patch(target, edit["patches"])
+            except PatchApplyError:
+                if new_text is None:
+                    raise
+        if new_text is None:
+            raise ValueError(f"Edit for block ID '{block_id}' has no newMarkdownText or patches")
+        if base_text is not None and base_text != current_text:
+            merge = merge_three_way(base_text, current_text, new_text)
+            if not merge["clean"]:
+                raise MergeConflictError(block_id, merge["conflicts"])
+            new_text = merge["merged_text"]
+        
+        new_texts[block_id] = new_text
+    
+    for block_id, new_text in new_texts.items():
+        blocks_map[block_id]["markdownText"] = new_text
     
     return [blocks_map[block["blockId"]] for block in original_blocks]
 
 
+class PatchApplyError(ValueError):
+    """Raised when a patch edit does not apply cleanly to the block text."""
+
+
+def apply_edit_patch(original_text: str, patches: List[Dict[str, str]]) -> str:
+    """
+    Apply anchored search/replace patches to a block's text.
+    
+    Args:
+        original_text: The block text the patches were written against
+        patches: List of {search, replace}, applied in order
+    
+    Returns:
+        The patched text
+    
+    Each search string must occur exactly once in the text as left by the
+    previous patches, so a stale or ambiguous anchor raises PatchApplyError
+    instead of editing the wrong place.
+    """
+    text = original_text
+    for index, patch in enumerate(patches):
+        search = patch.get("search")
+        replace = patch.get("replace")
+        if not isinstance(search, str) or not search or not isinstance(replace, str):
+            raise PatchApplyError(f"Patch {index} needs a non-empty 'search' and a 'replace' string")
+        
+        start = text.find(search)
+        if start == -1:
+            raise PatchApplyError(f"Patch {index} search text not found")
+        if text.find(search, start + 1) != -1:
+            raise PatchApplyError(f"Patch {index} search text matches more than once")
+        text = text[:start] + replace + text[start + len(search):]
+    return text
+
+
+def resolve_edit_text(original_text: str, edit: Dict[str, Any]) -> Optional[str]:
+    """
+    Return the new block text for an agent edit in the response schema.
+    
+    Edits carry either "patches" (see apply_edit_patch) or the full
+    "content". Patches are tried first; if they do not apply cleanly the
+    full content is used when present. Returns None when neither gives a
+    text, so the caller can ask for a full replacement.
+    """
+    patches = edit.get("patches")
+    if patches:
+        try:
+            return apply_edit_patch(original_text, patches)
+        except PatchApplyError:
+            pass
+    content = edit.get("content")
+    return content if isinstance(content, str) else None
+
+
 def format_diff_for_display(diff: Dict) -> str:
     """
     Format diff for human-readable display.
@@ -106,10 +312,26 @@ def format_diff_for_display(diff: Dict) -> str:
     - [+added text+]
     - [-deleted text-]
     
+    Accepts per-token operations, DiffSpan spans or the span wire format;
+    spans are marked once per run rather than once per token.
+    
     Returns formatted string.
     """
     result = []
     
+    if "spans" in diff:
+        if diff["spans"] and not isinstance(diff["spans"][0], DiffSpan):
+            diff = decode_span_diff(diff)
+        old_text, new_text = diff["old_text"], diff["new_text"]
+        for span in diff["spans"]:
+            if span.type == "keep":
+                result.append(old_text[span.old_start:span.old_end])
+            elif span.type == "add":
+                result.append(f"[+{new_text[span.new_start:span.new_end]}+]")
+            elif span.type == "delete":
+                result.append(f"[-{old_text[span.old_start:span.old_end]}-]")
+        return "".join(result)
+    
     for op in diff["operations"]:
         if op["type"] == "keep":
             result.append(op["text"])
@@ -119,29 +341,3 @@ def format_diff_for_display(diff: Dict) -> str:
             result.append(f"[-{op['text']}-]")
     
     return "".join(result)
-
-
-def _tokenize_markdown(text: str) -> List[str]:
-    """
-    Tokenize markdown text preserving structure.
-    
-    Splits on word boundaries but keeps markdown tokens intact:
-    - Headings (#, ##, ###, etc.)
-    - List markers (-, *, 1., etc.)
-    - Code blocks (```, ```)
-    - Inline code (`code`)
-    - Links, emphasis, etc.
-    """
-    if not text:
-        return []
-    
-    tokens = []
-    pattern = r'(\s+|```|`|#{1,6}\s|^\s*[-*+]\s|^\s*\d+\.\s|\[.*?\]\(.*?\)|\*\*|__|\*|_|~~)'
-    
-    parts = re.split(pattern, text, flags=re.MULTILINE)
-    
-    for part in parts:
-        if part:
-            tokens.append(part)
-    
-    return tokens
@@ -0,0 +1,204 @@
+"""
+Server-side report state so callers can send block deltas instead of the
+whole report on every agent run.
+
+A document is stored per project or thread at a revision. A delta names
+the revision it was computed against, the blocks added or changed and the
+blocks removed; it applies in time proportional to its size. Block
+hashes are SHA-256 hex digests of the Markdown text (available as
+crypto.subtle in Convex), and the document hash is the XOR of
+SHA-256("{blockId}\\n{sectionId}\\n{order}\\n{blockHash}") over all blocks,
+so both sides can maintain it incrementally. Orders are Convex numbers
+and may be fractional; they are written as JavaScript's String(order)
+writes them. Any mismatch raises DocumentResyncRequired and the caller
+sends the full context again.
+"""
+
+from collections import OrderedDict
+from decimal import Decimal
+import hashlib
+import math
+import threading
+
+MAX_DOCUMENTS = 256
+
+_ZERO_HASH = bytes(32)
+
+
+class DocumentResyncRequired(Exception):
+    """Raised when a delta cannot be applied and the full document must be resent."""
+
+
+def block_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def js_number_string(value: float) -> str:
+    """Format a number as JavaScript's String(value) does (1, 0.5, 1e-7, 1e+21)."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "0"
+    sign = "-" if value < 0 else ""
+    # repr gives the shortest round-tripping digits, as JavaScript does.
+    _, digits, exponent = Decimal(repr(abs(float(value)))).normalize().as_tuple()
+    digits = "".join(map(str, digits))
+    point = len(digits) + exponent  # digits before the decimal point
+    if len(digits) <= point <= 21:
+        return sign + digits + "0" * (point - len(digits))
+    if 0 < point <= 21:
+        return sign + digits[:point] + "." + digits[point:]
+    if -6 < point <= 0:
+        return sign + "0." + "0" * -point + digits
+    mantissa = digits[0] + ("." + digits[1:] if len(digits) > 1 else "")
+    return f"{sign}{mantissa}e{'+' if point > 0 else '-'}{abs(point - 1)}"
+
+
+def _entry_digest(block: dict) -> bytes:
+    order = js_number_string(block["order"])
+    entry = f"{block['id']}\n{block.get('section_id') or ''}\n{order}\n{block['content_hash']}"
+    return hashlib.sha256(entry.encode("utf-8")).digest()
+
+
+def _xor(a: bytes, b: bytes) -> bytes:
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).to_bytes(32, "big")
+
+
+class Document:
+    def __init__(self, revision: str, sections: list[dict]):
+        self.revision = revision
+        self.sections = sections
+        self.blocks: dict[str, dict] = {}
+        self._digest = _ZERO_HASH
+        self._ordered: list[dict] | None = None
+        self._max_order = -1
+
+    @property
+    def document_hash(self) -> str:
+        return self._digest.hex()
+
+    def upsert(self, block: dict) -> None:
+        """Add or replace a block, checking its content_hash when given."""
+        text = block["markdown_text"]
+        digest = block_hash(text)
+        if block.get("content_hash") and block["content_hash"] != digest:
+            raise DocumentResyncRequired(f"Content hash mismatch for block '{block['id']}'")
+
+        current = self.blocks.get(block["id"])
+        order = block.get("order")
+        if order is None:
+            order = current["order"] if current else self._max_order + 1
+        self._max_order = max(self._max_order, order)
+        if current:
+            self._digest = _xor(self._digest, _entry_digest(current))
+
+        stored = {"id": block["id"], "markdown_text": text, "section_id": block.get("section_id"),
+                  "order": order, "content_hash": digest}
+        self.blocks[block["id"]] = stored
+        self._digest = _xor(self._digest, _entry_digest(stored))
+        self._ordered = None
+
+    def remove(self, block_id: str) -> None:
+        current = self.blocks.pop(block_id, None)
+        if current is None:
+            raise DocumentResyncRequired(f"Block '{block_id}' is not in the stored document")
+        self._digest = _xor(self._digest, _entry_digest(current))
+        self._ordered = None
+
+    def set_sections(self, sections: list[dict]) -> None:
+        self.sections = sections
+        self._ordered = None
+
+    def ordered_blocks(self) -> list[dict]:
+        """Blocks in document order: by section position, then order."""
+        if self._ordered is None:
+            section_position = {section["id"]: i for i, section in enumerate(self.sections)}
+            self._ordered = sorted(
+                self.blocks.values(),
+                key=lambda block: (section_position.get(block["section_id"], len(section_position)), block["order"]),
+            )
+        return self._ordered
+
+
+class DocumentStore:
+    def __init__(self, max_documents: int = MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self._documents: OrderedDict[str, Document] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def get(self, key: str) -> Document | None:
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+            return document
+
+    def put(self, key: str, revision: str, sections: list[dict], blocks: list[dict]) -> Document:
+        """
+        Store a full document, replacing any earlier one for key.
+
+        Blocks are dicts {id, markdown_text, section_id?, order?, content_hash?};
+        a missing order is the block's position in the list.
+        """
+        document = Document(revision, sections)
+        for position, block in enumerate(blocks):
+            document.upsert(block if block.get("order") is not None else {**block, "order": position})
+
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        return document
+
+    def apply_delta(
+        self,
+        key: str,
+        base_revision: str,
+        revision: str,
+        upserted_blocks: list[dict],
+        removed_block_ids: list[str],
+        sections: list[dict] | None = None,
+        document_hash: str | None = None,
+    ) -> Document:
+        """
+        Apply a delta computed against base_revision and move to revision.
+
+        Raises DocumentResyncRequired when no document is stored at
+        base_revision, a block hash does not match its text, a removed
+        block is unknown, or the resulting document_hash differs; the
+        stored document is then dropped.
+        """
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None or document.revision != base_revision:
+                raise DocumentResyncRequired(f"No document stored at revision '{base_revision}'")
+
+            try:
+                for block_id in removed_block_ids:
+                    document.remove(block_id)
+                for block in upserted_blocks:
+                    document.upsert(block)
+                if sections is not None:
+                    document.set_sections(sections)
+                if document_hash is not None and document.document_hash != document_hash:
+                    raise DocumentResyncRequired("Document hash mismatch after applying delta")
+            except DocumentResyncRequired:
+                del self._documents[key]
+                raise
+
+            document.revision = revision
+            self._documents.move_to_end(key)
+            return document
+
+
+_store = DocumentStore()
+
+
+def get_document_store() -> DocumentStore:
+    return _store
@@ -0,0 +1,104 @@
+"""
+Section-parallel agent runs for whole-report requests.
+
+A report is split into parts, one per section, with sections larger than
+the token budget split further into runs of consecutive blocks. Each part
+is prompted on its own, at most FAN_OUT_CONCURRENCY at a time, so the
+wall-clock time follows the largest part rather than the whole report.
+Results are merged in document order regardless of completion order.
+"""
+
+import asyncio
+import os
+from typing import Awaitable, Callable, NamedTuple, TypeVar
+
+from .token_counter import BaseTokenCounter, count_tokens, get_token_counter
+
+FAN_OUT_CONCURRENCY = 4
+
+T = TypeVar("T")
+
+
+class PartResult(NamedTuple):
+    title: str | None
+    message: str
+    edits: dict[str, str]
+
+
+def fan_out_concurrency() -> int:
+    value = os.getenv("FAN_OUT_CONCURRENCY")
+    return int(value) if value else FAN_OUT_CONCURRENCY
+
+
+def split_context(context: dict, max_tokens: int, token_counter: BaseTokenCounter | None = None) -> list[dict]:
+    """
+    Split a context into per-section parts of at most max_tokens of block text.
+
+    Parts keep the context's other keys, list only their own section, and
+    come in document order: blocks outside any listed section first, then
+    each section's blocks. A block larger than max_tokens is a part of its
+    own. Sections without blocks produce no part.
+    """
+    counter = token_counter or get_token_counter()
+    sections = context.get("sections", [])
+    grouped: dict[str | None, list[dict]] = {None: []}
+    grouped.update((section.get("id"), []) for section in sections)
+    for block in context.get("blocks", []):
+        section_id = block.get("section_id")
+        grouped[section_id if section_id in grouped else None].append(block)
+
+    parts = []
+    for section in [None, *sections]:
+        section_id = section.get("id") if section else None
+        chunk, used = [], 0
+        for block in grouped[section_id]:
+            tokens = count_tokens(block.get("content", ""), counter)
+            if chunk and used + tokens > max_tokens:
+                parts.append(_part(context, section, chunk))
+                chunk, used = [], 0
+            chunk.append(block)
+            used += tokens
+        if chunk:
+            parts.append(_part(context, section, chunk))
+    return parts
+
+
+def _part(context: dict, section: dict | None, blocks: list[dict]) -> dict:
+    return {
+        **context,
+        "sections": [section] if section else [],
+        "blocks": blocks,
+        "anchor_section_id": section.get("id") if section else None,
+    }
+
+
+async def gather_limited(tasks: list[Callable[[], Awaitable[T]]], limit: int) -> list[T]:
+    """Run task factories with at most limit running at once; results keep the task order."""
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(task: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            return await task()
+
+    return await asyncio.gather(*(run(task) for task in tasks))
+
+
+def merge_results(results: list[PartResult]) -> tuple[str, dict[str, str]]:
+    """
+    Merge part results into one agent message and one set of edits.
+
+    Messages are joined in part order under their section titles, with
+    consecutive repeats from one section collapsed. Parts cover disjoint
+    blocks, so edits are combined as they are.
+    """
+    lines: list[str] = []
+    edits: dict[str, str] = {}
+    previous = None
+    for result in results:
+        edits.update(result.edits)
+        message = result.message.strip()
+        if not message or (result.title, message) == previous:
+            continue
+        previous = (result.title, message)
+        lines.append(f"{result.title}: {message}" if result.title else message)
+    return "\n\n".join(lines), edits
@@ -0,0 +1,153 @@
+"""
+Bounded conversation history for agent prompts.
+
+The latest messages of a thread are sent verbatim; older ones are folded
+into a rolling summary written by the LLM. Summaries are stored per
+thread together with a hash of the messages they cover (the history
+revision), so each turn only summarizes newly folded messages, and an
+edited or truncated thread falls back to summarizing from scratch.
+Folding happens in batches so most turns reuse the stored summary and
+keep the prompt prefix stable. Messages are summarized in chunks of at
+most SUMMARY_CHUNK_TOKENS, each folded into the running summary, so
+even a whole long thread (after a restart, say) never makes a
+summarization request larger than the model's context.
+"""
+
+from collections import OrderedDict
+import threading
+from typing import Iterator, NamedTuple
+
+from .content_cache import content_hash
+from .llm_client import BaseLLMClient
+from .token_counter import BaseTokenCounter, count_tokens, get_token_counter
+
+KEEP_MESSAGES = 8
+FOLD_BATCH = 4
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_CHUNK_TOKENS = 6000
+MAX_THREADS = 1024
+
+# Role markers and separators the providers add around each message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_INSTRUCTIONS = f"""You maintain a running summary of a conversation between a user and an AI assistant editing a research report.
+
+Update the summary with the new messages. Keep decisions, requested changes, open questions and any constraints the user stated; drop pleasantries. Write plain prose under {SUMMARY_MAX_TOKENS * 3 // 4} words and return only the summary."""
+
+
+class HistoryWindow(NamedTuple):
+    summary: str | None
+    messages: list[dict]
+    tokens: int
+
+
+class _RollingSummary(NamedTuple):
+    folded_count: int
+    folded_hash: str
+    summary: str
+
+
+class HistoryManager:
+    def __init__(
+        self,
+        keep_messages: int = KEEP_MESSAGES,
+        fold_batch: int = FOLD_BATCH,
+        max_threads: int = MAX_THREADS,
+        token_counter: BaseTokenCounter | None = None,
+        chunk_tokens: int = SUMMARY_CHUNK_TOKENS,
+    ):
+        self.keep_messages = keep_messages
+        self.fold_batch = fold_batch
+        self.max_threads = max_threads
+        self.chunk_tokens = chunk_tokens
+        self.token_counter = token_counter
+        self._summaries: OrderedDict[str, _RollingSummary] = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def window(
+        self, thread_id: str, messages: list[dict], llm: BaseLLMClient, max_tokens: int
+    ) -> HistoryWindow:
+        """
+        Fit a thread's messages into max_tokens.
+
+        Returns the rolling summary of folded messages (None if nothing is
+        folded), the messages to send verbatim, and the tokens both use.
+        The latest message is always kept verbatim.
+        """
+        counter = self.token_counter or get_token_counter()
+        messages = [msg for msg in messages if msg.get("content")]
+        sizes = [count_tokens(msg["content"], counter) + MESSAGE_OVERHEAD_TOKENS for msg in messages]
+
+        boundary, summary = 0, None
+        with self._lock:
+            state = self._summaries.get(thread_id)
+        if state and state.folded_count <= len(messages) and _history_hash(messages[:state.folded_count]) == state.folded_hash:
+            boundary, summary = state.folded_count, state.summary
+
+        summary_tokens = count_tokens(summary, counter) if summary else 0
+        if len(messages) - boundary > self.keep_messages + self.fold_batch or (
+            summary_tokens + sum(sizes[boundary:]) > max_tokens
+        ):
+            new_boundary = max(boundary, len(messages) - self.keep_messages)
+            tail_budget = max_tokens - SUMMARY_MAX_TOKENS
+            tail_tokens = sum(sizes[new_boundary:])
+            while new_boundary < len(messages) - 1 and tail_tokens > tail_budget:
+                tail_tokens -= sizes[new_boundary]
+                new_boundary += 1
+
+            if new_boundary > boundary:
+                for start, end in self._chunks(sizes, boundary, new_boundary):
+                    summary = await self._summarize(llm, summary, messages[start:end], counter)
+                    boundary = end
+                    # Stored per chunk, so a failed request keeps the chunks already folded.
+                    self._store(thread_id, _RollingSummary(boundary, _history_hash(messages[:boundary]), summary))
+                summary_tokens = count_tokens(summary, counter)
+
+        return HistoryWindow(summary, messages[boundary:], summary_tokens + sum(sizes[boundary:]))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._summaries.clear()
+
+    def _chunks(self, sizes: list[int], start: int, end: int) -> Iterator[tuple[int, int]]:
+        """Split messages start..end into runs of at most chunk_tokens (a longer message runs alone)."""
+        chunk_start, chunk_tokens = start, 0
+        for k in range(start, end):
+            if k > chunk_start and chunk_tokens + sizes[k] > self.chunk_tokens:
+                yield chunk_start, k
+                chunk_start, chunk_tokens = k, 0
+            chunk_tokens += sizes[k]
+        yield chunk_start, end
+
+    async def _summarize(
+        self, llm: BaseLLMClient, summary: str | None, folded: list[dict], counter: BaseTokenCounter
+    ) -> str:
+        transcript = "\n\n".join(
+            f"{msg.get('role', 'user')}: {counter.truncate(msg['content'], self.chunk_tokens)}" for msg in folded
+        )
+        messages = [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+        ]
+        reply = await llm.complete(messages)
+        if reply.strip():
+            await llm.accept(messages, reply)
+        return counter.truncate(reply.strip(), SUMMARY_MAX_TOKENS)
+
+    def _store(self, thread_id: str, state: _RollingSummary) -> None:
+        with self._lock:
+            self._summaries[thread_id] = state
+            self._summaries.move_to_end(thread_id)
+            while len(self._summaries) > self.max_threads:
+                self._summaries.popitem(last=False)
+
+
+def _history_hash(messages: list[dict]) -> str:
+    return content_hash("\x00".join(f"{msg.get('role')}\x01{msg['content']}" for msg in messages))
+
+
+_manager = HistoryManager()
+
+
+def get_history_manager() -> HistoryManager:
+    return _manager
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict
 import os
 
 
@@ -8,9 +8,25 @@ class BaseLLMClient(ABC):
     async def complete(self, messages: list[Dict[str, str]]) -> str:
         pass
 
+    async def stream(self, messages: list[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        Yield the completion as text deltas while it is generated.
+
+        The deltas joined together equal what complete() returns. Clients
+        without native streaming yield the whole completion at once.
+        """
+        yield await self.complete(messages)
+
+    async def accept(self, messages: list[Dict[str, str]], reply: str) -> None:
+        """
+        Report that reply to messages was usable.
+
+        Caching clients store only accepted replies; others ignore this.
+        """
+
 
 class OpenAIClient(BaseLLMClient):
-    def __init__(self, api_key: str | None = None, model: str = "gpt-4"):
+    def __init__(self, api_key: str | None = None, model: str = "gpt-4", http_client: Any = None):
         try:
             from openai import AsyncOpenAI
         except ImportError:
@@ -25,20 +41,35 @@ class OpenAIClient(BaseLLMClient):
         self.client = AsyncOpenAI(
             api_key=self.api_key,
             default_headers={"OpenAI-Organization": "user-" + self.api_key[:8]},
+            **({"http_client": http_client} if http_client is not None else {}),
         )
         self.model = model
 
     async def complete(self, messages: list[Dict[str, str]]) -> str:
+        # OpenAI caches identical prompt prefixes automatically; only role and content are sent.
         response = await self.client.chat.completions.create(
             model=self.model,
-            messages=messages,
+            messages=[{"role": m["role"], "content": m["content"]} for m in messages],
             extra_body={"store": False},
         )
         return response.choices[0].message.content
 
+    async def stream(self, messages: list[Dict[str, str]]) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": m["role"], "content": m["content"]} for m in messages],
+            extra_body={"store": False},
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
 
 class AnthropicClient(BaseLLMClient):
-    def __init__(self, api_key: str | None = None, model: str = "claude-3-5-sonnet-20241022"):
+    def __init__(
+        self, api_key: str | None = None, model: str = "claude-3-5-sonnet-20241022", http_client: Any = None
+    ):
         try:
             from anthropic import AsyncAnthropic
         except ImportError:
@@ -55,20 +86,88 @@ class AnthropicClient(BaseLLMClient):
         self.client = AsyncAnthropic(
             api_key=self.api_key,
             default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+            **({"http_client": http_client} if http_client is not None else {}),
         )
         self.model = model
 
     async def complete(self, messages: list[Dict[str, str]]) -> str:
-        system_messages = [m for m in messages if m["role"] == "system"]
-        conversation_messages = [m for m in messages if m["role"] != "system"]
-
-        system_content = "\n\n".join(m["content"] for m in system_messages)
+        system, conversation = _to_anthropic_messages(messages)
 
         response = await self.client.messages.create(
             model=self.model,
-            system=system_content if system_content else None,
-            messages=conversation_messages,
+            messages=conversation,
             max_tokens=4096,
+            **({"system": system} if system else {}),
         )
 
         return response.content[0].text
+
+    async def stream(self, messages: list[Dict[str, str]]) -> AsyncIterator[str]:
+        system, conversation = _to_anthropic_messages(messages)
+
+        async with self.client.messages.stream(
+            model=self.model,
+            messages=conversation,
+            max_tokens=4096,
+            **({"system": system} if system else {}),
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+
+def _to_anthropic_messages(messages: list[Dict[str, Any]]) -> tuple[list[dict], list[dict]]:
+    """
+    Split messages into Anthropic system blocks and conversation messages.
+
+    Messages marked with the prompt builder's "cache" key get an ephemeral
+    cache_control breakpoint, so the prefix up to them is cached.
+    """
+    system = []
+    conversation = []
+    for message in messages:
+        block: dict[str, Any] = {"type": "text", "text": message["content"]}
+        if message.get("cache"):
+            block["cache_control"] = {"type": "ephemeral"}
+        if message["role"] == "system":
+            system.append(block)
+        else:
+            conversation.append({"role": message["role"], "content": [block]})
+    return system, conversation
+
+
+def resolve_provider(provider: str | None = None) -> str:
+    """
+    Return the provider named by provider or the LLM_PROVIDER env var.
+
+    Without either, the first configured API key wins and "fake" is used
+    if none is set.
+    """
+    provider = (provider or os.getenv("LLM_PROVIDER") or "").lower()
+    if provider:
+        return provider
+    if os.getenv("OPENAI_API_KEY"):
+        return "openai"
+    if os.getenv("ANTHROPIC_API_KEY"):
+        return "anthropic"
+    return "fake"
+
+
+def create_llm_client(provider: str | None = None, http_client: Any = None) -> BaseLLMClient:
+    """
+    Create the LLM client named by provider or the LLM_PROVIDER env var.
+
+    Providers are "openai", "anthropic" and "fake". http_client, when
+    given, is the httpx client the provider SDK sends its requests through.
+    """
+    provider = resolve_provider(provider)
+    model = os.getenv("LLM_MODEL")
+    options = {"model": model} if model else {}
+    if provider == "openai":
+        return OpenAIClient(http_client=http_client, **options)
+    if provider == "anthropic":
+        return AnthropicClient(http_client=http_client, **options)
+    if provider == "fake":
+        from ..test_doubles.fake_llm import FakeLLM
+
+        return FakeLLM()
+    raise ValueError(f"Unknown LLM provider: {provider}")
@@ -0,0 +1,199 @@
+"""
+Application-scoped LLM clients sharing pooled HTTP connections.
+
+Provider SDK clients are built once per process and send their requests
+through one httpx client per provider, so connections (and their TLS
+sessions) are kept alive and reused across agent runs. The pool is sized
+by LLM_POOL_MAX_CONNECTIONS, LLM_POOL_MAX_KEEPALIVE and
+LLM_POOL_KEEPALIVE_EXPIRY; HTTP/2 is used when the h2 package is
+installed, unless LLM_HTTP2=off. Clients are wrapped in the completion
+cache when one is configured, and identical concurrent requests are
+coalesced into one. The app lifespan creates the registry,
+warms it up when LLM_WARM_UP=1 and closes it on shutdown.
+"""
+
+import asyncio
+import importlib
+import importlib.util
+import os
+import threading
+from typing import Any, NamedTuple
+
+import httpx
+
+from .completion_cache import CachedLLMClient, CompletionCache, completion_cache_from_env, normalize_enabled
+from .llm_client import BaseLLMClient, create_llm_client, resolve_provider
+from .single_flight import SingleFlightLLMClient
+
+# Provider name -> SDK module whose DefaultAsyncHttpxClient keeps the SDK's timeouts.
+_SDK_MODULES = {"openai": "openai", "anthropic": "anthropic"}
+
+
+class PoolLimits(NamedTuple):
+    max_connections: int = 64
+    max_keepalive_connections: int = 16
+    keepalive_expiry: float = 60.0  # seconds an idle connection is kept open
+
+    @classmethod
+    def from_env(cls) -> "PoolLimits":
+        defaults = cls()
+        return cls(
+            int(os.getenv("LLM_POOL_MAX_CONNECTIONS") or defaults.max_connections),
+            int(os.getenv("LLM_POOL_MAX_KEEPALIVE") or defaults.max_keepalive_connections),
+            float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY") or defaults.keepalive_expiry),
+        )
+
+
+def http2_available() -> bool:
+    return os.getenv("LLM_HTTP2", "auto") != "off" and importlib.util.find_spec("h2") is not None
+
+
+class LLMClientRegistry:
+    def __init__(
+        self,
+        limits: PoolLimits | None = None,
+        http2: bool | None = None,
+        cache: CompletionCache | None = None,
+        normalize: bool = False,
+    ):
+        self.limits = limits or PoolLimits.from_env()
+        self.http2 = http2_available() if http2 is None else http2
+        self.cache = cache
+        self.normalize = normalize
+        self._clients: dict[str, BaseLLMClient] = {}
+        self._provider_clients: dict[str, BaseLLMClient] = {}
+        self._http_clients: dict[str, Any] = {}
+        self._requests: dict[str, int] = {}
+        self._warm_up_errors: dict[str, int] = {}
+        self._closing: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+    def get(self, provider: str | None = None) -> BaseLLMClient:
+        """Return the shared client for provider, creating it on first use."""
+        name = resolve_provider(provider)
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                http_client = self._create_http_client(name)
+                try:
+                    client = self._provider_clients[name] = create_llm_client(name, http_client)
+                except BaseException:
+                    if http_client is not None:
+                        self._discard(http_client)
+                    raise
+                if self.cache is not None:
+                    client = CachedLLMClient(client, self.cache, self.normalize)
+                client = self._clients[name] = SingleFlightLLMClient(client)
+                if http_client is not None:
+                    self._http_clients[name] = http_client
+        return client
+
+    def _create_http_client(self, provider: str) -> Any:
+        module = _SDK_MODULES.get(provider)
+        if module is None:
+            return None
+        try:
+            sdk = importlib.import_module(module)
+        except ImportError:
+            return None  # create_llm_client raises with the install hint
+
+        self._requests.setdefault(provider, 0)
+
+        async def count_request(request: Any) -> None:
+            self._requests[provider] += 1
+
+        return sdk.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.limits.max_connections,
+                max_keepalive_connections=self.limits.max_keepalive_connections,
+                keepalive_expiry=self.limits.keepalive_expiry,
+            ),
+            http2=self.http2,
+            event_hooks={"request": [count_request]},
+        )
+
+    def _discard(self, http_client: Any) -> None:
+        """Close an http client that never got a provider client, from sync code."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(http_client.aclose())
+            return
+        task = loop.create_task(http_client.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def warm_up(self, providers: list[str] | None = None) -> None:
+        """
+        Open a connection to each provider's API ahead of the first request.
+
+        Defaults to the configured provider. Any response will do, so the
+        request is a HEAD of the API base URL; failures are counted in
+        stats() and otherwise ignored, leaving the first real request to
+        connect as usual.
+        """
+        names = providers or [resolve_provider()]
+        for name in names:
+            self.get(name)
+        await asyncio.gather(*(self._warm_up(name) for name in names if name in self._http_clients))
+
+    async def _warm_up(self, provider: str) -> None:
+        try:
+            base_url = self._provider_clients[provider].client.base_url
+            await self._http_clients[provider].head(str(base_url))
+        except Exception:  # best effort: the SDKs may bring their own httpx build and errors
+            self._warm_up_errors[provider] = self._warm_up_errors.get(provider, 0) + 1
+
+    async def aclose(self) -> None:
+        """Close every pooled connection; clients are recreated on the next get()."""
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            self._clients.clear()
+            self._provider_clients.clear()
+            self._http_clients.clear()
+        for http_client in http_clients:
+            await http_client.aclose()
+        if self._closing:
+            await asyncio.gather(*self._closing)
+
+    def stats(self) -> dict:
+        """Pool limits plus per-provider connection and request counters."""
+        providers = {}
+        for name, http_client in list(self._http_clients.items()):
+            connections = _pool_connections(http_client)
+            providers[name] = {
+                "connections": len(connections),
+                "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+                "requests": self._requests.get(name, 0),
+                "warm_up_errors": self._warm_up_errors.get(name, 0),
+            }
+        return {"limits": self.limits._asdict(), "http2": self.http2, "providers": providers}
+
+
+def _pool_connections(http_client: Any) -> list:
+    # httpx does not expose its connection pool; read httpcore's when it is there.
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []))
+
+
+_registry: LLMClientRegistry | None = None
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    global _registry
+    if _registry is None:
+        _registry = LLMClientRegistry(cache=completion_cache_from_env(), normalize=normalize_enabled())
+    return _registry
+
+
+async def shutdown_llm_registry() -> None:
+    global _registry
+    if _registry is not None:
+        await _registry.aclose()
+        if _registry.cache is not None:
+            _registry.cache.close()
+        _registry = None
+
+
+def warm_up_enabled() -> bool:
+    return os.getenv("LLM_WARM_UP") == "1"
@@ -0,0 +1,241 @@
+"""
+Parsed Markdown structure shared by diffing, truncation and prompt building.
+
+Each block text is parsed once per content hash and kept in
+MARKDOWN_CACHE. The parse covers the block-level nodes (headings,
+paragraphs, list items, tables, code fences, quotes), the link spans and
+the diff tokens. The parser works line by line in time linear in the
+text, and it recognises the Markdown the editor produces rather than all
+of CommonMark.
+"""
+
+import re
+from typing import Iterator, NamedTuple
+
+from .content_cache import ContentCache, content_hash
+
+# Rough per-item overheads used to size cache entries in bytes.
+_TOKEN_OVERHEAD_BYTES = 56
+_NODE_OVERHEAD_BYTES = 96
+
+MARKDOWN_CACHE = ContentCache(max_entries=4096, max_bytes=64 * 1024 * 1024)
+
+_FENCE = re.compile(r"\s{0,3}(`{3,}|~{3,})")
+_HEADING = re.compile(r"\s{0,3}(#{1,6})(\s|$)")
+_LIST_ITEM = re.compile(r"\s*([-*+]|\d+[.)])\s")
+_BLOCK_KINDS = {"table": "table", "code": "code", "list_item": "list", "quote": "quote"}
+
+
+class MarkdownNode(NamedTuple):
+    """A block-level node spanning text[start:end], trailing newline included."""
+
+    kind: str  # "heading" | "paragraph" | "list_item" | "table" | "code" | "quote"
+    start: int
+    end: int
+    level: int = 0  # heading level
+
+
+class ParsedMarkdown(NamedTuple):
+    nodes: tuple[MarkdownNode, ...]
+    links: tuple[tuple[int, int], ...]
+    tokens: tuple[str, ...]
+
+
+def parse_markdown(text: str, text_hash: str | None = None) -> ParsedMarkdown:
+    """Return the parsed structure of text, cached by its content hash."""
+    return MARKDOWN_CACHE.get_or_compute(
+        text_hash or content_hash(text),
+        lambda: ParsedMarkdown(
+            tuple(_parse_nodes(text)), tuple(_iter_link_spans(text)), tuple(tokenize_markdown(text))
+        ),
+        lambda parsed: len(text)
+        + _TOKEN_OVERHEAD_BYTES * (len(parsed.tokens) + len(parsed.links) + 1)
+        + _NODE_OVERHEAD_BYTES * len(parsed.nodes),
+    )
+
+
+def block_kind(parsed: ParsedMarkdown) -> str | None:
+    """Return "table", "code", "list" or "quote" when every node of a block is of that kind."""
+    kinds = {node.kind for node in parsed.nodes}
+    return _BLOCK_KINDS.get(kinds.pop()) if len(kinds) == 1 else None
+
+
+def cut_markdown(text: str, limit: int, parsed: ParsedMarkdown | None = None) -> str:
+    """
+    Return a prefix of text of at most limit characters that keeps its structure.
+
+    The cut falls after the last whole node that fits. When not even the
+    first node fits, tables, lists and code are cut after a whole line
+    and an open code fence is closed (adding a few characters); prose is
+    cut at the last whitespace.
+    """
+    if limit >= len(text):
+        return text
+    parsed = parsed or parse_markdown(text)
+    end = 0
+    for node in parsed.nodes:
+        if node.end > limit:
+            break
+        end = node.end
+    if end:
+        return text[:end].rstrip("\n")
+
+    first = parsed.nodes[0] if parsed.nodes else None
+    prefix = text[:max(limit, 0)]
+    if first is None or first.kind in ("paragraph", "heading", "quote"):
+        space = max(prefix.rfind(" "), prefix.rfind("\n"))
+        return prefix[:space] if space > 0 else prefix
+
+    line_end = prefix.rfind("\n")
+    prefix = prefix[:line_end] if line_end > first.start else ""
+    if first.kind == "code" and prefix:
+        prefix += "\n" + _FENCE.match(text, first.start).group(1)
+    return prefix
+
+
+def _parse_nodes(text: str) -> Iterator[MarkdownNode]:
+    lines = text.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        start = i
+        fence = _FENCE.match(line)
+        if fence:
+            marker = fence.group(1)
+            i += 1
+            while i < len(lines) and not lines[i].lstrip().startswith(marker):
+                i += 1
+            i = min(i + 1, len(lines))
+            yield MarkdownNode("code", offsets[start], offsets[i])
+            continue
+        heading = _HEADING.match(line)
+        if heading:
+            i += 1
+            yield MarkdownNode("heading", offsets[start], offsets[i], len(heading.group(1)))
+            continue
+
+        stripped = line.lstrip()
+        if stripped.startswith("|"):
+            kind, continues = "table", _is_table_row
+        elif stripped.startswith(">"):
+            kind, continues = "quote", _is_quote_line
+        elif _LIST_ITEM.match(line):
+            kind, continues = "list_item", _continues_paragraph
+        else:
+            kind, continues = "paragraph", _continues_paragraph
+        i += 1
+        while i < len(lines) and lines[i].strip() and continues(lines[i]):
+            i += 1
+        yield MarkdownNode(kind, offsets[start], offsets[i])
+
+
+def _is_table_row(line: str) -> bool:
+    return line.lstrip().startswith("|")
+
+
+def _is_quote_line(line: str) -> bool:
+    return line.lstrip().startswith(">")
+
+
+def _continues_paragraph(line: str) -> bool:
+    return not (
+        _FENCE.match(line) or _HEADING.match(line) or _LIST_ITEM.match(line)
+        or _is_table_row(line) or _is_quote_line(line)
+    )
+
+
+def tokenize_markdown(text: str) -> list[str]:
+    """
+    Tokenize markdown text preserving structure.
+    
+    Splits on word boundaries but keeps markdown tokens intact:
+    - Headings (#, ##, ###, etc.)
+    - List markers (-, *, 1., etc.)
+    - Code blocks (```, ```)
+    - Inline code (`code`)
+    - Links, emphasis, etc.
+    
+    Runs in time linear in len(text): links are located by _iter_link_spans
+    and the text between them is split by one precompiled pattern.
+    """
+    if not text:
+        return []
+    
+    tokens: list[str] = []
+    split = _DELIMITER_PATTERN.split
+    segment_start = 0
+    
+    for link_start, link_end in _iter_link_spans(text):
+        if link_start > segment_start:
+            _split_segment(split, text, segment_start, link_start, tokens)
+        tokens.append(text[link_start:link_end])
+        segment_start = link_end
+    
+    if segment_start < len(text):
+        _split_segment(split, text, segment_start, len(text), tokens)
+    
+    return tokens
+
+
+# Every delimiter except links. Links used to be a \[.*?\]\(.*?\) alternative
+# here, which rescans the rest of the line for every "[" and is quadratic
+# on link-heavy or adversarial text.
+_DELIMITER_PATTERN = re.compile(
+    r'(\s+|```|`|#{1,6}\s|^\s*[-*+]\s|^\s*\d+\.\s|\*\*|__|\*|_|~~)',
+    re.MULTILINE,
+)
+
+
+def _split_segment(split, text: str, start: int, end: int, tokens: list[str]) -> None:
+    """Split text[start:end] on delimiters, appending non-empty parts to tokens."""
+    if start == 0:
+        tokens.extend(filter(None, split(text[:end])))
+        return
+    
+    # Segments after a link begin mid-line. Keep the link's closing ")" in
+    # front so "^" cannot match at the slice start, then drop it again.
+    parts = split(text[start - 1:end])
+    parts[0] = parts[0][1:]
+    tokens.extend(filter(None, parts))
+
+
+def _iter_link_spans(text: str) -> Iterator[tuple[int, int]]:
+    """
+    Yield (start, end) of each link token, left to right.
+    
+    A "[" starts a link when the same line has a later "](" followed by a
+    ")"; the link runs to the first such ")". The "](" and ")" lookups are
+    cached per line, so the scan is linear however many "[" a line has.
+    """
+    text_len = len(text)
+    line_end = -1
+    close_at = close_from = -1
+    paren_at = paren_from = -1
+    start = text.find('[')
+    
+    while start != -1:
+        if start > line_end:
+            line_end = text.find('\n', start)
+            if line_end == -1:
+                line_end = text_len
+            close_from = paren_from = -1
+        if close_from == -1 or (close_at != -1 and close_at <= start):
+            close_at = text.find('](', start + 1, line_end)
+            close_from = start + 1
+        if close_at != -1:
+            if paren_from == -1 or (paren_at != -1 and paren_at < close_at + 2):
+                paren_at = text.find(')', close_at + 2, line_end)
+                paren_from = close_at + 2
+            if paren_at != -1:
+                yield start, paren_at + 1
+                start = text.find('[', paren_at + 1)
+                continue
+        start = text.find('[', start + 1)
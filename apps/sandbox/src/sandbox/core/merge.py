@@ -0,0 +1,114 @@
+"""
+Three-way merge of block text, used to rebase stale agent proposals.
+
+The agent's edit was made against a base text; if a collaborator changed
+the block meanwhile, both changes are replayed onto the base at token
+granularity instead of re-running the LLM. Only regions that both sides
+changed differently are reported as conflicts.
+"""
+
+from typing import Any
+
+from .diff_algorithms import diff_tokens
+
+
+class MergeConflictError(ValueError):
+    """Raised when a proposed edit cannot be rebased without conflicts."""
+
+    def __init__(self, block_id: str, conflicts: list[dict[str, Any]]):
+        self.block_id = block_id
+        self.conflicts = conflicts
+        super().__init__(
+            f"Block ID '{block_id}' has {len(conflicts)} conflicting change(s) "
+            "between the human edit and the proposed edit"
+        )
+
+
+def merge_three_way(base: str, human: str, agent: str, algorithm: str = "auto") -> dict[str, Any]:
+    """
+    Merge the human and agent versions of a block against their common base.
+
+    Returns:
+    {
+        "merged_text": str,
+        "clean": bool,
+        "conflicts": [
+            {"offset": int, "base": str, "human": str, "agent": str}
+        ]
+    }
+
+    Non-overlapping changes from both sides are combined. Where both
+    sides changed the same tokens differently, merged_text keeps the
+    human text and the region is listed in conflicts, with offset the
+    character position of that region in merged_text.
+    """
+    base_tokens, human_tokens, human_opcodes = diff_tokens(base, human, algorithm)
+    _, agent_tokens, agent_opcodes = diff_tokens(base, agent, algorithm)
+    side_tokens = {"human": human_tokens, "agent": agent_tokens}
+
+    hunks = sorted(
+        [(i1, i2, j1, j2, "human") for tag, i1, i2, j1, j2 in human_opcodes if tag != "equal"]
+        + [(i1, i2, j1, j2, "agent") for tag, i1, i2, j1, j2 in agent_opcodes if tag != "equal"]
+    )
+
+    merged: list[str] = []
+    merged_len = 0
+    conflicts = []
+    delta = {"human": 0, "agent": 0}
+    position = 0
+    k = 0
+
+    while k < len(hunks):
+        group = [hunks[k]]
+        lo, hi = hunks[k][0], hunks[k][1]
+        k += 1
+        while k < len(hunks) and _overlaps(hunks[k], lo, hi):
+            group.append(hunks[k])
+            hi = max(hi, hunks[k][1])
+            k += 1
+
+        unchanged = "".join(base_tokens[position:lo])
+        merged.append(unchanged)
+        merged_len += len(unchanged)
+
+        replacements = {}
+        for side in {hunk[4] for hunk in group}:
+            growth = sum((j2 - j1) - (i2 - i1) for i1, i2, j1, j2, s in group if s == side)
+            start = lo + delta[side]
+            replacements[side] = "".join(side_tokens[side][start:hi + delta[side] + growth])
+            delta[side] += growth
+
+        if len(replacements) == 1:
+            text = next(iter(replacements.values()))
+        else:
+            text = replacements["human"]
+            if replacements["agent"] != text:
+                conflicts.append({
+                    "offset": merged_len,
+                    "base": "".join(base_tokens[lo:hi]),
+                    "human": replacements["human"],
+                    "agent": replacements["agent"],
+                })
+        merged.append(text)
+        merged_len += len(text)
+        position = hi
+
+    merged.append("".join(base_tokens[position:]))
+    return {
+        "merged_text": "".join(merged),
+        "clean": not conflicts,
+        "conflicts": conflicts,
+    }
+
+
+def _overlaps(hunk: tuple, lo: int, hi: int) -> bool:
+    """
+    Whether a hunk collides with the base range [lo, hi) of the current group.
+
+    Touching ranges only collide when an insertion is involved, since the
+    order of the two changes would then be ambiguous.
+    """
+    i1, i2 = hunk[0], hunk[1]
+    if i1 < hi:
+        return True
+    return i1 == hi and (i1 == i2 or lo == hi)
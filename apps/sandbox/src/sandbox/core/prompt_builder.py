@@ -1,9 +1,37 @@
-import json
+from functools import lru_cache
 from typing import Any
 
+from .bm25_index import BM25Index
+from .content_cache import ContentCache, content_hash
+from .dense_index import DenseIndex, combine_scores
+from .markdown_ast import block_kind, cut_markdown, parse_markdown
+from .token_counter import BaseTokenCounter, count_tokens, get_token_counter
+
+TRUNCATION_MARKER = "...[truncated]"
+
+# Message key marking the last message of a cacheable prompt prefix;
+# clients translate it to provider cache breakpoints.
+CACHE_BREAKPOINT = "cache"
+
+CONTEXT_PROMPT_CACHE = ContentCache(max_entries=256, max_bytes=32 * 1024 * 1024)
+
+# Block types not worth a label in compact prompts.
+_PLAIN_BLOCK_TYPES = {"markdown", "paragraph", "unknown"}
+
+COMPACT_ID_INSTRUCTIONS = """
+In the report context, sections are headed [s1], [s2], ... and blocks are
+marked [b1], [b2], ... Use these short IDs as the "id" of your edits."""
+
 
 def build_agent_prompt(
-    thread_messages: list[dict], context: dict
+    thread_messages: list[dict],
+    context: dict,
+    max_context_tokens: int | None = None,
+    index: BM25Index | None = None,
+    dense_index: DenseIndex | None = None,
+    history_summary: str | None = None,
+    compact: bool = False,
+    cache_scope: str | None = None,
 ) -> list[dict[str, str]]:
     """
     Build prompt for LLM with:
@@ -13,27 +41,140 @@ def build_agent_prompt(
     - Instructions for response format
     - Examples of proposed edits format
 
+    With max_context_tokens, the blocks most relevant to the latest user
+    message are packed into that budget (see select_context), using the
+    project's indexes when given.
+
+    The messages form a byte-stable prefix (system prompt, then the
+    document context) followed by the conversation, so provider prefix
+    caches hit across turns. When the whole document does not fit the
+    budget, the selection depends on the query: the prefix then holds
+    the document's sections and artifacts only, and the selected blocks
+    go in a user message just before the latest user message, after the
+    last cache breakpoint. The context prompt is memoized per
+    cache_scope (the project or thread) and context["revision"] when
+    given, keyed on the content hashes of what it renders. A history_summary of older turns
+    (see HistoryManager) goes between the context and the conversation.
+    The system, context and summary messages and the latest conversation
+    message (the one before the selected blocks, if any) are marked with
+    CACHE_BREAKPOINT.
+
+    With compact=True, section and block IDs are replaced by the short
+    aliases of compact_aliases(context) and blocks are grouped under
+    their section headings; map IDs in the reply back with expand_aliases.
+
     Returns list of message dicts for LLM
     """
     messages = []
-
-    system_prompt = _build_system_prompt()
-    messages.append({"role": "system", "content": system_prompt})
-
-    context_prompt = _build_context_prompt(context)
+    revision = context.get("revision") if context else None
+    aliases = compact_aliases(context) if compact and context else None
+
+    selection = None
+    if max_context_tokens is not None and context:
+        query = next(
+            (msg.get("content", "") for msg in reversed(thread_messages) if msg.get("role") == "user"),
+            "",
+        )
+        selected = select_context(context, query, max_context_tokens, index, dense_index=dense_index, aliases=aliases)
+        if selected["blocks"] == context.get("blocks", []):
+            context = selected
+        else:
+            selection = {**selected, "artifacts": []}
+            context = {**selected, "blocks": []}
+
+    system_prompt = _build_system_prompt(compact)
+    messages.append({"role": "system", "content": system_prompt, CACHE_BREAKPOINT: True})
+
+    context_prompt = _context_prompt_at_revision(context, revision, aliases, cache_scope)
     if context_prompt:
-        messages.append({"role": "system", "content": context_prompt})
+        messages.append({"role": "system", "content": context_prompt, CACHE_BREAKPOINT: True})
+
+    if history_summary:
+        messages.append({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{history_summary}",
+            CACHE_BREAKPOINT: True,
+        })
 
+    conversation = []
     for msg in thread_messages:
         role = "user" if msg.get("role") == "user" else "assistant"
         content = msg.get("content", "")
         if content:
-            messages.append({"role": role, "content": content})
+            conversation.append({"role": role, "content": content})
+    if selection is not None:
+        latest = len(conversation) - 1 if conversation and conversation[-1]["role"] == "user" else len(conversation)
+        if latest:
+            conversation[latest - 1][CACHE_BREAKPOINT] = True
+        conversation.insert(latest, {
+            "role": "user",
+            "content": "Blocks selected for the latest request:\n" + _render_context(selection, aliases),
+        })
+    elif conversation:
+        conversation[-1][CACHE_BREAKPOINT] = True
+    messages.extend(conversation)
 
     return messages
 
 
-def _build_system_prompt() -> str:
+def _context_prompt_at_revision(
+    context: dict, revision: str | None, aliases: dict[str, str] | None = None, scope: str | None = None
+) -> str:
+    """
+    Render the context prompt, reusing the string built for the same scope, revision and content.
+
+    Revisions come from the client, so the key also carries a content
+    hash of every block, section title and artifact summary rendered.
+    """
+    if revision is None:
+        return _render_context(context, aliases)
+
+    key = (
+        scope,
+        revision,
+        aliases is not None,
+        tuple(
+            (block.get("id"), block.get("section_id"), block.get("type"), content_hash(block.get("content", "")))
+            for block in context.get("blocks", [])
+        ),
+        tuple((section.get("id"), section.get("title")) for section in context.get("sections", [])),
+        tuple(
+            (artifact.get("id"), artifact.get("name"), content_hash(artifact.get("summary") or ""))
+            for artifact in context.get("artifacts", [])
+        ),
+    )
+    return CONTEXT_PROMPT_CACHE.get_or_compute(key, lambda: _render_context(context, aliases), len)
+
+
+def compact_aliases(context: dict) -> dict[str, str]:
+    """
+    Map section and block IDs to short aliases: s1, s2, ... and b1, b2, ...
+
+    Aliases follow the order of the full context, so they do not depend
+    on which blocks a token budget lets into the prompt.
+    """
+    aliases = {section.get("id"): f"s{i}" for i, section in enumerate(context.get("sections", []), start=1)}
+    aliases.update((block.get("id"), f"b{i}") for i, block in enumerate(context.get("blocks", []), start=1))
+    return aliases
+
+
+def expand_aliases(edits: list[dict], aliases: dict[str, str]) -> list[dict]:
+    """Replace aliased IDs in proposed edits with the real IDs; other IDs are kept."""
+    real_ids = {alias: real_id for real_id, alias in aliases.items()}
+    return [
+        {**edit, "id": real_ids[edit["id"]]} if edit.get("id") in real_ids else edit
+        for edit in edits
+    ]
+
+
+def _render_context(context: dict, aliases: dict[str, str] | None) -> str:
+    return _build_context_prompt(context) if aliases is None else _build_compact_context_prompt(context, aliases)
+
+
+@lru_cache(maxsize=2)
+def _build_system_prompt(compact: bool = False) -> str:
+    if compact:
+        return _build_system_prompt() + "\n" + COMPACT_ID_INSTRUCTIONS
     return """You are an AI assistant helping users edit research reports.
 
 Your task is to respond to user requests by proposing edits to sections and blocks in the report.
@@ -49,12 +190,19 @@ When responding:
     {
       "type": "section" | "block",
       "id": "section-id" or "block-id",
-      "action": "update" | "create" | "delete",
+      "action": "patch" | "update" | "create" | "delete",
+      "patches": [{"search": "exact existing text", "replace": "new text"}] (for patch actions),
       "content": "new content" (for update/create actions)
     }
   ]
 }
 
+For small changes to an existing block, use a "patch" edit instead of
+repeating the whole block. Each "search" must be copied exactly from the
+block's current text and match it only once; include a few surrounding
+words if needed to make it unique. Patches are applied in order. Use
+"update" with the full "content" only when rewriting most of a block.
+
 Examples:
 
 User: "Rewrite the introduction to be more concise"
@@ -71,6 +219,20 @@ Response:
   ]
 }
 
+User: "Fix the sample size in the methods"
+Response:
+{
+  "message": "I've corrected the sample size.",
+  "proposedEdits": [
+    {
+      "type": "block",
+      "id": "methods-block-2",
+      "action": "patch",
+      "patches": [{"search": "from 40 sites", "replace": "from 42 sites"}]
+    }
+  ]
+}
+
 User: "Add a conclusion section"
 Response:
 {
@@ -105,27 +267,142 @@ def _build_context_prompt(context: dict) -> str:
     if blocks:
         parts.append("\nBlocks:")
         for block in blocks:
-            block_id = block.get("id")
-            block_type = block.get("type", "unknown")
-            content = block.get("content", "")
-            truncated = content[:200] + "..." if len(content) > 200 else content
-            parts.append(f"- {block_id} ({block_type}): {truncated}")
+            parts.append(_block_header(block) + block.get("content", ""))
 
     artifacts = context.get("artifacts", [])
     if artifacts:
         parts.append("\nArtifacts:")
         for artifact in artifacts:
             parts.append(f"- {artifact.get('id')}: {artifact.get('name', 'Unnamed')}")
+            if artifact.get("summary"):
+                parts.append(artifact["summary"])
+
+    return "\n".join(parts)
+
+
+def _build_compact_context_prompt(context: dict, aliases: dict[str, str]) -> str:
+    """
+    Build the context with short aliases, blocks grouped under section headings.
+
+    Blocks outside any listed section come first. Plain block types carry
+    no label unless the block is entirely a table, code, list or quote.
+    """
+    if not context:
+        return ""
+
+    grouped: dict[str | None, list[str]] = {section.get("id"): [] for section in context.get("sections", [])}
+    loose = []
+    for block in context.get("blocks", []):
+        rendered = _compact_block_header(block, aliases) + block.get("content", "")
+        grouped.get(block.get("section_id"), loose).append(rendered)
+
+    parts = ["Current report context:"]
+    parts.extend(loose)
+    for section in context.get("sections", []):
+        section_id = section.get("id")
+        parts.append(f"\n## [{aliases.get(section_id, section_id)}] {section.get('title', 'Untitled')}")
+        parts.extend(grouped[section_id])
+
+    artifacts = context.get("artifacts", [])
+    if artifacts:
+        parts.append("\nArtifacts:")
+        for artifact in artifacts:
+            parts.append(f"- {artifact.get('name', 'Unnamed')}")
+            if artifact.get("summary"):
+                parts.append(artifact["summary"])
 
     return "\n".join(parts)
 
 
-def truncate_context(context: dict, max_tokens: int = 8000) -> dict:
+def select_context(
+    context: dict,
+    query: str,
+    max_tokens: int = 8000,
+    index: BM25Index | None = None,
+    token_counter: BaseTokenCounter | None = None,
+    dense_index: DenseIndex | None = None,
+    aliases: dict[str, str] | None = None,
+) -> dict:
+    """
+    Pack the blocks most relevant to query into a token budget.
+
+    Blocks of context["anchor_section_id"] go first, then blocks ranked by
+    BM25 over their text and section title, then the rest in document
+    order; truncate_context fills the budget in that order. The chosen
+    blocks are returned in document order. A shared index is synced to
+    the context's blocks, so only blocks that changed are re-indexed.
+    With a dense_index, BM25 and embedding scores are blended, so
+    paraphrases of the query rank too. Pass the compact aliases to budget
+    for the compact encoding.
+    """
+    blocks = context.get("blocks", [])
+    titles = {section.get("id"): section.get("title", "") for section in context.get("sections", [])}
+    items = [
+        {
+            "id": block.get("id"),
+            "content": block.get("content", ""),
+            "section_title": titles.get(block.get("section_id"), ""),
+        }
+        for block in blocks
+    ]
+    index = index if index is not None else BM25Index()
+    index.sync(items)
+
+    scores = index.scores(query) if query else {}
+    if dense_index is not None:
+        dense_index.sync(items)
+        if query:
+            scores = combine_scores(scores, dense_index.scores(query))
+    anchor = context.get("anchor_section_id")
+    ranked = sorted(
+        range(len(blocks)),
+        key=lambda i: (
+            anchor is None or blocks[i].get("section_id") != anchor,
+            -scores.get(blocks[i].get("id"), 0.0),
+            i,
+        ),
+    )
+
+    selected = truncate_context(
+        {**context, "blocks": [blocks[i] for i in ranked]}, max_tokens, token_counter, aliases
+    )
+    position = {block.get("id"): i for i, block in enumerate(blocks)}
+    selected["blocks"].sort(key=lambda block: position[block.get("id")])
+    return selected
+
+
+def _block_header(block: dict) -> str:
+    return f"- {block.get('id')} ({block.get('type', 'unknown')}):\n"
+
+
+def _compact_block_header(block: dict, aliases: dict[str, str]) -> str:
+    label = aliases.get(block.get("id"), block.get("id"))
+    block_type = block.get("type", "unknown")
+    if block_type in _PLAIN_BLOCK_TYPES:
+        block_type = block_kind(parse_markdown(block.get("content", "")))
+    if block_type:
+        label = f"{label} {block_type}"
+    return f"[{label}]\n"
+
+
+def truncate_context(
+    context: dict,
+    max_tokens: int = 8000,
+    token_counter: BaseTokenCounter | None = None,
+    aliases: dict[str, str] | None = None,
+) -> dict:
     """
     Truncate large documents to fit in context window.
-    Uses rough approximation: 1 token ≈ 4 characters
+
+    Blocks are kept in order while they fit; the first block that does not
+    is cut to the remaining budget and the rest are dropped. The cut falls
+    on a Markdown node boundary where possible (see cut_markdown), so
+    tables and code fences are not left half open. Token counts
+    are taken from the rendered context prompt, accumulated block by block
+    and cached per block content, so the cost is linear in the context.
+    With aliases, they are taken from the compact encoding.
     """
-    max_chars = max_tokens * 4
+    counter = token_counter or get_token_counter()
 
     truncated = {
         "sections": context.get("sections", []),
@@ -133,25 +410,33 @@ def truncate_context(context: dict, max_tokens: int = 8000) -> dict:
         "artifacts": context.get("artifacts", []),
     }
 
-    current_size = _estimate_size(truncated)
+    if aliases is None:
+        used = counter.count(_build_context_prompt(truncated)) + counter.count("\nBlocks:")
+    else:
+        used = counter.count(_build_compact_context_prompt(truncated, aliases))
+    # Room for the marker on its own line and a code fence closed by the cut.
+    marker_tokens = counter.count("\n```\n" + TRUNCATION_MARKER)
 
     for block in context.get("blocks", []):
+        remaining = max_tokens - used
+        if remaining <= 0:
+            break
+
         block_copy = block.copy()
         content = block_copy.get("content", "")
-
-        remaining_space = max_chars - current_size
-        if remaining_space <= 0:
+        header = _block_header(block_copy) if aliases is None else _compact_block_header(block_copy, aliases)
+        header_tokens = counter.count("\n" + header)
+        block_tokens = header_tokens + count_tokens(content, counter)
+
+        if block_tokens > remaining:
+            room = remaining - header_tokens - marker_tokens
+            cut = cut_markdown(content, len(counter.truncate(content, room))) if room > 0 else ""
+            if cut:
+                block_copy["content"] = cut + "\n" + TRUNCATION_MARKER
+                truncated["blocks"].append(block_copy)
             break
 
-        if len(content) > remaining_space:
-            block_copy["content"] = content[:remaining_space] + "...[truncated]"
-
         truncated["blocks"].append(block_copy)
-        current_size = _estimate_size(truncated)
+        used += block_tokens
 
     return truncated
-
-
-def _estimate_size(context: dict) -> int:
-    """Estimate the character size of the context."""
-    return len(json.dumps(context))
@@ -0,0 +1,206 @@
+"""
+Incremental parsing of streamed agent replies.
+
+The model answers with one JSON object {"message": str, "proposedEdits":
+[...]}, optionally inside a Markdown code fence. AgentReplyParser is fed
+the reply chunk by chunk and reports the message text as it arrives and
+each proposedEdits element as soon as its closing brace does, so edits
+can be applied and diffed while the model is still writing the rest.
+Each chunk is scanned once; string contents are skipped with a regex
+search rather than character by character, and only the part of the
+message not yet sent is kept, so work grows with the reply's length.
+
+Replies that are not a JSON object are streamed as plain message text,
+matching how parse_agent_response treats them.
+"""
+
+import json
+import re
+from typing import Any, NamedTuple
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_STRUCTURAL = re.compile(r'[{}\[\]":,]')
+# An escape that may continue in the next chunk: a partial \uXXXX, or a
+# high surrogate whose low half has not arrived yet.
+_HELD_ESCAPE = re.compile(r'\\u[0-9a-fA-F]{0,3}$|\\u[dD][89abAB][0-9a-fA-F]{2}$')
+# Longest text held back at the end of a chunk: a high surrogate and a partial low one.
+_HELD_ESCAPE_CHARS = len("\\uD83D\\uDE0")
+
+
+class ReplyEvent(NamedTuple):
+    kind: str  # "message" (a piece of the message text) | "edit" (a proposedEdits element)
+    value: Any
+
+
+class AgentReplyParser:
+    def __init__(self):
+        self.chunks: list[str] = []
+        self._mode: str | None = None  # None until the first non-blank character, then "json" or "plain"
+        self._done = False
+        self._stack: list[str] = []
+        self._expect_key = False
+        self._key: str | None = None
+
+        self._in_string = False
+        self._escape = False
+        self._string_role: str | None = None  # "key" | "message" | None
+        self._string_raw: list[str] = []  # for the message: only the part not yet sent
+
+        self._edits_depth: int | None = None
+        self._edit_parts: list[str] | None = None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return "".join(self.chunks)
+
+    def feed(self, chunk: str) -> list[ReplyEvent]:
+        """Consume the next chunk of the reply and return the events it completes."""
+        self.chunks.append(chunk)
+        events: list[ReplyEvent] = []
+        if self._mode is None:
+            stripped = chunk.lstrip()
+            if not stripped:
+                return events
+            self._mode = "json" if stripped[0] in "{`" else "plain"
+        if self._mode == "plain":
+            return [ReplyEvent("message", chunk)]
+        if self._done:
+            return events
+
+        self._scan(chunk, events)
+        if self._string_role == "message":
+            self._flush_message(events, final=False)
+        return events
+
+    def _scan(self, chunk: str, events: list[ReplyEvent]) -> None:
+        i, n = 0, len(chunk)
+        capture_from = 0 if self._edit_parts is not None else None
+        string_from = 0 if self._in_string else None
+
+        while i < n:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(chunk, i)
+                if match is None:
+                    i = n
+                    break
+                i = match.start()
+                if chunk[i] == "\\":
+                    if i + 1 < n:
+                        i += 2
+                    else:
+                        self._escape = True
+                        i += 1
+                    continue
+                self._add_string_raw(chunk[string_from:i])
+                self._end_string(events)
+                string_from = None
+                i += 1
+                continue
+
+            if not self._stack:
+                start = chunk.find("{", i)
+                if start == -1:
+                    return
+                i = start
+            else:
+                match = _STRUCTURAL.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+
+            char = chunk[i]
+            depth = len(self._stack)
+            if char == '"':
+                self._in_string = True
+                self._string_raw = []
+                string_from = i + 1
+                if depth == 1 and self._expect_key:
+                    self._string_role = "key"
+                elif depth == 1 and self._key == "message":
+                    self._string_role = "message"
+                else:
+                    self._string_role = None
+            elif char in "{[":
+                if char == "{" and self._edits_depth is not None and depth == self._edits_depth:
+                    self._edit_parts = []
+                    capture_from = i
+                if char == "[" and depth == 1 and self._key == "proposedEdits" and not self._expect_key:
+                    self._edits_depth = depth + 1
+                self._stack.append(char)
+                self._expect_key = char == "{" and depth == 0
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                depth = len(self._stack)
+                if char == "}" and self._edit_parts is not None and depth == self._edits_depth:
+                    self._edit_parts.append(chunk[capture_from:i + 1])
+                    self._emit_edit(events)
+                    capture_from = None
+                if char == "]" and self._edits_depth is not None and depth == self._edits_depth - 1:
+                    self._edits_depth = None
+                if not self._stack:
+                    self._done = True
+                    return
+            elif depth == 1:
+                if char == ",":
+                    self._expect_key = True
+                elif char == ":":
+                    self._expect_key = False
+            i += 1
+
+        if self._in_string and string_from is not None:
+            self._add_string_raw(chunk[string_from:])
+        if self._edit_parts is not None and capture_from is not None:
+            self._edit_parts.append(chunk[capture_from:])
+
+    def _add_string_raw(self, raw: str) -> None:
+        if self._string_role is not None and raw:
+            self._string_raw.append(raw)
+
+    def _end_string(self, events: list[ReplyEvent]) -> None:
+        self._in_string = False
+        if self._string_role == "key":
+            self._key = _decode("".join(self._string_raw))
+        elif self._string_role == "message":
+            self._flush_message(events, final=True)
+        self._string_role = None
+        self._string_raw = []
+
+    def _flush_message(self, events: list[ReplyEvent], final: bool) -> None:
+        raw = "".join(self._string_raw)
+        end = len(raw)
+        if not final:
+            if self._escape:
+                end -= 1
+            # A partial low surrogate can in turn expose a held high surrogate.
+            while held := _HELD_ESCAPE.search(raw, max(end - _HELD_ESCAPE_CHARS, 0), end):
+                end = held.start()
+        text = _decode(raw[:end])
+        if text is None:
+            self._string_raw = [raw]
+            return
+        self._string_raw = [raw[end:]] if end < len(raw) else []
+        if text:
+            events.append(ReplyEvent("message", text))
+
+    def _emit_edit(self, events: list[ReplyEvent]) -> None:
+        raw = "".join(self._edit_parts)
+        self._edit_parts = None
+        try:
+            edit = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        if isinstance(edit, dict):
+            events.append(ReplyEvent("edit", edit))
+
+
+def _decode(raw: str) -> str | None:
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return None
@@ -0,0 +1,232 @@
+"""
+Coalescing of duplicate in-flight work and replay of idempotent requests.
+
+Convex retries actions and collaborators trigger the same run, so the
+same request often arrives while an identical one is still running.
+SingleFlight runs one task per key and lets every concurrent caller with
+that key await it. IdempotencyStore reserves each Idempotency-Key when
+its request arrives and keeps the finished response for a TTL, so a
+retry, even one reaching another worker or a restarted one, gets the
+stored response instead of a new generation.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, TypeVar
+
+from .completion_cache import completion_cache_dir, completion_key, open_private_db
+from .llm_client import BaseLLMClient
+
+IDEMPOTENCY_TTL = 24 * 60 * 60
+# Seconds after which an unfinished reservation is taken to be abandoned.
+IDEMPOTENCY_LEASE = 10 * 60
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Share one running task among concurrent callers with the same key.
+
+    The task runs detached from its callers: one caller being cancelled
+    does not cancel it for the others. Keys are released when the task
+    finishes, so only concurrent calls are coalesced.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            flight = self.in_flight(key)
+            if flight is None:
+                return await asyncio.shield(self.track(key, asyncio.ensure_future(fn())))
+            self.shared += 1
+            try:
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise
+                # The flight was abandoned rather than this caller cancelled; run it again.
+
+    def track(self, key: str, flight: asyncio.Future) -> asyncio.Future:
+        """Register flight as the in-flight work for key until it is done."""
+        self.calls += 1
+        self._flights[key] = flight
+        flight.add_done_callback(lambda done: self._release(key, done))
+        return flight
+
+    def _release(self, key: str, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            flight.exception()  # retrieved here so a failure nobody awaited is not logged
+
+    def in_flight(self, key: str) -> asyncio.Future | None:
+        flight = self._flights.get(key)
+        return flight if flight is not None and flight.get_loop() is asyncio.get_running_loop() else None
+
+    def stats(self) -> dict[str, int]:
+        return {"in_flight": len(self._flights), "calls": self.calls, "shared": self.shared}
+
+
+class SingleFlightLLMClient(BaseLLMClient):
+    """
+    Coalesce identical concurrent completions of client.
+
+    Requests are identified by completion_key of their messages. A stream
+    started while an identical request is in flight yields that request's
+    whole completion at once; otherwise it streams live and its finished
+    text is shared with identical callers that arrive meanwhile.
+    """
+
+    def __init__(self, client: BaseLLMClient, flights: SingleFlight | None = None):
+        self.client = client
+        self.flights = flights or SingleFlight()
+        self.model = getattr(client, "model", "")
+
+    def _key(self, messages: list[Dict[str, Any]]) -> str:
+        return completion_key(self.model, messages)
+
+    async def complete(self, messages: list[Dict[str, str]]) -> str:
+        return await self.flights.do(self._key(messages), lambda: self.client.complete(messages))
+
+    async def stream(self, messages: list[Dict[str, str]]) -> AsyncIterator[str]:
+        key = self._key(messages)
+        if self.flights.in_flight(key) is not None:
+            yield await self.complete(messages)
+            return
+
+        finished = self.flights.track(key, asyncio.get_running_loop().create_future())
+        chunks = []
+        try:
+            async for chunk in self.client.stream(messages):
+                chunks.append(chunk)
+                yield chunk
+            finished.set_result("".join(chunks))
+        except Exception as exc:
+            finished.set_exception(exc)
+            raise
+        finally:
+            if not finished.done():  # cancelled, or the consumer stopped iterating early
+                finished.cancel()
+
+    async def accept(self, messages: list[Dict[str, str]], reply: str) -> None:
+        await self.client.accept(messages, reply)
+
+
+class IdempotencyKeyReused(Exception):
+    """The Idempotency-Key was already used for a different request."""
+
+
+class IdempotencyStore:
+    """
+    Responses by (scope, idempotency key), persisted in SQLite for ttl seconds.
+
+    A key is reserved, together with its request fingerprint, when the
+    request arrives, and holds the response once the run finishes. The
+    database file is shared by the workers of a host and survives
+    restarts; path None keeps it in memory. A reservation older than
+    lease seconds is treated as abandoned by a crashed worker.
+    """
+
+    def __init__(
+        self, path: str | None = None, ttl: float = IDEMPOTENCY_TTL, lease: float = IDEMPOTENCY_LEASE
+    ):
+        self.ttl = ttl
+        self.lease = lease
+        self.replays = 0
+        self._lock = threading.Lock()
+        if path:
+            self._db = open_private_db(path)
+        else:
+            self._db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            "scope TEXT NOT NULL, key TEXT NOT NULL, fingerprint TEXT NOT NULL, response TEXT,"
+            " created REAL NOT NULL, PRIMARY KEY (scope, key))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idempotency_created ON idempotency (created)")
+
+    async def reserve(self, scope: str, key: str, fingerprint: str) -> tuple[str, str | None]:
+        """
+        Reserve key for a request, or report what holds it.
+
+        Returns ("reserved", None) when the caller should run the request,
+        ("pending", None) while another run with the same fingerprint
+        holds it, and ("done", response) once that run has finished.
+        Raises IdempotencyKeyReused if key is held for another fingerprint.
+        """
+        return await asyncio.to_thread(self._reserve, scope, key, fingerprint)
+
+    def _reserve(self, scope: str, key: str, fingerprint: str) -> tuple[str, str | None]:
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM idempotency WHERE created <= ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM idempotency WHERE response IS NULL AND created <= ?", (now - self.lease,)
+            )
+            self._db.execute(
+                "INSERT OR IGNORE INTO idempotency (scope, key, fingerprint, response, created) VALUES (?, ?, ?, NULL, ?)",
+                (scope, key, fingerprint, now),
+            )
+            if self._db.execute("SELECT changes()").fetchone()[0]:
+                return "reserved", None
+            stored_fingerprint, response = self._db.execute(
+                "SELECT fingerprint, response FROM idempotency WHERE scope = ? AND key = ?", (scope, key)
+            ).fetchone()
+            if stored_fingerprint != fingerprint:
+                raise IdempotencyKeyReused(key)
+            if response is None:
+                return "pending", None
+            self.replays += 1
+            return "done", response
+
+    async def finish(self, scope: str, key: str, response: str) -> None:
+        await asyncio.to_thread(
+            self._execute, "UPDATE idempotency SET response = ? WHERE scope = ? AND key = ?", (response, scope, key)
+        )
+
+    async def release(self, scope: str, key: str) -> None:
+        """Drop a reservation whose run failed, so a retry runs again."""
+        await asyncio.to_thread(
+            self._execute, "DELETE FROM idempotency WHERE scope = ? AND key = ? AND response IS NULL", (scope, key)
+        )
+
+    def _execute(self, sql: str, parameters: tuple) -> None:
+        with self._lock:
+            self._db.execute(sql, parameters)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            entries, pending = self._db.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(response) FROM idempotency"
+            ).fetchone()
+        return {"entries": entries, "pending": pending, "replays": self.replays}
+
+
+_idempotency_store: IdempotencyStore | None = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Return the store kept next to the completion cache, in COMPLETION_CACHE_DIR."""
+    global _idempotency_store
+    if _idempotency_store is None:
+        _idempotency_store = IdempotencyStore(os.path.join(completion_cache_dir(), "idempotency.sqlite3"))
+    return _idempotency_store
+
+
+def shutdown_idempotency_store() -> None:
+    global _idempotency_store
+    if _idempotency_store is not None:
+        _idempotency_store.close()
+        _idempotency_store = None
@@ -0,0 +1,123 @@
+"""
+Token counting for prompt budgeting.
+
+TiktokenCounter is exact for OpenAI models (and close for others) but
+needs the optional tiktoken package; ApproximateTokenCounter mimics BPE
+splitting with a single regex scan, which tracks real counts far better
+than a characters-per-token ratio. count_tokens caches counts per content hash, so
+re-budgeting a large report only tokenizes blocks that changed.
+"""
+
+from abc import ABC, abstractmethod
+from functools import lru_cache
+import os
+import re
+
+from .content_cache import ContentCache, content_hash
+
+TOKEN_COUNT_CACHE = ContentCache(max_entries=65536, max_bytes=8 * 1024 * 1024)
+_COUNT_ENTRY_BYTES = 96
+
+# Words, digit runs, newline runs and punctuation runs; spaces are folded
+# into the following piece, as BPE vocabularies do.
+_PIECE_PATTERN = re.compile(r"[^\W\d]+|\d+|\n+|[^\w\s]+")
+# Common words up to this length are single tokens in BPE vocabularies.
+_SHORT_WORD_CHARS = 10
+
+
+class BaseTokenCounter(ABC):
+    name: str
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        pass
+
+    @abstractmethod
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Return the longest prefix of text that fits in max_tokens."""
+        pass
+
+
+class ApproximateTokenCounter(BaseTokenCounter):
+    name = "approximate"
+
+    def count(self, text: str) -> int:
+        pieces = _PIECE_PATTERN.findall(text)
+        long_pieces = [piece for piece in pieces if len(piece) > _SHORT_WORD_CHARS]
+        return len(pieces) + sum(_piece_tokens(piece) - 1 for piece in long_pieces)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        used = 0
+        for match in _PIECE_PATTERN.finditer(text):
+            piece = match.group()
+            cost = _piece_tokens(piece) if len(piece) > _SHORT_WORD_CHARS else 1
+            if used + cost > max_tokens:
+                # Cut inside a long piece in proportion to the tokens left.
+                keep = (max_tokens - used) * len(piece) // cost
+                return text[:match.start() + keep]
+            used += cost
+        return text
+
+
+class TiktokenCounter(BaseTokenCounter):
+    def __init__(self, encoding: str = "cl100k_base"):
+        try:
+            import tiktoken
+        except ImportError:
+            raise ImportError(
+                "tiktoken package is required. Install with: pip install tiktoken"
+            )
+
+        self.encoding = tiktoken.get_encoding(encoding)
+        self.name = f"tiktoken:{encoding}"
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(name: str | None = None) -> BaseTokenCounter:
+    """
+    Return the token counter named by name or the TOKEN_COUNTER env var.
+
+    Names are "approximate", "tiktoken" and "auto" (the default), which
+    uses tiktoken when it is installed and its encoding loads; the
+    encoding is downloaded on first use, which fails offline.
+    """
+    name = (name or os.getenv("TOKEN_COUNTER") or "auto").lower()
+    if name == "approximate":
+        return ApproximateTokenCounter()
+    if name == "tiktoken":
+        return TiktokenCounter()
+    if name == "auto":
+        try:
+            return TiktokenCounter()
+        except Exception:  # not installed, or the encoding could not be fetched
+            return ApproximateTokenCounter()
+    raise ValueError(f"Unknown token counter: {name}")
+
+
+def count_tokens(text: str, counter: BaseTokenCounter | None = None) -> int:
+    """Count tokens in text, cached by content hash per counter."""
+    counter = counter or get_token_counter()
+    if len(text) < 64:
+        return counter.count(text)
+    return TOKEN_COUNT_CACHE.get_or_compute(
+        (counter.name, content_hash(text)),
+        lambda: counter.count(text),
+        lambda _: _COUNT_ENTRY_BYTES,
+    )
+
+
+def _piece_tokens(piece: str) -> int:
+    if piece.isdigit():
+        return -(-len(piece) // 3)
+    if piece.isascii():
+        return -(-len(piece) // 4)
+    return -(-len(piece) // 2)
@@ -0,0 +1,234 @@
+"""
+Diff two reportVersions snapshots ({"sections": [{..., "blocks": [...]}]}).
+
+Blocks are aligned by blockId, unchanged blocks are skipped by content
+hash, and only changed blocks are diffed, so the cost follows the size of
+the change rather than the size of the report. Blocks whose IDs did not
+survive (restoreVersion re-creates every block) are aligned by content
+with match_blocks. A block counts as moved when it changed section, or
+when it fell out of the longest run of blocks that kept their relative
+order within its section.
+"""
+
+from bisect import bisect_left
+from typing import Any, Iterator
+
+from .batch_diff import diff_pair
+from .block_matcher import match_blocks
+from .content_cache import content_hash
+
+
+def diff_snapshots(
+    old_snapshot: dict,
+    new_snapshot: dict,
+    algorithm: str = "auto",
+    output: str = "spans",
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield one result per section, in new-snapshot order, then removed sections.
+
+    Each result:
+    {
+        "section_id": str,
+        "old_section_id": str | None,
+        "status": "unchanged|changed|added|removed",
+        "heading_text": str,
+        "old_heading_text": str | None,
+        "unchanged_blocks": int,
+        "blocks": [
+            {"status": "changed|added|removed|moved", "block_id", "old_block_id",
+             "moved": bool, "diff": {...}}
+        ]
+    }
+
+    Unchanged blocks are only counted. diff uses the batch diff output
+    formats ("spans" or "operations"); added and removed blocks are
+    diffed against empty text.
+    """
+    old_sections = old_snapshot.get("sections", [])
+    new_sections = new_snapshot.get("sections", [])
+    section_pairs = _align_sections(old_sections, new_sections)
+
+    old_blocks = {}
+    old_positions = {}
+    for section in old_sections:
+        for position, block in enumerate(section.get("blocks", [])):
+            old_blocks[block["blockId"]] = (section["sectionId"], block)
+            old_positions[block["blockId"]] = position
+    new_block_ids = {
+        block["blockId"] for section in new_sections for block in section.get("blocks", [])
+    }
+
+    block_pairs = {block_id: entry for block_id, entry in old_blocks.items() if block_id in new_block_ids}
+    block_pairs.update(_align_orphans(old_blocks, new_sections, new_block_ids))
+    paired_old_ids = {block["blockId"] for _, block in block_pairs.values()}
+
+    removed_by_section: dict[str, list[dict]] = {}
+    for block_id, (section_id, block) in old_blocks.items():
+        if block_id not in paired_old_ids:
+            removed_by_section.setdefault(section_id, []).append(block)
+
+    def removed_entry(block):
+        return {
+            "status": "removed",
+            "block_id": None,
+            "old_block_id": block["blockId"],
+            "moved": False,
+            "diff": diff_pair(block["markdownText"], "", algorithm, output),
+        }
+
+    aligned_old_ids = set()
+    for section in new_sections:
+        old_section = section_pairs.get(section["sectionId"])
+        old_section_id = old_section["sectionId"] if old_section else None
+        if old_section_id:
+            aligned_old_ids.add(old_section_id)
+
+        stayed = [
+            block_pairs[block["blockId"]][1]["blockId"]
+            for block in section.get("blocks", [])
+            if block["blockId"] in block_pairs and block_pairs[block["blockId"]][0] == old_section_id
+        ]
+        reordered = {stayed[i] for i in _out_of_order([old_positions[block_id] for block_id in stayed])}
+
+        entries = []
+        unchanged = 0
+        for block in section.get("blocks", []):
+            paired = block_pairs.get(block["blockId"])
+            if paired is None:
+                entries.append({
+                    "status": "added",
+                    "block_id": block["blockId"],
+                    "old_block_id": None,
+                    "moved": False,
+                    "diff": diff_pair("", block["markdownText"], algorithm, output),
+                })
+                continue
+
+            from_section_id, old_block = paired
+            moved = from_section_id != old_section_id or old_block["blockId"] in reordered
+            if _same_content(old_block, block):
+                if not moved:
+                    unchanged += 1
+                    continue
+                entries.append({
+                    "status": "moved",
+                    "block_id": block["blockId"],
+                    "old_block_id": old_block["blockId"],
+                    "moved": True,
+                    "diff": None,
+                })
+                continue
+
+            entries.append({
+                "status": "changed",
+                "block_id": block["blockId"],
+                "old_block_id": old_block["blockId"],
+                "moved": moved,
+                "diff": diff_pair(old_block["markdownText"], block["markdownText"], algorithm, output),
+            })
+
+        entries.extend(removed_entry(block) for block in removed_by_section.get(old_section_id, []))
+
+        heading_changed = old_section is not None and (
+            old_section.get("headingText") != section.get("headingText")
+            or old_section.get("headingLevel") != section.get("headingLevel")
+        )
+        if old_section is None:
+            status = "added"
+        elif entries or heading_changed:
+            status = "changed"
+        else:
+            status = "unchanged"
+
+        yield {
+            "section_id": section["sectionId"],
+            "old_section_id": old_section_id,
+            "status": status,
+            "heading_text": section.get("headingText"),
+            "old_heading_text": old_section.get("headingText") if old_section else None,
+            "unchanged_blocks": unchanged,
+            "blocks": entries,
+        }
+
+    for old_section in old_sections:
+        if old_section["sectionId"] in aligned_old_ids:
+            continue
+        yield {
+            "section_id": old_section["sectionId"],
+            "old_section_id": old_section["sectionId"],
+            "status": "removed",
+            "heading_text": None,
+            "old_heading_text": old_section.get("headingText"),
+            "unchanged_blocks": 0,
+            "blocks": [removed_entry(block) for block in removed_by_section.get(old_section["sectionId"], [])],
+        }
+
+
+def _same_content(old_block: dict, new_block: dict) -> bool:
+    # A client contentHash is only comparable with another client contentHash.
+    if old_block.get("contentHash") and new_block.get("contentHash"):
+        return old_block["contentHash"] == new_block["contentHash"]
+    return content_hash(old_block["markdownText"]) == content_hash(new_block["markdownText"])
+
+
+def _out_of_order(positions: list[int]) -> set[int]:
+    """Indices of positions outside one longest increasing subsequence."""
+    tails: list[int] = []  # tails[k]: index ending the best increasing run of length k + 1
+    tail_positions: list[int] = []
+    previous = [-1] * len(positions)
+    for i, position in enumerate(positions):
+        k = bisect_left(tail_positions, position)
+        if k:
+            previous[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_positions.append(position)
+        else:
+            tails[k] = i
+            tail_positions[k] = position
+    kept = set()
+    i = tails[-1] if tails else -1
+    while i != -1:
+        kept.add(i)
+        i = previous[i]
+    return set(range(len(positions))) - kept
+
+
+def _align_sections(old_sections: list[dict], new_sections: list[dict]) -> dict[str, dict]:
+    """Map new sectionId -> old section, by sectionId and then by heading text."""
+    old_by_id = {section["sectionId"]: section for section in old_sections}
+    pairs = {}
+    for section in new_sections:
+        if section["sectionId"] in old_by_id:
+            pairs[section["sectionId"]] = old_by_id.pop(section["sectionId"])
+
+    for section in new_sections:
+        if section["sectionId"] in pairs:
+            continue
+        match = next(
+            (old for old in old_by_id.values() if old.get("headingText") == section.get("headingText")),
+            None,
+        )
+        if match is not None:
+            pairs[section["sectionId"]] = old_by_id.pop(match["sectionId"])
+    return pairs
+
+
+def _align_orphans(old_blocks, new_sections, new_block_ids) -> dict[str, tuple[str, dict]]:
+    """Pair blocks whose IDs exist on only one side by content similarity."""
+    orphan_old = [entry for block_id, entry in old_blocks.items() if block_id not in new_block_ids]
+    orphan_new = [
+        block
+        for section in new_sections
+        for block in section.get("blocks", [])
+        if block["blockId"] not in old_blocks
+    ]
+    if not orphan_old or not orphan_new:
+        return {}
+
+    result = match_blocks([block for _, block in orphan_old], orphan_new)
+    return {
+        orphan_new[match["new_index"]]["blockId"]: orphan_old[match["old_index"]]
+        for match in result["matches"]
+    }
@@ -1,13 +1,30 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 
-from sandbox.api import agent_run
+from sandbox.api import agent_run, diff
+from sandbox.core.batch_diff import shutdown_batch_diff_runner
+from sandbox.core.llm_pool import get_llm_registry, shutdown_llm_registry, warm_up_enabled
+from sandbox.core.single_flight import shutdown_idempotency_store
 
 load_dotenv()
 
-app = FastAPI(title="Report Writer Sandbox", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry = get_llm_registry()
+    if warm_up_enabled():
+        await registry.warm_up()
+    yield
+    await shutdown_llm_registry()
+    shutdown_idempotency_store()
+    shutdown_batch_diff_runner()
+
+
+app = FastAPI(title="Report Writer Sandbox", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +35,7 @@ app.add_middleware(
 )
 
 app.include_router(agent_run.router, prefix="/v1")
+app.include_router(diff.router, prefix="/v1")
 
 
 @app.get("/health")
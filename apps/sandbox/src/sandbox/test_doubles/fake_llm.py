@@ -1,4 +1,6 @@
 import json
+from typing import AsyncIterator
+
 from ..core.llm_client import BaseLLMClient
 
 
@@ -8,8 +10,9 @@ class FakeLLM(BaseLLMClient):
     Returns predictable responses based on input.
     """
 
-    def __init__(self, response_map: dict | None = None):
+    def __init__(self, response_map: dict | None = None, chunk_size: int = 8):
         self.response_map = response_map or {}
+        self.chunk_size = chunk_size
         self.call_count = 0
         self.last_messages = None
 
@@ -27,6 +30,12 @@ class FakeLLM(BaseLLMClient):
 
         return json.dumps(self._default_response(last_message))
 
+    async def stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """Yield the complete() response in chunk_size pieces."""
+        response = await self.complete(messages)
+        for start in range(0, len(response), self.chunk_size):
+            yield response[start:start + self.chunk_size]
+
     def _default_response(self, message: str) -> dict:
         if "rewrite" in message or "edit" in message:
             return {
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# The agent endpoint creates its LLM client from the environment; never reach a real provider in tests.
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["DENSE_INDEX_DIR"] = tempfile.mkdtemp(prefix="sandbox-dense-index-")
+os.environ["COMPLETION_CACHE_DIR"] = tempfile.mkdtemp(prefix="sandbox-completion-cache-")
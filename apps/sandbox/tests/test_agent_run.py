@@ -1,7 +1,18 @@
+import json
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 from sandbox.main import app
-from sandbox.api.agent_run import AgentRunRequest, Context, Message, Section, Block
+from sandbox.api.agent_run import (
+    AgentRunRequest,
+    Context,
+    Message,
+    Section,
+    Block,
+    get_llm_client,
+    parse_agent_response,
+)
+from sandbox.test_doubles.fake_llm import FakeLLM
 
 
 client = TestClient(app)
@@ -157,3 +168,328 @@ def test_agent_run_proposed_edits_format():
         assert "new_markdown_text" in edit
         assert isinstance(edit["block_id"], str)
         assert isinstance(edit["new_markdown_text"], str)
+
+
+def _run_with_llm(llm, content, blocks):
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    try:
+        return client.post("/v1/agent/run", json={
+            "thread_id": "test-thread-patch",
+            "messages": [{"role": "user", "content": content}],
+            "context": {"sections": [], "blocks": blocks},
+        })
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_agent_run_applies_patch_edits():
+    llm = FakeLLM(response_map={"fix": {
+        "message": "Fixed the count.",
+        "proposedEdits": [{
+            "type": "block",
+            "id": "block-1",
+            "action": "patch",
+            "patches": [{"search": "40 sites", "replace": "42 sites"}],
+        }],
+    }})
+
+    response = _run_with_llm(
+        llm, "Fix the site count", [{"id": "block-1", "markdown_text": "We sampled 40 sites in 2020."}]
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "agent_message": "Fixed the count.",
+        "proposed_edits": [{"block_id": "block-1", "new_markdown_text": "We sampled 42 sites in 2020."}],
+        "document_revision": None,
+    }
+    assert llm.call_count == 1
+
+
+def test_agent_run_retries_failed_patch_with_full_text():
+    llm = FakeLLM(response_map={
+        "complete new content": {
+            "message": "Full text.",
+            "proposedEdits": [{"type": "block", "id": "block-1", "action": "update", "content": "Rewritten."}],
+        },
+        "fix": {
+            "message": "Fixed the count.",
+            "proposedEdits": [{
+                "type": "block",
+                "id": "block-1",
+                "action": "patch",
+                "patches": [{"search": "50 sites", "replace": "52 sites"}],
+            }],
+        },
+    })
+
+    response = _run_with_llm(
+        llm, "Fix the site count", [{"id": "block-1", "markdown_text": "We sampled 40 sites in 2020."}]
+    )
+
+    data = response.json()
+    assert data["agent_message"] == "Fixed the count."
+    assert data["proposed_edits"] == [{"block_id": "block-1", "new_markdown_text": "Rewritten."}]
+    assert llm.call_count == 2
+
+
+def test_agent_run_ignores_unknown_blocks():
+    llm = FakeLLM(response_map={"rewrite": {
+        "message": "Done.",
+        "proposedEdits": [{"type": "block", "id": "missing", "action": "update", "content": "x"}],
+    }})
+
+    response = _run_with_llm(llm, "Rewrite", [{"id": "block-1", "markdown_text": "Text"}])
+
+    assert response.json()["proposed_edits"] == []
+
+
+def test_parse_agent_response_handles_fences_and_plain_text():
+    fenced = '```json\n{"message": "Hi", "proposedEdits": []}\n```'
+
+    assert parse_agent_response(fenced) == {"message": "Hi", "proposedEdits": []}
+    assert parse_agent_response("Just text") == {"message": "Just text", "proposedEdits": []}
+
+
+def test_agent_run_includes_artifact_digests(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_ROOT", str(tmp_path))
+    (tmp_path / "sites.csv").write_text("site,rainfall\nA,1\nB,3\n")
+    llm = FakeLLM()
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    try:
+        response = client.post("/v1/agent/run", json={
+            "thread_id": "test-thread-artifacts",
+            "messages": [{"role": "user", "content": "Summarize the data"}],
+            "context": {
+                "sections": [],
+                "blocks": [],
+                "artifacts": [{"id": "art-1", "name": "Sites", "path": "sites.csv"}],
+            },
+        })
+        outside = client.post("/v1/agent/run", json={
+            "thread_id": "test-thread-artifacts",
+            "messages": [{"role": "user", "content": "Summarize the data"}],
+            "context": {
+                "sections": [],
+                "blocks": [],
+                "artifacts": [{"id": "art-2", "name": "Secrets", "path": "../secrets.csv"}],
+            },
+        })
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    prompt = "\n".join(message["content"] for message in llm.last_messages)
+    assert "- art-1: Sites" in prompt
+    assert "- rainfall: numeric, min 1, max 3, mean 2" in prompt
+    assert outside.status_code == 422
+
+
+def test_agent_run_compact_encoding_maps_aliases_back(monkeypatch):
+    monkeypatch.setenv("PROMPT_ENCODING", "compact")
+    llm = FakeLLM(response_map={"fix": {
+        "message": "Fixed.",
+        "proposedEdits": [{"type": "block", "id": "b2", "action": "patch",
+                           "patches": [{"search": "40", "replace": "42"}]}],
+    }})
+
+    response = _run_with_llm(llm, "Fix the count", [
+        {"id": "jd7f3k2m9x8q4r5t6w3y7z1c0d2e4f6g", "markdown_text": "Intro."},
+        {"id": "jd7a1b2c3d4e5f6g7h8i9j0k1l2m3n4o", "markdown_text": "We sampled 40 sites."},
+    ])
+
+    assert "[b2]" in llm.last_messages[1]["content"]
+    assert "jd7a1b2c3d4e5f6g7h8i9j0k1l2m3n4o" not in llm.last_messages[1]["content"]
+    assert response.json()["proposed_edits"] == [
+        {"block_id": "jd7a1b2c3d4e5f6g7h8i9j0k1l2m3n4o", "new_markdown_text": "We sampled 42 sites."}
+    ]
+
+
+def test_agent_run_fan_out_prompts_each_section():
+    llm = FakeLLM(response_map={"tighten": {
+        "message": "Tightened.",
+        "proposedEdits": [
+            {"type": "block", "id": "intro-1", "action": "update", "content": "Short intro."},
+            {"type": "block", "id": "results-1", "action": "update", "content": "Short results."},
+        ],
+    }})
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    try:
+        response = client.post("/v1/agent/run", json={
+            "thread_id": "test-thread-fan-out",
+            "messages": [{"role": "user", "content": "Tighten every section"}],
+            "context": {
+                "sections": [{"id": "intro", "title": "Introduction"}, {"id": "results", "title": "Results"}],
+                "blocks": [
+                    {"id": "results-1", "markdown_text": "Long results.", "section_id": "results"},
+                    {"id": "intro-1", "markdown_text": "Long intro.", "section_id": "intro"},
+                ],
+            },
+            "fan_out": True,
+        })
+    finally:
+        app.dependency_overrides.clear()
+
+    data = response.json()
+    assert llm.call_count == 2
+    assert data["agent_message"] == "Introduction: Tightened.\n\nResults: Tightened."
+    assert data["proposed_edits"] == [
+        {"block_id": "intro-1", "new_markdown_text": "Short intro."},
+        {"block_id": "results-1", "new_markdown_text": "Short results."},
+    ]
+
+
+def _sse_events(body):
+    events = []
+    for chunk in body.strip().split("\n\n"):
+        event, data = chunk.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_agent_run_stream_sends_message_edits_then_result():
+    llm = FakeLLM(response_map={"fix": {
+        "message": "Fixed the count.",
+        "proposedEdits": [
+            {"type": "block", "id": "block-1", "action": "patch", "patches": [{"search": "40", "replace": "42"}]},
+            {"type": "block", "id": "block-2", "action": "patch", "patches": [{"search": "missing", "replace": "x"}]},
+        ],
+    }})
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    try:
+        response = client.post("/v1/agent/run/stream", json={
+            "thread_id": "test-thread-stream",
+            "messages": [{"role": "user", "content": "Fix the count"}],
+            "context": {"sections": [], "blocks": [
+                {"id": "block-1", "markdown_text": "We sampled 40 sites."},
+                {"id": "block-2", "markdown_text": "Unchanged."},
+            ]},
+        })
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _sse_events(response.text)
+    kinds = [event for event, _ in events]
+    assert kinds.index("edit") < len(kinds) - 1 and kinds[-1] == "result"
+    assert "".join(data["text"] for event, data in events if event == "message") == "Fixed the count."
+    [edit] = [data for event, data in events if event == "edit"]
+    assert edit["block_id"] == "block-1"
+    assert edit["new_markdown_text"] == "We sampled 42 sites."
+    assert ["-", 2] in edit["diff"]["spans"] and ["+", 2] in edit["diff"]["spans"]
+    assert events[-1][1]["proposed_edits"][0] == {"block_id": "block-1", "new_markdown_text": "We sampled 42 sites."}
+
+
+def test_agent_run_stream_validates_before_streaming():
+    response = client.post("/v1/agent/run/stream", json={
+        "thread_id": "test-thread-stream",
+        "messages": [],
+        "delta": {"base_revision": "missing", "revision": "r2"},
+    })
+
+    assert response.status_code == 409
+
+
+def test_agent_run_replays_idempotent_requests():
+    llm = FakeLLM()
+    body = {
+        "thread_id": "test-thread-idempotent",
+        "messages": [{"role": "user", "content": "Rewrite the summary"}],
+        "context": {"sections": [], "blocks": [{"id": "block-1", "markdown_text": "Summary."}]},
+    }
+    app.dependency_overrides[get_llm_client] = lambda: llm
+    try:
+        first = client.post("/v1/agent/run", json=body, headers={"Idempotency-Key": "run-idempotent-1"})
+        retry = client.post("/v1/agent/run", json=body, headers={"Idempotency-Key": "run-idempotent-1"})
+        reused = client.post(
+            "/v1/agent/run",
+            json={**body, "messages": [{"role": "user", "content": "Rewrite the intro"}]},
+            headers={"Idempotency-Key": "run-idempotent-1"},
+        )
+        unkeyed = client.post("/v1/agent/run", json=body)
+    finally:
+        app.dependency_overrides.clear()
+
+    assert first.status_code == 200
+    assert retry.json() == first.json()
+    assert reused.status_code == 422
+    assert unkeyed.status_code == 200
+    assert llm.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_agent_run_reserves_idempotency_keys_on_arrival():
+    import asyncio
+
+    from sandbox.api.agent_run import agent_run
+
+    class SlowLLM(FakeLLM):
+        async def complete(self, messages):
+            await asyncio.sleep(0.05)
+            return await super().complete(messages)
+
+    llm = SlowLLM()
+    request = AgentRunRequest(
+        thread_id="test-thread-reserve",
+        messages=[Message(role="user", content="Rewrite the summary")],
+        context=Context(sections=[], blocks=[Block(id="block-1", markdown_text="Summary.")]),
+    )
+    changed = request.model_copy(update={"messages": [Message(role="user", content="Rewrite the intro")]})
+    other_thread = request.model_copy(update={"thread_id": "test-thread-reserve-2"})
+
+    first = asyncio.ensure_future(agent_run(request, llm, idempotency_key="run-reserve-1"))
+    await asyncio.sleep(0.01)
+    with pytest.raises(HTTPException) as reused:
+        await agent_run(changed, llm, idempotency_key="run-reserve-1")
+    second = await agent_run(request, llm, idempotency_key="run-reserve-1")
+    scoped = await agent_run(other_thread, llm, idempotency_key="run-reserve-1")
+
+    assert reused.value.status_code == 422
+    assert second.model_dump() == (await first).model_dump()
+    assert scoped.agent_message
+    assert llm.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_agent_run_coalesces_concurrent_identical_requests():
+    import asyncio
+
+    from sandbox.api.agent_run import agent_run
+
+    class SlowLLM(FakeLLM):
+        async def complete(self, messages):
+            await asyncio.sleep(0.01)
+            return await super().complete(messages)
+
+    llm = SlowLLM()
+    request = AgentRunRequest(
+        thread_id="test-thread-coalesce",
+        messages=[Message(role="user", content="Rewrite the summary")],
+        context=Context(sections=[], blocks=[Block(id="block-1", markdown_text="Summary.")]),
+    )
+
+    first, second = await asyncio.gather(
+        agent_run(request, llm, idempotency_key=None), agent_run(request, llm, idempotency_key=None)
+    )
+    third = await agent_run(request, llm, idempotency_key=None)
+
+    assert first is second
+    assert third.model_dump() == first.model_dump()
+    assert llm.call_count == 2
+
+
+def test_agent_run_caches_only_usable_replies():
+    from sandbox.core.completion_cache import CachedLLMClient, CompletionCache
+
+    llm = FakeLLM(response_map={"refuse": "I cannot help with that.", "shorten": {
+        "message": "Shortened.",
+        "proposedEdits": [{"type": "block", "id": "block-1", "action": "update", "content": "Short."}],
+    }})
+    cached = CachedLLMClient(llm, CompletionCache())
+
+    for content in ["Please refuse", "Please refuse", "Shorten it", "Shorten it"]:
+        response = _run_with_llm(cached, content, [{"id": "block-1", "markdown_text": "A long block."}])
+        assert response.status_code == 200
+
+    assert llm.call_count == 3
@@ -0,0 +1,265 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+from sandbox.core import artifact_ingest
+from sandbox.core.artifact_ingest import (
+    artifact_kind,
+    digest_artifact,
+    fetch_artifact,
+    open_artifact,
+    resolve_local_artifact,
+)
+from sandbox.core.token_counter import ApproximateTokenCounter
+
+
+@pytest.fixture(autouse=True)
+def _clear_digest_cache():
+    artifact_ingest.DIGEST_CACHE.clear()
+    artifact_ingest.FILE_HASH_CACHE.clear()
+    yield
+    artifact_ingest.DIGEST_CACHE.clear()
+    artifact_ingest.FILE_HASH_CACHE.clear()
+
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_artifact_kind_from_mime_type_or_extension():
+    assert artifact_kind("data.bin", "text/csv") == "csv"
+    assert artifact_kind("page.htm") == "html"
+    assert artifact_kind("report.PDF") == "pdf"
+    assert artifact_kind("notes") == "text"
+
+
+def test_csv_digest_has_schema_stats_and_samples(tmp_path):
+    rows = "\n".join(f"site-{i},{i * 1.5},{'north' if i % 2 else 'south'}" for i in range(20))
+    path = _write(tmp_path, "sites.csv", "site,rainfall,region\n" + rows + "\n")
+
+    digest = digest_artifact(path, token_counter=ApproximateTokenCounter())
+
+    assert digest.startswith("CSV with 3 columns and 20 rows.")
+    assert "- rainfall: numeric, min 0, max 28.5, mean 14.25" in digest
+    assert "- region: text, 2 distinct" in digest
+    assert "site-4,6.0,south" in digest
+    assert "site-5," not in digest
+
+
+def test_csv_statistics_are_capped_but_row_count_is_exact(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifact_ingest, "STATS_MAX_ROWS", 10)
+    path = _write(tmp_path, "big.csv", "n\n" + "\n".join(str(i) for i in range(50)))
+
+    digest = digest_artifact(path, token_counter=ApproximateTokenCounter())
+
+    assert "about 50 rows" in digest
+    assert "Statistics cover the first 10 rows." in digest
+    assert "max 9," in digest
+
+
+def test_html_digest_skips_scripts_and_stops_at_budget(tmp_path):
+    body = "".join(f"<p>Paragraph {i} about rainfall.</p>" for i in range(5000))
+    path = _write(tmp_path, "page.html", f"<html><script>var x = 1;</script><h2>Results</h2>{body}</html>")
+    counter = ApproximateTokenCounter()
+
+    digest = digest_artifact(path, max_tokens=50, token_counter=counter)
+
+    assert "var x" not in digest
+    assert digest.startswith("## Results")
+    assert counter.count(digest) <= 50
+
+
+def test_digest_is_cached_by_content(tmp_path, monkeypatch):
+    path = _write(tmp_path, "notes.txt", "Some notes.")
+    counter = ApproximateTokenCounter()
+    digest_artifact(path, token_counter=counter)
+
+    calls = []
+    monkeypatch.setattr(artifact_ingest, "_digest_text", lambda *args: calls.append(args) or "")
+    copy = _write(tmp_path, "copy.txt", "Some notes.")
+
+    assert digest_artifact(copy, token_counter=counter) == "Some notes."
+    assert calls == []
+
+
+def test_file_hash_rereads_only_changed_files(tmp_path, monkeypatch):
+    import os
+
+    path = _write(tmp_path, "notes.txt", "Some notes.")
+    reads = []
+    hash_file = artifact_ingest._hash_file
+    monkeypatch.setattr(artifact_ingest, "_hash_file", lambda p: reads.append(p) or hash_file(p))
+
+    first = artifact_ingest.file_hash(path)
+    assert artifact_ingest.file_hash(path) == first
+    assert len(reads) == 1
+
+    _write(tmp_path, "notes.txt", "Other notes")
+    os.utime(path, ns=(0, 1))
+    assert artifact_ingest.file_hash(path) != first
+    assert len(reads) == 2
+
+
+def test_pdf_without_pypdf_raises_import_error(tmp_path, monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def fake_import(name, *args, **kwargs):
+        if name == "pypdf":
+            raise ImportError
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", fake_import)
+    path = _write(tmp_path, "report.pdf", "%PDF-1.4")
+
+    with pytest.raises(ImportError, match="pip install pypdf"):
+        digest_artifact(path)
+
+
+def test_local_artifacts_must_stay_under_root(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_ROOT", str(tmp_path))
+
+    assert resolve_local_artifact("data/a.csv") == str(tmp_path / "data" / "a.csv")
+    with pytest.raises(ValueError):
+        resolve_local_artifact("../etc/passwd")
+
+    monkeypatch.delenv("ARTIFACT_ROOT")
+    with pytest.raises(ValueError):
+        resolve_local_artifact("data/a.csv")
+
+
+def _serve(monkeypatch, handler):
+    """Route the artifact downloader's httpx client through handler."""
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(
+        artifact_ingest.httpx,
+        "AsyncClient",
+        lambda **kwargs: async_client(transport=httpx.MockTransport(handler), **kwargs),
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch_artifact_only_reaches_allowed_hosts(tmp_path, monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(str(request.url))
+        if request.url.host == "files.example.com":
+            return httpx.Response(302, headers={"location": "http://169.254.169.254/latest/meta-data"})
+        return httpx.Response(200, content=b"data")
+
+    _serve(monkeypatch, handler)
+    with pytest.raises(ValueError, match="ARTIFACT_HOSTS is not configured"):
+        await fetch_artifact("https://files.example.com/a.csv", str(tmp_path))
+
+    monkeypatch.setenv("ARTIFACT_HOSTS", ".example.com")
+    with pytest.raises(ValueError, match="scheme"):
+        await fetch_artifact("file:///etc/passwd", str(tmp_path))
+    with pytest.raises(ValueError, match="169.254.169.254"):
+        await fetch_artifact("https://files.example.com/a.csv", str(tmp_path))
+    assert requests == ["https://files.example.com/a.csv"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_artifact_refuses_oversized_downloads(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_HOSTS", "files.example.com")
+    monkeypatch.setenv("ARTIFACT_MAX_BYTES", "10")
+
+    async def chunks():
+        for _ in range(4):
+            yield b"12345"
+
+    _serve(monkeypatch, lambda request: httpx.Response(200, content=chunks()))
+
+    with pytest.raises(ValueError, match="larger than 10 bytes"):
+        await fetch_artifact("https://files.example.com/big.csv", str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_fetch_artifact_revalidates_cached_downloads(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_HOSTS", "files.example.com")
+    versions = {"etag": '"v1"', "body": b"first"}
+    conditional = []
+
+    def handler(request):
+        conditional.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == versions["etag"]:
+            return httpx.Response(304)
+        return httpx.Response(200, content=versions["body"], headers={"etag": versions["etag"]})
+
+    _serve(monkeypatch, handler)
+    url = "https://files.example.com/a.txt"
+
+    path = await fetch_artifact(url, str(tmp_path))
+    assert open(path, "rb").read() == b"first"
+    assert await fetch_artifact(url, str(tmp_path)) == path
+
+    versions.update(etag='"v2"', body=b"second")
+    assert await fetch_artifact(url, str(tmp_path)) == path
+    assert open(path, "rb").read() == b"second"
+    assert conditional == [None, '"v1"', '"v1"']
+
+
+@pytest.mark.asyncio
+async def test_fetch_artifact_prunes_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_HOSTS", "files.example.com")
+    monkeypatch.setenv("ARTIFACT_CACHE_MAX_BYTES", "15")
+    _serve(monkeypatch, lambda request: httpx.Response(200, content=b"0123456789"))
+
+    first = await fetch_artifact("https://files.example.com/1", str(tmp_path))
+    second = await fetch_artifact("https://files.example.com/2", str(tmp_path))
+
+    assert not (tmp_path / first).exists()
+    assert open(second, "rb").read() == b"0123456789"
+
+
+@pytest.mark.asyncio
+async def test_fetch_artifact_does_not_prune_files_in_use(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_HOSTS", "files.example.com")
+    monkeypatch.setenv("ARTIFACT_CACHE_MAX_BYTES", "15")
+    _serve(monkeypatch, lambda request: httpx.Response(200, content=b"0123456789"))
+
+    async with open_artifact("https://files.example.com/1", str(tmp_path)) as first:
+        second = await fetch_artifact("https://files.example.com/2", str(tmp_path))
+        assert open(first, "rb").read() == b"0123456789"
+        assert open(second, "rb").read() == b"0123456789"
+
+    third = await fetch_artifact("https://files.example.com/3", str(tmp_path))
+    assert {path.name for path in tmp_path.iterdir() if not path.name.endswith(".json")} == {
+        os.path.basename(third)
+    }
+
+
+@pytest.mark.asyncio
+async def test_concurrent_fetches_of_one_url_use_separate_partial_files(tmp_path, monkeypatch):
+    monkeypatch.setenv("ARTIFACT_HOSTS", "files.example.com")
+    started = asyncio.Event()
+    writers = []
+
+    async def chunks(body):
+        writers.append(body)
+        if len(writers) == 2:
+            started.set()
+        await started.wait()
+        for byte in body:
+            yield bytes([byte])
+            await asyncio.sleep(0)
+
+    bodies = iter([b"first version", b"second version"])
+    _serve(monkeypatch, lambda request: httpx.Response(200, content=chunks(next(bodies))))
+    url = "https://files.example.com/a.txt"
+
+    async def fetch_and_read():
+        async with open_artifact(url, str(tmp_path)) as path:
+            return open(path, "rb").read()
+
+    contents = await asyncio.gather(fetch_and_read(), fetch_and_read())
+
+    # Either download may land last, but neither is interleaved with the other.
+    assert set(contents) <= {b"first version", b"second version"}
+    assert not [path for path in tmp_path.iterdir() if path.name.endswith(".part")]
@@ -0,0 +1,125 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+from fastapi.testclient import TestClient
+from sandbox.main import app
+from sandbox.core.batch_diff import BatchDiffRunner, diff_pair
+from sandbox.core.diff_engine import compute_block_diff
+
+
+client = TestClient(app)
+
+
+@pytest.mark.asyncio
+async def test_runner_yields_results_in_order():
+    runner = BatchDiffRunner(max_workers=1, inline_max_chars=50)
+    pairs = [
+        ("Hello world", "Hello universe"),
+        ("word " * 40, "word " * 39 + "changed "),
+        ("Same", "Same"),
+    ]
+
+    try:
+        results = [result async for result in runner.run(pairs)]
+    finally:
+        runner.shutdown()
+
+    assert results == [compute_block_diff(old, new) for old, new in pairs]
+
+
+@pytest.mark.asyncio
+async def test_runner_inline_only_does_not_start_pool():
+    runner = BatchDiffRunner(inline_max_chars=10_000)
+
+    results = [result async for result in runner.run([("a b", "a c")])]
+
+    assert len(results) == 1
+    assert runner._executor is None
+
+
+@pytest.mark.asyncio
+async def test_runner_budgets_inline_work_across_the_batch(monkeypatch):
+    submitted = []
+
+    class RecordingExecutor:
+        def submit(self, fn, *args):
+            submitted.append(args[:2])
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    runner = BatchDiffRunner(inline_max_chars=50)
+    monkeypatch.setattr(runner, "_get_executor", RecordingExecutor)
+    pairs = [(f"old {i} text", f"new {i} text") for i in range(5)]  # 20 chars each
+
+    results = [result async for result in runner.run(pairs)]
+
+    assert results == [compute_block_diff(old, new) for old, new in pairs]
+    assert submitted == pairs[2:]
+
+
+def test_diff_pair_spans_output():
+    result = diff_pair("Hello world", "Hello universe", output="spans")
+
+    assert result["spans"] == [["=", 6], ["-", 5], ["+", 8]]
+
+
+def test_diff_batch_endpoint_streams_ndjson():
+    request_data = {
+        "pairs": [
+            {"old_text": "Hello world", "new_text": "Hello universe"},
+            {"old_text": "", "new_text": "New text"},
+        ]
+    }
+
+    response = client.post("/v1/diff/batch", json=request_data)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["index"] for line in lines] == [0, 1]
+    assert lines[0]["diff"] == compute_block_diff("Hello world", "Hello universe")
+    assert all(op["type"] == "add" for op in lines[1]["diff"]["operations"])
+
+
+def test_diff_batch_endpoint_spans_output():
+    request_data = {
+        "pairs": [{"old_text": "Hello world", "new_text": "Hello universe"}],
+        "output": "spans",
+    }
+
+    response = client.post("/v1/diff/batch", json=request_data)
+
+    line = json.loads(response.text)
+    assert line["diff"]["spans"] == [["=", 6], ["-", 5], ["+", 8]]
+
+
+def test_diff_batch_endpoint_rejects_unknown_algorithm():
+    request_data = {
+        "pairs": [{"old_text": "a", "new_text": "b"}],
+        "algorithm": "nope",
+    }
+
+    response = client.post("/v1/diff/batch", json=request_data)
+
+    assert response.status_code == 422
+
+
+def test_diff_batch_endpoint_empty_batch():
+    response = client.post("/v1/diff/batch", json={"pairs": []})
+
+    assert response.status_code == 200
+    assert response.text == ""
+
+
+def test_diff_cache_stats_endpoint():
+    client.post("/v1/diff/batch", json={"pairs": [{"old_text": "stats a", "new_text": "stats b"}]})
+
+    response = client.get("/v1/diff/cache/stats")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert set(data) == {"tokens", "diffs"}
+    assert data["diffs"]["misses"] >= 1
+    assert {"hits", "misses", "bytes", "max_bytes", "entries"} <= set(data["tokens"])
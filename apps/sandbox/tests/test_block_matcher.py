@@ -0,0 +1,134 @@
+import random
+import time
+
+import numpy as np
+from sandbox.core.block_matcher import match_blocks, minhash_signatures, similarity_matrix
+
+
+def _blocks(prefix, texts):
+    return [{"blockId": f"{prefix}{i}", "markdownText": text} for i, text in enumerate(texts)]
+
+
+PARAGRAPHS = [
+    "Climate change is altering the distribution of many bird species across Europe.",
+    "We sampled forty sites over three breeding seasons using standard point counts.",
+    "Population trends were estimated with generalised additive models per species.",
+    "Northern species declined while southern species expanded their ranges north.",
+    "These results suggest conservation planning must anticipate shifting ranges.",
+]
+
+
+def test_identical_documents_match_in_place():
+    old = _blocks("b", PARAGRAPHS)
+
+    result = match_blocks(old, old)
+
+    assert [(m["old_index"], m["new_index"]) for m in result["matches"]] == [(i, i) for i in range(5)]
+    assert not any(m["moved"] or m["rewritten"] for m in result["matches"])
+    assert result["deleted"] == [] and result["inserted"] == []
+
+
+def test_detects_moved_block():
+    old = _blocks("b", PARAGRAPHS)
+    new = [old[0], old[2], old[3], old[1], old[4]]
+
+    result = match_blocks(old, new)
+
+    moved = [m for m in result["matches"] if m["moved"]]
+    assert [(m["old_block_id"], m["new_index"]) for m in moved] == [("b1", 3)]
+    assert result["deleted"] == [] and result["inserted"] == []
+
+
+def test_detects_rewritten_block_with_new_id():
+    old = _blocks("b", PARAGRAPHS)
+    new = _blocks("n", PARAGRAPHS)
+    new[2]["markdownText"] = (
+        "Population trends were estimated with generalised additive models per taxon."
+    )
+
+    result = match_blocks(old, new)
+
+    rewritten = [m for m in result["matches"] if m["rewritten"]]
+    assert len(rewritten) == 1
+    assert (rewritten[0]["old_index"], rewritten[0]["new_index"]) == (2, 2)
+    assert 0.5 <= rewritten[0]["similarity"] < 1.0
+    assert rewritten[0]["new_block_id"] == "n2"
+
+
+def test_unrelated_blocks_are_deleted_and_inserted():
+    old = _blocks("b", PARAGRAPHS[:2])
+    new = _blocks("n", [PARAGRAPHS[0], "Completely different text about something else entirely."])
+
+    result = match_blocks(old, new)
+
+    assert result["deleted"] == [1]
+    assert result["inserted"] == [1]
+
+
+def test_reports_near_duplicates():
+    old = _blocks("b", [PARAGRAPHS[0]])
+    new = _blocks("n", [PARAGRAPHS[0] + " Indeed.", PARAGRAPHS[0] + " Truly."])
+
+    result = match_blocks(old, new)
+
+    assert len(result["matches"]) == 1
+    assert result["inserted"] == [1 - result["matches"][0]["new_index"]]
+    assert len(result["near_duplicates"]) == 1
+
+
+def test_near_duplicates_keep_one_pair_per_unmatched_block():
+    old = _blocks("b", [PARAGRAPHS[0] + f" Variant {i}." for i in range(20)])
+    new = _blocks("n", [PARAGRAPHS[0] + f" Version {i}." for i in range(25)])
+
+    result = match_blocks(old, new)
+
+    assert len(result["matches"]) == 20
+    assert len(result["near_duplicates"]) == 5
+    assert sorted(pair["new_index"] for pair in result["near_duplicates"]) == result["inserted"]
+
+
+def test_identical_text_prefers_same_block_id():
+    old = _blocks("b", ["Same text here.", "Same text here."])
+    new = [{"blockId": "b1", "markdownText": "Same text here."}]
+
+    result = match_blocks(old, new)
+
+    assert result["matches"][0]["old_index"] == 1
+    assert result["deleted"] == [0]
+
+
+def test_empty_texts_never_fuzzy_match():
+    similarity = similarity_matrix(["", "a b c"], ["", "x y z"])
+
+    assert similarity[0, 0] == 0
+    assert similarity[0, 1] == 0
+
+
+def test_signatures_shape_and_determinism():
+    signatures = minhash_signatures(PARAGRAPHS)
+
+    assert signatures.shape == (5, 64)
+    assert signatures.dtype == np.uint32
+    assert np.array_equal(signatures, minhash_signatures(PARAGRAPHS))
+
+
+def test_thousand_blocks_restructured_quickly():
+    rng = random.Random(3)
+    vocabulary = [f"w{i}" for i in range(3000)]
+    texts = [" ".join(rng.choice(vocabulary) for _ in range(60)) for _ in range(1000)]
+    old = _blocks("b", texts)
+    new = _blocks("n", texts)
+    rng.shuffle(new)
+    for block in new[:300]:
+        block["markdownText"] += " an appended sentence"
+
+    start = time.perf_counter()
+    result = match_blocks(old, new)
+    elapsed = time.perf_counter() - start
+
+    assert len(result["matches"]) == 1000
+    assert all(
+        old[m["old_index"]]["markdownText"] in new[m["new_index"]]["markdownText"]
+        for m in result["matches"]
+    )
+    assert elapsed < 5.0
@@ -0,0 +1,60 @@
+from sandbox.core.bm25_index import BM25Index, get_project_index, tokenize
+
+
+def _index(*blocks):
+    index = BM25Index()
+    index.sync([{"id": block_id, "content": text, "section_title": title} for block_id, title, text in blocks])
+    return index
+
+
+def test_tokenize_drops_stopwords_and_case():
+    assert tokenize("The Species of the Forest") == ["species", "forest"]
+
+
+def test_search_ranks_matching_blocks_first():
+    index = _index(
+        ("b1", "Introduction", "Forests cover a third of the land."),
+        ("b2", "Methods", "We counted beetle species in forty plots."),
+        ("b3", "Results", "Beetle species richness rose with canopy cover."),
+    )
+
+    ranked = index.search("beetle species richness")
+
+    assert [block_id for block_id, _ in ranked] == ["b3", "b2"]
+
+
+def test_section_title_is_searchable():
+    index = _index(
+        ("b1", "Introduction", "Some opening text."),
+        ("b2", "Conclusion", "Overall the effect was small."),
+    )
+
+    assert index.search("conclusion")[0][0] == "b2"
+
+
+def test_sync_is_incremental():
+    index = _index(("b1", "", "alpha beta"), ("b2", "", "gamma delta"))
+
+    changed = index.sync([
+        {"id": "b1", "content": "alpha beta"},
+        {"id": "b3", "content": "epsilon"},
+    ])
+
+    assert changed == 2
+    assert "b2" not in index
+    assert index.search("gamma") == []
+    assert index.search("epsilon")[0][0] == "b3"
+    assert index.sync([{"id": "b1", "content": "alpha beta"}, {"id": "b3", "content": "epsilon"}]) == 0
+
+
+def test_update_replaces_old_terms():
+    index = _index(("b1", "", "old words"))
+
+    assert index.upsert("b1", "new words")
+    assert index.search("old") == []
+    assert index.search("new")[0][0] == "b1"
+
+
+def test_project_indexes_are_shared_per_project():
+    assert get_project_index("project-a") is get_project_index("project-a")
+    assert get_project_index("project-a") is not get_project_index("project-b")
@@ -0,0 +1,198 @@
+import pytest
+
+from sandbox.core import completion_cache
+from sandbox.core.completion_cache import CachedLLMClient, CompletionCache, completion_key
+from sandbox.core.llm_pool import LLMClientRegistry
+from sandbox.test_doubles.fake_llm import FakeLLM
+
+MESSAGES = [
+    {"role": "system", "content": "You edit reports.", "cache": True},
+    {"role": "user", "content": "Rewrite  the\nintro"},
+]
+
+
+def test_completion_key_is_canonical():
+    reordered = [{"content": m["content"], **m} for m in MESSAGES]
+
+    assert completion_key("gpt-4", MESSAGES) == completion_key("gpt-4", reordered)
+    assert completion_key("gpt-4", MESSAGES) != completion_key("gpt-4o", MESSAGES)
+    assert completion_key("gpt-4", MESSAGES, {"max_tokens": 10}) != completion_key("gpt-4", MESSAGES)
+
+
+def test_normalized_key_ignores_whitespace_differences():
+    spaced = [{**MESSAGES[0]}, {"role": "user", "content": " Rewrite the intro\n"}]
+
+    assert completion_key("m", MESSAGES) != completion_key("m", spaced)
+    assert completion_key("m", MESSAGES, normalize=True) == completion_key("m", spaced, normalize=True)
+    assert completion_key("m", MESSAGES, normalize=True) != completion_key("m", MESSAGES)
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "completions.sqlite3")
+    cache = CompletionCache(path)
+    cache.put("k", "reply")
+    cache.close()
+
+    reopened = CompletionCache(path)
+
+    assert reopened.get("k") == "reply"
+    assert reopened.stats()["disk"]["hits"] == 1
+    assert reopened.get("k") == "reply"
+    assert reopened.stats()["disk"]["hits"] == 1  # served from memory
+    reopened.close()
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(completion_cache.time, "time", lambda: now[0])
+    cache = CompletionCache(str(tmp_path / "c.sqlite3"), ttl=60)
+    cache.put("k", "reply")
+
+    now[0] += 59
+    assert cache.get("k") == "reply"
+    now[0] += 2
+    assert cache.get("k") is None
+    cache.put("other", "reply")
+    assert cache.stats()["disk"]["entries"] == 1
+    cache.close()
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(completion_cache.time, "time", lambda: now[0])
+    cache = CompletionCache(str(tmp_path / "c.sqlite3"), max_bytes=3 * (100 + 64))
+    for key in "abc":
+        now[0] += 1
+        cache.put(key, key * 100)
+    cache.memory.clear()
+    now[0] += 1
+    assert cache.get("a") == "a" * 100
+
+    now[0] += 1
+    cache.put("d", "d" * 100)
+
+    cache.memory.clear()
+    assert cache.get("b") is None
+    assert [cache.get(key) is not None for key in "acd"] == [True, True, True]
+    cache.close()
+
+
+def test_disk_tier_is_private(tmp_path):
+    import os
+    import stat
+
+    path = tmp_path / "private" / "c.sqlite3"
+    cache = CompletionCache(str(path))
+    cache.put("k", "reply")
+
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) & 0o077 == 0
+    cache.close()
+
+
+def test_disk_tier_tightens_an_existing_directory(tmp_path):
+    import os
+    import stat
+
+    directory = tmp_path / "shared"
+    directory.mkdir(mode=0o755)
+    os.chmod(directory, 0o755)
+    cache = CompletionCache(str(directory / "c.sqlite3"))
+
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    cache.close()
+
+
+def test_workers_sharing_the_file_enforce_one_byte_budget(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(completion_cache.time, "time", lambda: now[0])
+    path = str(tmp_path / "c.sqlite3")
+    workers = [CompletionCache(path, max_bytes=3 * (100 + 64)) for _ in range(2)]
+    for i, key in enumerate("abcdef"):
+        now[0] += 1
+        workers[i % 2].put(key, key * 100)
+
+    for worker in workers:
+        worker.memory.clear()
+        assert worker.stats()["disk"]["entries"] == 3
+        assert worker.stats()["disk"]["bytes"] == 3 * (100 + 64)
+        assert [worker.get(key) is not None for key in "abcdef"] == [False] * 3 + [True] * 3
+        worker.close()
+
+
+def test_disk_tier_keeps_a_running_byte_total(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    cache = CompletionCache(path)
+    cache.put("k", "reply")
+    cache.put("k", "longer reply")
+    cache.put("j", "other")
+
+    assert cache.disk_bytes == (12 + 64) + (5 + 64)
+    cache.close()
+    assert CompletionCache(path).disk_bytes == (12 + 64) + (5 + 64)
+
+
+@pytest.mark.asyncio
+async def test_async_lookup_and_store_reach_the_disk_tier(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    cache = CompletionCache(path)
+    await cache.store("k", "reply")
+    cache.close()
+
+    reopened = CompletionCache(path)
+    assert await reopened.lookup("k") == "reply"
+    assert await reopened.lookup("missing") is None
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_cached_client_completes_once_per_prompt():
+    llm = FakeLLM()
+    client = CachedLLMClient(llm, CompletionCache())
+
+    first = await client.complete(MESSAGES)
+    await client.complete(MESSAGES)
+    assert llm.call_count == 2  # not accepted, so not cached
+
+    await client.accept(MESSAGES, first)
+    second = await client.complete([dict(m) for m in MESSAGES])
+
+    assert first == second
+    assert llm.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_cached_client_normalized_lookup():
+    llm = FakeLLM()
+    client = CachedLLMClient(llm, CompletionCache(), normalize=True)
+
+    await client.accept(MESSAGES, await client.complete(MESSAGES))
+    await client.complete([MESSAGES[0], {"role": "user", "content": "Rewrite the intro"}])
+
+    assert llm.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_client_serves_accepted_streams():
+    llm = FakeLLM(chunk_size=4)
+    client = CachedLLMClient(llm, CompletionCache())
+
+    streamed = [chunk async for chunk in client.stream(MESSAGES)]
+    await client.accept(MESSAGES, "".join(streamed))
+    cached = [chunk async for chunk in client.stream(MESSAGES)]
+
+    assert len(streamed) > 1
+    assert cached == ["".join(streamed)]
+    assert await client.complete(MESSAGES) == "".join(streamed)
+    assert llm.call_count == 1
+
+
+def test_registry_wraps_clients_in_the_cache():
+    cache = CompletionCache()
+    registry = LLMClientRegistry(cache=cache, normalize=True)
+
+    client = registry.get("fake").client
+
+    assert isinstance(client, CachedLLMClient)
+    assert client.cache is cache and client.normalize
+    assert isinstance(client.client, FakeLLM)
@@ -0,0 +1,90 @@
+from sandbox.core.content_cache import ContentCache, content_hash
+from sandbox.core.diff_engine import DIFF_CACHE, TOKEN_CACHE, compute_block_diff, compute_span_diff
+
+
+def test_content_hash_is_stable_and_distinct():
+    assert content_hash("abc") == content_hash("abc")
+    assert content_hash("abc") != content_hash("abd")
+    assert len(content_hash("")) == 32
+
+
+def test_get_and_put_count_hits_and_misses():
+    cache = ContentCache()
+
+    assert cache.get("a") is None
+    cache.put("a", [1, 2], size=10)
+    assert cache.get("a") == [1, 2]
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+    assert stats["bytes"] == 10
+
+
+def test_evicts_least_recently_used_by_entry_count():
+    cache = ContentCache(max_entries=2)
+    cache.put("a", 1, size=1)
+    cache.put("b", 2, size=1)
+    cache.get("a")
+    cache.put("c", 3, size=1)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_evicts_to_stay_under_byte_cap():
+    cache = ContentCache(max_bytes=100)
+    cache.put("a", "x", size=60)
+    cache.put("b", "y", size=60)
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "y"
+    assert cache.stats()["bytes"] == 60
+
+
+def test_oversized_values_are_not_stored():
+    cache = ContentCache(max_bytes=10)
+    cache.put("big", "value", size=11)
+
+    assert len(cache) == 0
+
+
+def test_replacing_a_key_updates_size():
+    cache = ContentCache()
+    cache.put("a", 1, size=10)
+    cache.put("a", 2, size=4)
+
+    assert cache.get("a") == 2
+    assert cache.stats()["bytes"] == 4
+
+
+def test_get_or_compute_only_computes_once():
+    cache = ContentCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "value"
+
+    assert cache.get_or_compute("k", compute, len) == "value"
+    assert cache.get_or_compute("k", compute, len) == "value"
+    assert len(calls) == 1
+
+
+def test_block_diff_reuses_cached_tokens_and_opcodes():
+    old_text = "Cache test: the quick brown fox"
+    new_text = "Cache test: the quick red fox"
+    diff_hits = DIFF_CACHE.hits
+    token_hits = TOKEN_CACHE.hits
+
+    first = compute_block_diff(old_text, new_text)
+    second = compute_block_diff(old_text, new_text)
+    compute_span_diff(old_text, new_text)
+
+    assert first == second
+    assert first is not second
+    assert DIFF_CACHE.hits == diff_hits + 2
+    assert TOKEN_CACHE.hits >= token_hits + 4
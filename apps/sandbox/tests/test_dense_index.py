@@ -0,0 +1,137 @@
+import numpy as np
+from sandbox.core.dense_index import DenseIndex, combine_scores, embed_texts
+
+
+def test_embeddings_are_unit_length_and_deterministic():
+    vectors = embed_texts(["Species richness declined.", "", "Species richness declined."])
+
+    assert vectors.shape == (3, 256)
+    assert np.isclose(np.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[1].any()
+    assert np.array_equal(vectors[0], vectors[2])
+
+
+def test_paraphrase_is_closer_than_unrelated_text():
+    query, paraphrase, unrelated = embed_texts([
+        "Species richness declined across sites",
+        "The decline in species richness was seen at every site",
+        "Budget allocations for the next fiscal year",
+    ])
+
+    assert query @ paraphrase > 0.3
+    assert query @ paraphrase > query @ unrelated + 0.3
+
+
+def _items(**texts):
+    return [{"id": item_id, "content": text} for item_id, text in texts.items()]
+
+
+def test_search_returns_top_k_best_first():
+    index = DenseIndex()
+    index.sync(_items(b1="Beetle counts in forest plots", b2="Annual budget report", b3="Beetles counted in forests"))
+
+    results = index.search("counting beetles in the forest", limit=2)
+
+    assert {item_id for item_id, _ in results} == {"b1", "b3"}
+    assert results[0][1] >= results[1][1]
+    assert len(index.search_batch(["budget", "beetle"], limit=1)) == 2
+
+
+def test_sync_only_embeds_changed_items():
+    index = DenseIndex()
+    assert index.sync(_items(b1="alpha", b2="beta", b3="gamma")) == 3
+
+    assert index.sync(_items(b1="alpha", b3="gamma changed")) == 2
+    assert "b2" not in index
+    assert len(index) == 2
+    assert index.search("gamma changed", limit=1)[0][0] == "b3"
+    assert index.sync(_items(b1="alpha", b3="gamma changed")) == 0
+
+
+def test_index_persists_and_grows_on_disk(tmp_path):
+    items = [{"id": f"b{i}", "content": f"Paragraph number {i} about topic {i % 7}"} for i in range(150)]
+    index = DenseIndex(str(tmp_path))
+    index.sync(items)
+    expected = index.search("topic 3", limit=5)
+
+    reopened = DenseIndex(str(tmp_path))
+
+    assert len(reopened) == 150
+    assert reopened.sync(items) == 0
+    assert reopened.search("topic 3", limit=5) == expected
+
+
+def test_workers_sharing_a_directory_keep_private_copies(tmp_path):
+    first = DenseIndex(str(tmp_path))
+    first.sync(_items(b1="Beetle counts in forest plots", b2="Annual budget report"))
+    second = DenseIndex(str(tmp_path))
+
+    first.sync(_items(b2="Annual budget report", b3="Rainfall totals by month"))
+    second.sync(_items(b1="Beetle counts in forest plots", b2="Annual budget report", b4="Soil pH samples"))
+
+    assert second.search("beetles in the forest", limit=1)[0][0] == "b1"
+    assert first.search("monthly rainfall", limit=1)[0][0] == "b3"
+    reopened = DenseIndex(str(tmp_path))
+    assert len(reopened) == 3 and "b3" not in reopened  # the last flush, whole
+    assert reopened.search("soil samples", limit=1)[0][0] == "b4"
+
+
+def test_concurrent_syncs_apply_each_change_once(monkeypatch):
+    import threading
+
+    from sandbox.core import dense_index
+
+    index = DenseIndex()
+    index.sync(_items(b1="alpha", b2="beta", b3="gamma"))
+    barrier = threading.Barrier(2)
+
+    def embed_together(texts):
+        barrier.wait(timeout=5)
+        return embed_texts(texts)
+
+    monkeypatch.setattr(dense_index, "embed_texts", embed_together)
+    counts = []
+    threads = [
+        threading.Thread(target=lambda: counts.append(index.sync(_items(b1="alpha", b3="gamma changed"))))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(counts) == [0, 2]
+    assert len(index) == 2 and "b2" not in index
+
+
+def test_flush_appends_changed_rows_and_compacts(tmp_path):
+    from sandbox.core.dense_index import _COMPACT_SLACK, _ROW_BYTES
+
+    vectors_path = tmp_path / "vectors.f32"
+    items = [{"id": f"b{i}", "content": f"Paragraph number {i} about topic {i % 7}"} for i in range(100)]
+    index = DenseIndex(str(tmp_path))
+    index.sync(items)
+    assert vectors_path.stat().st_size == 100 * _ROW_BYTES
+
+    items[3] = {"id": "b3", "content": "Rewritten paragraph about beetles"}
+    index.sync(items[:-1])
+    assert vectors_path.stat().st_size == 101 * _ROW_BYTES
+    reopened = DenseIndex(str(tmp_path))
+    assert len(reopened) == 99
+    assert reopened.search("beetles", limit=1)[0][0] == "b3"
+    assert reopened.sync(items[:-1]) == 0
+
+    for revision in range(_COMPACT_SLACK):
+        items[5] = {"id": "b5", "content": f"Revision {revision} of paragraph five"}
+        index.sync(items[:-1])
+    assert vectors_path.stat().st_size <= (2 * 99 + _COMPACT_SLACK) * _ROW_BYTES
+    assert DenseIndex(str(tmp_path)).search("Revision 255 of paragraph five", limit=1)[0][0] == "b5"
+
+
+def test_combine_scores_normalises_lexical_scores():
+    combined = combine_scores({"a": 10.0, "b": 5.0}, {"a": 0.2, "c": 0.9, "d": -0.5})
+
+    assert combined["a"] == 0.5 * 1.0 + 0.5 * 0.2
+    assert combined["b"] == 0.25
+    assert combined["c"] == 0.45
+    assert combined["d"] == 0.0
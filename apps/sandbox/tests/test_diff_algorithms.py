@@ -0,0 +1,147 @@
+import random
+
+import pytest
+from sandbox.core.diff_algorithms import (
+    HistogramDiff,
+    MyersDiff,
+    SequenceMatcherDiff,
+    get_diff_algorithm,
+)
+from sandbox.core.diff_engine import compute_block_diff
+
+
+ALGORITHMS = [SequenceMatcherDiff(), MyersDiff(), HistogramDiff()]
+
+
+def _apply_opcodes(a, b, opcodes):
+    result = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            result.extend(a[i1:i2])
+        elif tag in ("insert", "replace"):
+            result.extend(b[j1:j2])
+    return result
+
+
+def _lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def _random_pair(rng, alphabet="abcde"):
+    a = [rng.choice(alphabet) for _ in range(rng.randint(0, 30))]
+    b = list(a)
+    for _ in range(rng.randint(0, 6)):
+        op = rng.choice(["insert", "delete", "replace"])
+        pos = rng.randint(0, len(b))
+        if op == "insert":
+            b.insert(pos, rng.choice(alphabet))
+        elif b and pos < len(b):
+            if op == "delete":
+                del b[pos]
+            else:
+                b[pos] = rng.choice(alphabet)
+    return a, b
+
+
+class TestOpcodes:
+    @pytest.mark.parametrize("algorithm", ALGORITHMS, ids=lambda a: a.name)
+    def test_opcodes_reconstruct_new_sequence(self, algorithm):
+        rng = random.Random(1234)
+        for _ in range(300):
+            a, b = _random_pair(rng)
+            opcodes = algorithm.opcodes(a, b)
+            assert _apply_opcodes(a, b, opcodes) == b
+
+    @pytest.mark.parametrize("algorithm", ALGORITHMS, ids=lambda a: a.name)
+    def test_opcodes_cover_both_sequences(self, algorithm):
+        a = list("the quick brown fox")
+        b = list("the quack brown box!")
+
+        opcodes = algorithm.opcodes(a, b)
+
+        assert opcodes[0][1] == 0 and opcodes[0][3] == 0
+        assert opcodes[-1][2] == len(a) and opcodes[-1][4] == len(b)
+        for previous, current in zip(opcodes, opcodes[1:]):
+            assert previous[2] == current[1]
+            assert previous[4] == current[3]
+
+    @pytest.mark.parametrize("algorithm", ALGORITHMS, ids=lambda a: a.name)
+    def test_empty_sequences(self, algorithm):
+        assert algorithm.opcodes([], []) == []
+        assert algorithm.opcodes([], ["x"]) == [("insert", 0, 0, 0, 1)]
+        assert algorithm.opcodes(["x"], []) == [("delete", 0, 1, 0, 0)]
+
+    def test_myers_is_minimal(self):
+        rng = random.Random(99)
+        myers = MyersDiff()
+        for _ in range(200):
+            a, b = _random_pair(rng, alphabet="abc")
+            matched = sum(size for _, _, size in myers.matching_blocks(a, b))
+            assert matched == _lcs_length(a, b)
+
+    def test_myers_edit_cost_cap_still_valid(self):
+        a = [f"a{i}" for i in range(500)]
+        b = [f"b{i}" for i in range(500)]
+
+        opcodes = MyersDiff(max_edit_cost=10).opcodes(a, b)
+
+        assert opcodes == [("replace", 0, 500, 0, 500)]
+
+    def test_histogram_ignores_frequent_tokens_as_anchors(self):
+        a = ["alpha", " ", "beta", " ", "gamma"] * 50
+        b = list(a)
+        b[125] = "delta"
+
+        opcodes = HistogramDiff().opcodes(a, b)
+
+        changed = [op for op in opcodes if op[0] != "equal"]
+        assert changed == [("replace", 125, 126, 125, 126)]
+
+
+class TestGetDiffAlgorithm:
+    def test_auto_picks_by_size(self):
+        assert get_diff_algorithm("auto", 10, 10).name == "myers"
+        assert get_diff_algorithm("auto", 50_000, 50_000).name == "histogram"
+
+    def test_explicit_name(self):
+        assert get_diff_algorithm("difflib").name == "difflib"
+
+    def test_unknown_name_raises(self):
+        with pytest.raises(ValueError, match="Unknown diff algorithm"):
+            get_diff_algorithm("nope")
+
+
+class TestComputeBlockDiffAlgorithms:
+    @pytest.mark.parametrize("name", ["auto", "myers", "histogram", "difflib"])
+    def test_same_operations_contract(self, name):
+        old_text = "# Title\n\nThe quick brown fox jumps over the lazy dog."
+        new_text = "# Title\n\nThe quick red fox leaps over the lazy dog."
+
+        diff = compute_block_diff(old_text, new_text, algorithm=name)
+
+        kept_or_added = "".join(op["text"] for op in diff["operations"] if op["type"] != "delete")
+        kept_or_deleted = "".join(op["text"] for op in diff["operations"] if op["type"] != "add")
+        assert kept_or_added == new_text
+        assert kept_or_deleted == old_text
+        assert [op["position"] for op in diff["operations"]] == list(range(len(diff["operations"])))
+
+    def test_large_block_alignment(self):
+        words = [f"word{i % 997}" for i in range(20_000)]
+        old_text = " ".join(words)
+        words[10_000] = "changed"
+        new_text = " ".join(words)
+
+        diff = compute_block_diff(old_text, new_text)
+
+        changes = [op for op in diff["operations"] if op["type"] != "keep"]
+        assert [(op["type"], op["text"]) for op in changes] == [
+            ("delete", "word30"),
+            ("add", "changed"),
+        ]
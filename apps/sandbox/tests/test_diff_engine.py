@@ -1,9 +1,23 @@
+import json
+import random
+import re
+import time
+
 import pytest
 from sandbox.core.diff_engine import (
+    DiffSpan,
+    PatchApplyError,
     compute_block_diff,
+    compute_span_diff,
+    decode_span_diff,
+    encode_span_diff,
     apply_diff,
-    format_diff_for_display
+    apply_edit_patch,
+    format_diff_for_display,
+    resolve_edit_text,
 )
+from sandbox.core.diff_algorithms import _intern_tokens
+from sandbox.core.markdown_ast import tokenize_markdown
 
 
 class TestComputeBlockDiff:
@@ -89,6 +103,122 @@ class TestComputeBlockDiff:
         assert all(op["type"] == "keep" for op in diff["operations"])
 
 
+class TestTwoTierDiff:
+    @staticmethod
+    def _reconstruct(diff):
+        old = "".join(op["text"] for op in diff["operations"] if op["type"] != "add")
+        new = "".join(op["text"] for op in diff["operations"] if op["type"] != "delete")
+        return old, new
+    
+    def test_single_line_change_in_large_block(self):
+        lines = [f"- Item {i} has **some** text and a [link](http://x/{i})" for i in range(2000)]
+        old_text = "\n".join(lines)
+        lines[1234] = "- Item 1234 has **other** text and a [link](http://x/1234)"
+        new_text = "\n".join(lines)
+        
+        diff = compute_block_diff(old_text, new_text, two_tier=True)
+        
+        changes = [(op["type"], op["text"]) for op in diff["operations"] if op["type"] != "keep"]
+        assert changes == [("delete", "some"), ("add", "other")]
+        assert self._reconstruct(diff) == (old_text, new_text)
+    
+    def test_matches_single_tier_changes(self):
+        old_text = "# Title\n\nFirst paragraph here.\n\n  indented line\nlast line"
+        new_text = "# Title\n\nFirst paragraph there.\n\n  indented line\nlast line!\nextra"
+        
+        two_tier = compute_block_diff(old_text, new_text, two_tier=True)
+        single = compute_block_diff(old_text, new_text, two_tier=False)
+        
+        assert two_tier == single
+    
+    def test_fuzz_reconstructs_both_texts(self):
+        rng = random.Random(11)
+        words = ["alpha", "beta", "gamma", "\n", "\n\n", "  ", "- ", "# ", "**x**"]
+        for _ in range(300):
+            old_text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 40)))
+            new_words = old_text.split(" ")
+            for _ in range(rng.randint(0, 4)):
+                new_words.insert(rng.randint(0, len(new_words)), rng.choice(words))
+            new_text = " ".join(new_words)
+            
+            diff = compute_block_diff(old_text, new_text, two_tier=True)
+            
+            assert self._reconstruct(diff) == (old_text, new_text)
+    
+    def test_spans_support_two_tier(self):
+        old_text = "line one\nline two\nline three"
+        new_text = "line one\nline 2\nline three"
+        
+        diff = compute_span_diff(old_text, new_text, two_tier=True)
+        
+        assert format_diff_for_display(diff) == "line one\nline [-two-][+2+]\nline three"
+
+
+class TestComputeSpanDiff:
+    def test_spans_point_into_texts(self):
+        old_text = "Hello world"
+        new_text = "Hello beautiful world"
+        
+        diff = compute_span_diff(old_text, new_text)
+        
+        assert diff["spans"] == [
+            DiffSpan("keep", 0, 6, 0, 6),
+            DiffSpan("add", 6, 6, 6, 16),
+            DiffSpan("keep", 6, 11, 16, 21),
+        ]
+    
+    def test_replace_becomes_delete_then_add(self):
+        diff = compute_span_diff("Hello world", "Hello universe")
+        
+        assert [span.type for span in diff["spans"]] == ["keep", "delete", "add"]
+        delete, add = diff["spans"][1:]
+        assert diff["old_text"][delete.old_start:delete.old_end] == "world"
+        assert diff["new_text"][add.new_start:add.new_end] == "universe"
+    
+    def test_matches_token_operations(self):
+        old_text = "- Item one\n- Item two\n\n```python\nold_code\n```"
+        new_text = "- Item one\n- Item three\n\n```python\nnew_code\n```"
+        
+        span_diff = compute_span_diff(old_text, new_text)
+        token_diff = compute_block_diff(old_text, new_text)
+        
+        for span_type in ("keep", "delete", "add"):
+            from_spans = "".join(
+                (span_diff["new_text"][s.new_start:s.new_end] if s.type == "add"
+                 else span_diff["old_text"][s.old_start:s.old_end])
+                for s in span_diff["spans"] if s.type == span_type
+            )
+            from_ops = "".join(op["text"] for op in token_diff["operations"] if op["type"] == span_type)
+            assert from_spans == from_ops
+    
+    def test_empty_blocks(self):
+        assert compute_span_diff("", "")["spans"] == []
+        assert compute_span_diff("", "New")["spans"] == [DiffSpan("add", 0, 0, 0, 3)]
+    
+    def test_wire_format_round_trip(self):
+        diff = compute_span_diff("Hello world", "Hello universe")
+        
+        encoded = encode_span_diff(diff)
+        
+        assert encoded["spans"] == [["=", 6], ["-", 5], ["+", 8]]
+        assert decode_span_diff(json.loads(json.dumps(encoded))) == diff
+    
+    def test_decode_rejects_mismatched_lengths(self):
+        with pytest.raises(ValueError, match="do not match"):
+            decode_span_diff({"old_text": "abc", "new_text": "abc", "spans": [["=", 2]]})
+    
+    def test_wire_format_is_much_smaller(self):
+        old_text = " ".join(f"word{i}" for i in range(5000))
+        new_text = old_text.replace("word2500", "changed")
+        
+        token_payload = json.dumps(compute_block_diff(old_text, new_text))
+        span_payload = json.dumps(encode_span_diff(compute_span_diff(old_text, new_text)))
+        
+        token_ops_size = len(token_payload) - len(old_text) - len(new_text)
+        span_ops_size = len(span_payload) - len(old_text) - len(new_text)
+        assert span_ops_size * 10 < token_ops_size
+
+
 class TestApplyDiff:
     def test_apply_single_edit(self):
         original_blocks = [
@@ -170,6 +300,71 @@ class TestApplyDiff:
         result = apply_diff(original_blocks, proposed_edits)
         
         assert result[0]["metadata"] == {"author": "Alice"}
+    
+    def test_patch_edit(self):
+        original_blocks = [{"blockId": "block1", "markdownText": "Sampled 40 sites in 2020."}]
+        proposed_edits = [
+            {"blockId": "block1", "patches": [{"search": "40 sites", "replace": "42 sites"}]}
+        ]
+        
+        result = apply_diff(original_blocks, proposed_edits)
+        
+        assert result[0]["markdownText"] == "Sampled 42 sites in 2020."
+    
+    def test_failed_patch_falls_back_to_full_text(self):
+        original_blocks = [{"blockId": "block1", "markdownText": "Sampled 40 sites."}]
+        proposed_edits = [{
+            "blockId": "block1",
+            "patches": [{"search": "missing", "replace": "x"}],
+            "newMarkdownText": "Full replacement.",
+        }]
+        
+        result = apply_diff(original_blocks, proposed_edits)
+        
+        assert result[0]["markdownText"] == "Full replacement."
+    
+    def test_failed_patch_without_full_text_raises(self):
+        original_blocks = [{"blockId": "block1", "markdownText": "Sampled 40 sites."}]
+        proposed_edits = [{"blockId": "block1", "patches": [{"search": "missing", "replace": "x"}]}]
+        
+        with pytest.raises(PatchApplyError):
+            apply_diff(original_blocks, proposed_edits)
+        assert original_blocks[0]["markdownText"] == "Sampled 40 sites."
+
+
+class TestApplyEditPatch:
+    def test_patches_apply_in_order(self):
+        text = "The quick brown fox jumps over the lazy dog."
+        patches = [
+            {"search": "quick brown", "replace": "slow red"},
+            {"search": "slow red fox", "replace": "slow red hen"},
+        ]
+        
+        assert apply_edit_patch(text, patches) == "The slow red hen jumps over the lazy dog."
+    
+    def test_missing_anchor_raises(self):
+        with pytest.raises(PatchApplyError, match="not found"):
+            apply_edit_patch("Some text", [{"search": "other", "replace": "x"}])
+    
+    def test_ambiguous_anchor_raises(self):
+        with pytest.raises(PatchApplyError, match="more than once"):
+            apply_edit_patch("a cat and a cat", [{"search": "a cat", "replace": "a dog"}])
+    
+    def test_malformed_patch_raises(self):
+        with pytest.raises(PatchApplyError):
+            apply_edit_patch("text", [{"search": "", "replace": "x"}])
+        with pytest.raises(PatchApplyError):
+            apply_edit_patch("text", [{"search": "text"}])
+    
+    def test_resolve_edit_text(self):
+        text = "Sampled 40 sites."
+        
+        assert resolve_edit_text(text, {"patches": [{"search": "40", "replace": "42"}]}) == "Sampled 42 sites."
+        assert resolve_edit_text(text, {"content": "New."}) == "New."
+        assert resolve_edit_text(
+            text, {"patches": [{"search": "50", "replace": "52"}], "content": "New."}
+        ) == "New."
+        assert resolve_edit_text(text, {"patches": [{"search": "50", "replace": "52"}]}) is None
 
 
 class TestFormatDiffForDisplay:
@@ -248,3 +443,68 @@ class TestFormatDiffForDisplay:
         result = format_diff_for_display(diff)
         
         assert result == ""
+    
+    def test_format_spans(self):
+        diff = compute_span_diff("Hello beautiful world", "Hello big world")
+        
+        assert format_diff_for_display(diff) == "Hello [-beautiful-][+big+] world"
+    
+    def test_format_span_wire_format(self):
+        diff = encode_span_diff(compute_span_diff("Hello world", "Hello universe"))
+        
+        assert format_diff_for_display(diff) == "Hello [-world-][+universe+]"
+
+
+LEGACY_TOKEN_PATTERN = r'(\s+|```|`|#{1,6}\s|^\s*[-*+]\s|^\s*\d+\.\s|\[.*?\]\(.*?\)|\*\*|__|\*|_|~~)'
+
+
+def _legacy_tokenize(text):
+    return [part for part in re.split(LEGACY_TOKEN_PATTERN, text, flags=re.MULTILINE) if part]
+
+
+class TestTokenizeMarkdown:
+    FUZZ_ALPHABET = ["a", "b", " ", "  ", "\n", "\t", "#", "-", "*", "+", "_", "~", "`", "1", ".",
+                     "[", "]", "(", ")", "](", "\u00a0", "\x1c", "\r"]
+    
+    def test_basic_tokens(self):
+        tokens = tokenize_markdown("# Title\n- item with [link](http://x.y) and **bold**")
+        
+        assert tokens == ["# ", "Title", "\n", "- ", "item", " ", "with", " ",
+                          "[link](http://x.y)", " ", "and", " ", "**", "bold", "**"]
+    
+    def test_empty_text(self):
+        assert tokenize_markdown("") == []
+    
+    def test_tokens_concatenate_to_text(self):
+        text = "1. first\n   2. second `code` ~~gone~~ __under__ [a] (b) [c](d"
+        
+        assert "".join(tokenize_markdown(text)) == text
+    
+    def test_fuzz_equivalent_to_regex_split(self):
+        rng = random.Random(2024)
+        for _ in range(3000):
+            text = "".join(rng.choice(self.FUZZ_ALPHABET) for _ in range(rng.randint(0, 40)))
+            assert tokenize_markdown(text) == _legacy_tokenize(text), repr(text)
+    
+    def test_fuzz_link_heavy_equivalent_to_regex_split(self):
+        rng = random.Random(7)
+        alphabet = ["[", "]", "(", ")", "](", "x", " ", "\n"]
+        for _ in range(3000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+            assert tokenize_markdown(text) == _legacy_tokenize(text), repr(text)
+    
+    def test_adversarial_brackets_are_linear(self):
+        text = "[a " * 50_000 + "](" * 50_000
+        
+        start = time.perf_counter()
+        tokens = tokenize_markdown(text)
+        elapsed = time.perf_counter() - start
+        
+        assert "".join(tokens) == text
+        assert elapsed < 2.0
+    
+    def test_intern_tokens_shares_ids(self):
+        old_ids, new_ids = _intern_tokens(["a", " ", "b"], ["b", " ", "c"])
+        
+        assert old_ids == [0, 1, 2]
+        assert new_ids == [2, 1, 3]
@@ -0,0 +1,153 @@
+import hashlib
+
+import pytest
+from fastapi.testclient import TestClient
+from sandbox.main import app
+from sandbox.core.document_store import DocumentResyncRequired, DocumentStore, block_hash, js_number_string
+
+
+client = TestClient(app)
+
+SECTIONS = [{"id": "s1", "title": "Intro"}, {"id": "s2", "title": "Methods"}]
+BLOCKS = [
+    {"id": "b1", "markdown_text": "First.", "section_id": "s1"},
+    {"id": "b2", "markdown_text": "Second.", "section_id": "s1"},
+    {"id": "b3", "markdown_text": "Third.", "section_id": "s2"},
+]
+
+
+def _document_hash(blocks):
+    digest = 0
+    for block in blocks:
+        entry = f"{block['id']}\n{block['section_id']}\n{block['order']}\n{block_hash(block['markdown_text'])}"
+        digest ^= int.from_bytes(hashlib.sha256(entry.encode()).digest(), "big")
+    return digest.to_bytes(32, "big").hex()
+
+
+def test_put_orders_blocks_by_section_then_order():
+    store = DocumentStore()
+    document = store.put("p1", "r1", SECTIONS, [BLOCKS[2], BLOCKS[0], BLOCKS[1]])
+
+    assert [block["id"] for block in document.ordered_blocks()] == ["b1", "b2", "b3"]
+    assert document.document_hash == _document_hash([
+        {**BLOCKS[2], "order": 0}, {**BLOCKS[0], "order": 1}, {**BLOCKS[1], "order": 2},
+    ])
+
+
+def test_apply_delta_updates_adds_and_removes():
+    store = DocumentStore()
+    store.put("p1", "r1", SECTIONS, BLOCKS)
+    expected_hash = _document_hash([
+        {**BLOCKS[0], "markdown_text": "First, revised.", "order": 0},
+        {**BLOCKS[2], "order": 2},
+        {"id": "b4", "markdown_text": "Fourth.", "section_id": "s1", "order": 5},
+    ])
+
+    document = store.apply_delta(
+        "p1", "r1", "r2",
+        upserted_blocks=[
+            {"id": "b1", "markdown_text": "First, revised.", "section_id": "s1",
+             "content_hash": block_hash("First, revised.")},
+            {"id": "b4", "markdown_text": "Fourth.", "section_id": "s1", "order": 5},
+        ],
+        removed_block_ids=["b2"],
+        document_hash=expected_hash,
+    )
+
+    assert document.revision == "r2"
+    assert [block["id"] for block in document.ordered_blocks()] == ["b1", "b4", "b3"]
+    assert document.blocks["b1"]["markdown_text"] == "First, revised."
+
+
+@pytest.mark.parametrize("value, expected", [
+    (3.0, "3"), (-0.0, "0"), (0.5, "0.5"), (0.1 + 0.2, "0.30000000000000004"),
+    (1e-6, "0.000001"), (1e-7, "1e-7"), (1.5e-7, "1.5e-7"), (1e20, "100000000000000000000"), (1e21, "1e+21"),
+])
+def test_js_number_string_matches_javascript(value, expected):
+    assert js_number_string(value) == expected
+
+
+def test_fractional_orders_hash_as_javascript_writes_them():
+    store = DocumentStore()
+    store.put("p1", "r1", SECTIONS, BLOCKS)
+
+    document = store.apply_delta(
+        "p1", "r1", "r2",
+        upserted_blocks=[{"id": "b4", "markdown_text": "Fourth.", "section_id": "s1", "order": 1e-7}],
+        removed_block_ids=[],
+        document_hash=_document_hash([
+            {**BLOCKS[0], "order": 0}, {**BLOCKS[1], "order": 1}, {**BLOCKS[2], "order": 2},
+            {"id": "b4", "markdown_text": "Fourth.", "section_id": "s1", "order": "1e-7"},
+        ]),
+    )
+
+    assert [block["id"] for block in document.ordered_blocks()] == ["b1", "b4", "b2", "b3"]
+
+
+@pytest.mark.parametrize("delta", [
+    {"base_revision": "stale"},
+    {"upserted_blocks": [{"id": "b1", "markdown_text": "x", "content_hash": "bad"}]},
+    {"removed_block_ids": ["missing"]},
+    {"document_hash": "0" * 64},
+])
+def test_mismatch_requires_resync_and_drops_document(delta):
+    store = DocumentStore()
+    store.put("p1", "r1", SECTIONS, BLOCKS)
+    args = {"base_revision": "r1", "revision": "r2", "upserted_blocks": [], "removed_block_ids": [], **delta}
+
+    with pytest.raises(DocumentResyncRequired):
+        store.apply_delta("p1", **args)
+    if delta.get("base_revision") != "stale":
+        assert store.get("p1") is None
+
+
+def test_store_evicts_least_recently_used():
+    store = DocumentStore(max_documents=2)
+    store.put("a", "r", [], [])
+    store.put("b", "r", [], [])
+    store.get("a")
+    store.put("c", "r", [], [])
+
+    assert store.get("b") is None
+    assert store.get("a") is not None
+
+
+def _request(**body):
+    return {"thread_id": "delta-thread", "project_id": "delta-project",
+            "messages": [{"role": "user", "content": "Hello"}], **body}
+
+
+def test_agent_run_accepts_delta_after_full_context():
+    full = client.post("/v1/agent/run", json=_request(context={
+        "sections": SECTIONS, "blocks": BLOCKS, "revision": "r1",
+    }))
+    assert full.status_code == 200
+    assert full.json()["document_revision"] == "r1"
+
+    delta = client.post("/v1/agent/run", json=_request(delta={
+        "base_revision": "r1",
+        "revision": "r2",
+        "upserted_blocks": [{"id": "b2", "markdown_text": "Second, revised.", "section_id": "s1"}],
+    }))
+
+    assert delta.status_code == 200
+    assert delta.json()["document_revision"] == "r2"
+
+
+def test_agent_run_delta_against_unknown_revision_needs_resync():
+    response = client.post("/v1/agent/run", json=_request(
+        project_id="unknown-project",
+        delta={"base_revision": "r1", "revision": "r2"},
+    ))
+
+    assert response.status_code == 409
+    assert response.json()["detail"]["code"] == "need_full_resync"
+
+
+def test_agent_run_rejects_context_and_delta_together():
+    response = client.post("/v1/agent/run", json=_request(
+        context={"sections": [], "blocks": []},
+        delta={"base_revision": "r1", "revision": "r2"},
+    ))
+
+    assert response.status_code == 422
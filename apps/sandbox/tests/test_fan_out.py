@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from sandbox.core.fan_out import PartResult, gather_limited, merge_results, split_context
+from sandbox.core.token_counter import ApproximateTokenCounter
+
+
+def _context():
+    return {
+        "sections": [{"id": "intro", "title": "Introduction"}, {"id": "empty", "title": "Empty"},
+                     {"id": "results", "title": "Results"}],
+        "blocks": [
+            {"id": "r1", "content": "word " * 40, "section_id": "results"},
+            {"id": "i1", "content": "word " * 10, "section_id": "intro"},
+            {"id": "loose", "content": "word", "section_id": None},
+            {"id": "r2", "content": "word " * 40, "section_id": "results"},
+        ],
+        "artifacts": [],
+        "revision": "rev-1",
+    }
+
+
+def test_split_context_groups_blocks_by_section_in_document_order():
+    parts = split_context(_context(), max_tokens=1000, token_counter=ApproximateTokenCounter())
+
+    assert [[block["id"] for block in part["blocks"]] for part in parts] == [["loose"], ["i1"], ["r1", "r2"]]
+    assert [part["anchor_section_id"] for part in parts] == [None, "intro", "results"]
+    assert parts[2]["sections"] == [{"id": "results", "title": "Results"}]
+    assert parts[2]["revision"] == "rev-1"
+
+
+def test_split_context_splits_large_sections_by_budget():
+    parts = split_context(_context(), max_tokens=50, token_counter=ApproximateTokenCounter())
+
+    assert [[block["id"] for block in part["blocks"]] for part in parts] == [["loose"], ["i1"], ["r1"], ["r2"]]
+
+
+@pytest.mark.asyncio
+async def test_gather_limited_bounds_concurrency_and_keeps_order():
+    running, peak = 0, 0
+
+    async def task(i):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01 * (5 - i))
+        running -= 1
+        return i
+
+    results = await gather_limited([lambda i=i: task(i) for i in range(5)], limit=2)
+
+    assert results == [0, 1, 2, 3, 4]
+    assert peak == 2
+
+
+def test_merge_results_is_ordered_and_labelled():
+    message, edits = merge_results([
+        PartResult(None, "Tidied a loose block.", {"loose": "x"}),
+        PartResult("Results", "Shortened.", {"r1": "a"}),
+        PartResult("Results", "Shortened.", {"r2": "b"}),
+        PartResult("Introduction", "", {}),
+    ])
+
+    assert message == "Tidied a loose block.\n\nResults: Shortened."
+    assert list(edits) == ["loose", "r1", "r2"]
@@ -0,0 +1,121 @@
+import pytest
+from sandbox.core.history import HistoryManager
+from sandbox.core.prompt_builder import build_agent_prompt
+from sandbox.core.token_counter import ApproximateTokenCounter
+from sandbox.test_doubles.fake_llm import FakeLLM
+
+
+def _thread(count, words=5):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "word " * words}
+        for i in range(count)
+    ]
+
+
+def _manager(**kwargs):
+    return HistoryManager(token_counter=ApproximateTokenCounter(), **kwargs)
+
+
+def _llm():
+    return FakeLLM(response_map={"new messages": "Earlier the user asked for shorter sections."})
+
+
+@pytest.mark.asyncio
+async def test_short_history_is_kept_verbatim():
+    llm = _llm()
+
+    window = await _manager().window("t1", _thread(6), llm, max_tokens=10_000)
+
+    assert window.summary is None
+    assert len(window.messages) == 6
+    assert llm.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_long_history_is_folded_into_summary():
+    llm = _llm()
+
+    window = await _manager(keep_messages=4, fold_batch=2).window("t1", _thread(10), llm, max_tokens=10_000)
+
+    assert window.summary == "Earlier the user asked for shorter sections."
+    assert [m["content"].split()[1] for m in window.messages] == ["6", "7", "8", "9"]
+    assert "message 5" in llm.last_messages[-1]["content"]
+    assert "message 6" not in llm.last_messages[-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_summary_is_reused_and_rolled_forward():
+    llm = _llm()
+    manager = _manager(keep_messages=4, fold_batch=2)
+    await manager.window("t1", _thread(10), llm, max_tokens=10_000)
+
+    for count in (11, 12):
+        window = await manager.window("t1", _thread(count), llm, max_tokens=10_000)
+        assert llm.call_count == 1
+        assert window.summary is not None
+
+    window = await manager.window("t1", _thread(13), llm, max_tokens=10_000)
+
+    assert llm.call_count == 2
+    assert "Current summary:\nEarlier the user" in llm.last_messages[-1]["content"]
+    assert "message 6" in llm.last_messages[-1]["content"]
+    assert len(window.messages) == 4
+
+
+@pytest.mark.asyncio
+async def test_edited_history_is_resummarized():
+    llm = _llm()
+    manager = _manager(keep_messages=4, fold_batch=2)
+    await manager.window("t1", _thread(10), llm, max_tokens=10_000)
+
+    edited = _thread(11)
+    edited[0]["content"] = "a different opening"
+    await manager.window("t1", edited, llm, max_tokens=10_000)
+
+    assert llm.call_count == 2
+    assert "a different opening" in llm.last_messages[-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_token_budget_folds_large_messages():
+    llm = _llm()
+
+    window = await _manager().window("t1", _thread(4, words=500), llm, max_tokens=1000)
+
+    assert len(window.messages) == 1
+    assert window.summary is not None
+    assert window.tokens <= 1000
+
+
+@pytest.mark.asyncio
+async def test_long_unsummarized_history_is_summarized_in_chunks():
+    counter = ApproximateTokenCounter()
+    request_tokens = []
+
+    class RecordingLLM(FakeLLM):
+        async def complete(self, messages):
+            request_tokens.append(counter.count(messages[-1]["content"]))
+            return await super().complete(messages)
+
+    llm = RecordingLLM(response_map={"new messages": "Earlier the user asked for shorter sections."})
+    manager = _manager(keep_messages=4, fold_batch=2, chunk_tokens=300)
+    thread = _thread(40, words=50)
+    thread[10]["content"] = "huge " * 5000
+
+    window = await manager.window("t1", thread, llm, max_tokens=100_000)
+
+    assert len(request_tokens) > 1
+    assert max(request_tokens) <= 2 * 300  # a chunk, plus the running summary and role markers
+    assert "Current summary:\nEarlier the user" in llm.last_messages[-1]["content"]
+    assert "message 35" in llm.last_messages[-1]["content"]
+    assert [m["content"].split()[1] for m in window.messages] == ["36", "37", "38", "39"]
+
+
+def test_summary_is_placed_before_conversation():
+    messages = build_agent_prompt(
+        [{"role": "user", "content": "Continue"}], {}, history_summary="Earlier we shortened the intro."
+    )
+
+    assert messages[1]["role"] == "system"
+    assert messages[1]["content"].endswith("Earlier we shortened the intro.")
+    assert messages[-1]["content"] == "Continue"
@@ -1,5 +1,8 @@
 import pytest
 import json
+from types import SimpleNamespace
+
+from sandbox.core.llm_client import AnthropicClient, BaseLLMClient, OpenAIClient, _to_anthropic_messages
 from sandbox.test_doubles.fake_llm import FakeLLM
 
 
@@ -82,3 +85,99 @@ async def test_fake_llm_reset():
     llm.reset()
     assert llm.call_count == 0
     assert llm.last_messages is None
+
+
+def test_anthropic_messages_carry_cache_breakpoints():
+    messages = [
+        {"role": "system", "content": "System prompt", "cache": True},
+        {"role": "system", "content": "Context", "cache": True},
+        {"role": "user", "content": "Earlier question"},
+        {"role": "assistant", "content": "Earlier answer"},
+        {"role": "user", "content": "Latest question", "cache": True},
+    ]
+
+    system, conversation = _to_anthropic_messages(messages)
+
+    ephemeral = {"type": "ephemeral"}
+    assert system == [
+        {"type": "text", "text": "System prompt", "cache_control": ephemeral},
+        {"type": "text", "text": "Context", "cache_control": ephemeral},
+    ]
+    assert [m["role"] for m in conversation] == ["user", "assistant", "user"]
+    assert "cache_control" not in conversation[0]["content"][0]
+    assert conversation[-1]["content"] == [{"type": "text", "text": "Latest question", "cache_control": ephemeral}]
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_fake_llm_stream_yields_complete_response_in_chunks():
+    llm = FakeLLM(response_map={"hello": "Hello there, streaming world"}, chunk_size=5)
+
+    chunks = await _collect(llm.stream([{"role": "user", "content": "Hello"}]))
+
+    assert chunks[0] == "Hello"
+    assert "".join(chunks) == "Hello there, streaming world"
+    assert llm.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_base_client_stream_falls_back_to_complete():
+    class OneShot(BaseLLMClient):
+        async def complete(self, messages):
+            return "whole reply"
+
+    assert await _collect(OneShot().stream([])) == ["whole reply"]
+
+
+@pytest.mark.asyncio
+async def test_openai_stream_yields_content_deltas():
+    async def chunks():
+        for content in ["Hel", None, "lo"]:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+        yield SimpleNamespace(choices=[])
+
+    calls = []
+
+    async def create(**kwargs):
+        calls.append(kwargs)
+        return chunks()
+
+    client = OpenAIClient.__new__(OpenAIClient)
+    client.model = "gpt-test"
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    assert await _collect(client.stream([{"role": "user", "content": "Hi", "cache": True}])) == ["Hel", "lo"]
+    assert calls[0]["stream"] is True
+    assert calls[0]["messages"] == [{"role": "user", "content": "Hi"}]
+
+
+@pytest.mark.asyncio
+async def test_anthropic_stream_yields_text_deltas():
+    class FakeStream:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        @property
+        async def text_stream(self):
+            for text in ["Hel", "lo"]:
+                yield text
+
+    calls = []
+
+    def stream(**kwargs):
+        calls.append(kwargs)
+        return FakeStream()
+
+    client = AnthropicClient.__new__(AnthropicClient)
+    client.model = "claude-test"
+    client.client = SimpleNamespace(messages=SimpleNamespace(stream=stream))
+    messages = [{"role": "system", "content": "Sys", "cache": True}, {"role": "user", "content": "Hi"}]
+
+    assert await _collect(client.stream(messages)) == ["Hel", "lo"]
+    assert calls[0]["system"] == [{"type": "text", "text": "Sys", "cache_control": {"type": "ephemeral"}}]
@@ -0,0 +1,127 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from sandbox.core import llm_pool
+from sandbox.core.llm_client import OpenAIClient
+from sandbox.core.llm_pool import LLMClientRegistry, PoolLimits
+from sandbox.core.single_flight import SingleFlightLLMClient
+from sandbox.main import app
+from sandbox.test_doubles.fake_llm import FakeLLM
+
+
+def test_registry_shares_one_client_per_provider():
+    registry = LLMClientRegistry()
+
+    client = registry.get("fake")
+
+    assert isinstance(client, SingleFlightLLMClient)
+    assert isinstance(client.client, FakeLLM)
+    assert registry.get("fake") is client
+    assert registry.stats()["providers"] == {}
+
+
+def test_pool_limits_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_POOL_MAX_CONNECTIONS", "12")
+    monkeypatch.setenv("LLM_POOL_KEEPALIVE_EXPIRY", "5")
+
+    assert PoolLimits.from_env() == PoolLimits(12, 16, 5.0)
+
+
+@pytest.mark.asyncio
+async def test_openai_client_uses_pooled_http_client(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test-key")
+    registry = LLMClientRegistry(PoolLimits(8, 4, 30.0), http2=False)
+
+    client = registry.get("openai")
+
+    assert isinstance(client.client, OpenAIClient)
+    http_client = registry._http_clients["openai"]
+    assert client.client.client._client is http_client
+    assert llm_pool._pool_connections(http_client) == []
+    stats = registry.stats()
+    assert stats["limits"] == {"max_connections": 8, "max_keepalive_connections": 4, "keepalive_expiry": 30.0}
+    assert stats["providers"]["openai"] == {
+        "connections": 0,
+        "idle_connections": 0,
+        "requests": 0,
+        "warm_up_errors": 0,
+    }
+
+    await registry.aclose()
+    assert http_client.is_closed
+    assert registry.stats()["providers"] == {}
+    assert registry.get("openai") is not client
+    await registry.aclose()
+
+
+def _failing_provider(monkeypatch, registry):
+    http_client = httpx.AsyncClient()
+    monkeypatch.setattr(registry, "_create_http_client", lambda name: http_client)
+
+    def create_llm_client(name, http_client):
+        raise RuntimeError("missing API key")
+
+    monkeypatch.setattr(llm_pool, "create_llm_client", create_llm_client)
+    return http_client
+
+
+def test_failed_client_creation_closes_the_http_client(monkeypatch):
+    registry = LLMClientRegistry()
+    http_client = _failing_provider(monkeypatch, registry)
+
+    with pytest.raises(RuntimeError):
+        registry.get("openai")
+
+    assert http_client.is_closed
+    assert registry._http_clients == {}
+
+
+@pytest.mark.asyncio
+async def test_failed_client_creation_closes_the_http_client_on_the_loop(monkeypatch):
+    registry = LLMClientRegistry()
+    http_client = _failing_provider(monkeypatch, registry)
+
+    with pytest.raises(RuntimeError):
+        registry.get("openai")
+    await registry.aclose()
+
+    assert http_client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failures_are_counted(monkeypatch):
+    pytest.importorskip("openai")
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test-key")
+    registry = LLMClientRegistry(http2=False)
+    registry.get("openai")
+    heads = []
+
+    async def failing_head(url):
+        heads.append(url)
+        raise OSError("unreachable")
+
+    monkeypatch.setattr(registry._http_clients["openai"], "head", failing_head)
+
+    await registry.warm_up(["openai", "fake"])
+
+    assert heads == ["https://api.openai.com/v1/"]
+    assert registry.stats()["providers"]["openai"]["warm_up_errors"] == 1
+    await registry.aclose()
+
+
+def test_lifespan_creates_and_closes_registry(monkeypatch):
+    monkeypatch.setattr(llm_pool, "_registry", None)
+
+    with TestClient(app) as client:
+        registry = llm_pool._registry
+        assert registry is not None
+        response = client.get("/v1/llm/pool/stats")
+        assert response.status_code == 200
+        assert set(response.json()) == {"limits", "http2", "providers"}
+        response = client.get("/v1/llm/cache/stats")
+        assert response.status_code == 200
+        assert response.json()["disk"]["enabled"]
+
+    assert llm_pool._registry is None
@@ -0,0 +1,86 @@
+from sandbox.core.markdown_ast import (
+    MARKDOWN_CACHE,
+    block_kind,
+    cut_markdown,
+    parse_markdown,
+)
+
+REPORT = """# Results
+
+Richness declined at most sites
+across the region.
+
+- first item
+  continued
+- second item
+
+| site | count |
+| --- | --- |
+| A | 4 |
+
+```python
+print("# not a heading")
+```
+
+> A quote, see [the data](http://x.y).
+"""
+
+
+def _kinds(text):
+    return [(node.kind, text[node.start:node.end].split("\n")[0]) for node in parse_markdown(text).nodes]
+
+
+def test_parse_markdown_finds_block_nodes():
+    assert _kinds(REPORT) == [
+        ("heading", "# Results"),
+        ("paragraph", "Richness declined at most sites"),
+        ("list_item", "- first item"),
+        ("list_item", "- second item"),
+        ("table", "| site | count |"),
+        ("code", "```python"),
+        ("quote", "> A quote, see [the data](http://x.y)."),
+    ]
+    parsed = parse_markdown(REPORT)
+    assert parsed.nodes[0].level == 1
+    assert [REPORT[start:end] for start, end in parsed.links] == ["[the data](http://x.y)"]
+    assert "".join(parsed.tokens) == REPORT
+
+
+def test_unclosed_code_fence_runs_to_end():
+    text = "Intro\n```\ncode\n| not a table"
+
+    assert _kinds(text) == [("paragraph", "Intro"), ("code", "```")]
+
+
+def test_parse_markdown_is_cached_by_content():
+    text = "Cached *markdown* text."
+    first = parse_markdown(text)
+    hits = MARKDOWN_CACHE.hits
+
+    assert parse_markdown(str(text)) is first
+    assert MARKDOWN_CACHE.hits == hits + 1
+
+
+def test_block_kind():
+    assert block_kind(parse_markdown("| a |\n| - |\n| 1 |")) == "table"
+    assert block_kind(parse_markdown("- a\n- b")) == "list"
+    assert block_kind(parse_markdown("Text\n\n- a")) is None
+
+
+def test_cut_markdown_keeps_whole_nodes():
+    limit = REPORT.index("| A | 4 |") + 3
+
+    cut = cut_markdown(REPORT, limit)
+
+    assert cut.endswith("- second item")
+    assert "| site" not in cut
+
+
+def test_cut_markdown_splits_oversized_first_node_by_line():
+    table = "| a | b |\n| --- | --- |\n" + "| 1 | 2 |\n" * 50
+    code = "```sql\nselect 1;\nselect 2;\nselect 3;\n```"
+
+    assert cut_markdown(table, 40) == "| a | b |\n| --- | --- |\n| 1 | 2 |"
+    assert cut_markdown(code, 25) == "```sql\nselect 1;\n```"
+    assert cut_markdown("Many words in one paragraph", 12) == "Many words"
+    assert cut_markdown("short", 100) == "short"
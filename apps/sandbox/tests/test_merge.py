@@ -0,0 +1,120 @@
+import pytest
+from fastapi.testclient import TestClient
+from sandbox.main import app
+from sandbox.core.diff_engine import apply_diff
+from sandbox.core.merge import MergeConflictError, merge_three_way
+
+
+client = TestClient(app)
+
+BASE = "The quick brown fox jumps over the lazy dog."
+
+
+def test_non_overlapping_changes_are_combined():
+    human = "The quick red fox jumps over the lazy dog."
+    agent = "The quick brown fox leaps over the lazy dog."
+
+    result = merge_three_way(BASE, human, agent)
+
+    assert result["clean"]
+    assert result["merged_text"] == "The quick red fox leaps over the lazy dog."
+
+
+def test_same_change_on_both_sides_is_not_a_conflict():
+    edited = "The quick brown cat jumps over the lazy dog."
+
+    result = merge_three_way(BASE, edited, edited)
+
+    assert result["clean"]
+    assert result["merged_text"] == edited
+
+
+def test_conflicting_change_keeps_human_text():
+    human = "The quick red fox jumps over the lazy dog."
+    agent = "The quick grey fox jumps over the sleepy dog."
+
+    result = merge_three_way(BASE, human, agent)
+
+    assert not result["clean"]
+    assert result["merged_text"] == "The quick red fox jumps over the sleepy dog."
+    [conflict] = result["conflicts"]
+    assert (conflict["base"], conflict["human"], conflict["agent"]) == ("brown", "red", "grey")
+    assert result["merged_text"][conflict["offset"]:].startswith("red")
+
+
+def test_insertions_at_same_point_conflict():
+    human = "The quick brown fox jumps over the lazy dog. Human."
+    agent = "The quick brown fox jumps over the lazy dog. Agent."
+
+    result = merge_three_way(BASE, human, agent)
+
+    assert not result["clean"]
+    assert result["conflicts"][0]["base"] == ""
+
+
+def test_unchanged_sides():
+    assert merge_three_way(BASE, BASE, BASE)["merged_text"] == BASE
+    agent = "Completely new text."
+    assert merge_three_way(BASE, BASE, agent)["merged_text"] == agent
+    assert merge_three_way(BASE, agent, BASE)["merged_text"] == agent
+
+
+def test_multiline_markdown_merge():
+    base = "# Results\n\n- Item one\n- Item two\n- Item three"
+    human = "# Results\n\n- Item one\n- Item 2\n- Item three"
+    agent = "# Findings\n\n- Item one\n- Item two\n- Item three\n- Item four"
+
+    result = merge_three_way(base, human, agent)
+
+    assert result["clean"]
+    assert result["merged_text"] == "# Findings\n\n- Item one\n- Item 2\n- Item three\n- Item four"
+
+
+def test_apply_diff_rebases_stale_edit():
+    blocks = [{"blockId": "b1", "markdownText": "The quick red fox jumps over the lazy dog."}]
+    edits = [{
+        "blockId": "b1",
+        "baseMarkdownText": BASE,
+        "newMarkdownText": "The quick brown fox leaps over the lazy dog.",
+    }]
+
+    result = apply_diff(blocks, edits)
+
+    assert result[0]["markdownText"] == "The quick red fox leaps over the lazy dog."
+
+
+def test_apply_diff_raises_on_conflict_without_partial_updates():
+    blocks = [
+        {"blockId": "b0", "markdownText": "Untouched"},
+        {"blockId": "b1", "markdownText": "The quick red fox jumps over the lazy dog."},
+    ]
+    edits = [
+        {"blockId": "b0", "newMarkdownText": "Changed"},
+        {
+            "blockId": "b1",
+            "baseMarkdownText": BASE,
+            "newMarkdownText": "The quick grey fox jumps over the lazy dog.",
+        },
+    ]
+
+    with pytest.raises(MergeConflictError, match="Block ID 'b1'") as excinfo:
+        apply_diff(blocks, edits)
+
+    assert excinfo.value.conflicts[0]["agent"] == "grey"
+    assert blocks[0]["markdownText"] == "Untouched"
+
+
+def test_merge_endpoint():
+    response = client.post("/v1/diff/merge", json={
+        "base_text": BASE,
+        "human_text": "The quick red fox jumps over the lazy dog.",
+        "agent_text": "The quick brown fox leaps over the lazy dog.",
+    })
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data == {
+        "merged_text": "The quick red fox leaps over the lazy dog.",
+        "clean": True,
+        "conflicts": [],
+    }
@@ -3,7 +3,12 @@ from sandbox.core.prompt_builder import (
     build_agent_prompt,
     truncate_context,
     _build_context_prompt,
+    compact_aliases,
+    expand_aliases,
+    select_context,
 )
+from sandbox.core.dense_index import DenseIndex
+from sandbox.core.token_counter import ApproximateTokenCounter
 
 
 def test_build_agent_prompt_basic():
@@ -94,7 +99,14 @@ def test_build_context_prompt_with_blocks():
     assert "block-1" in result
     assert "Short content" in result
     assert "block-2" in result
-    assert "..." in result
+    assert "A" * 300 in result
+
+
+def test_system_prompt_describes_patch_edits():
+    messages = build_agent_prompt([{"role": "user", "content": "Fix a typo"}], {})
+
+    assert '"action": "patch"' in messages[0]["content"]
+    assert '"search"' in messages[0]["content"]
 
 
 def test_build_context_prompt_with_artifacts():
@@ -152,3 +164,258 @@ def test_truncate_context_stops_when_limit_reached():
     result = truncate_context(context, max_tokens=2000)
     
     assert len(result["blocks"]) < len(context["blocks"])
+
+
+def test_truncate_context_hits_token_budget():
+    counter = ApproximateTokenCounter()
+    context = {
+        "sections": [{"id": "sec-1", "title": "Intro"}],
+        "blocks": [
+            {"id": f"block-{i}", "type": "paragraph", "content": "Observed species richness rose. " * 20}
+            for i in range(50)
+        ],
+        "artifacts": [],
+    }
+
+    result = truncate_context(context, max_tokens=1000, token_counter=counter)
+    used = counter.count(_build_context_prompt(result))
+
+    assert 950 <= used <= 1000
+
+
+class CountingTokenCounter(ApproximateTokenCounter):
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+        self.chars = 0
+
+    def count(self, text: str) -> int:
+        self.calls += 1
+        self.chars += len(text)
+        return super().count(text)
+
+
+def test_truncate_context_large_report_counts_in_linear_work():
+    blocks = [
+        {"id": f"block-{i}", "type": "paragraph", "content": f"Paragraph {i} of the report. " * 10}
+        for i in range(5000)
+    ]
+    context = {"sections": [], "blocks": blocks, "artifacts": []}
+    counter = CountingTokenCounter()
+
+    result = truncate_context(context, max_tokens=10**6, token_counter=counter)
+
+    assert len(result["blocks"]) == 5000
+    # Each block is counted a bounded number of times, never the whole prompt per block.
+    assert counter.calls <= 2 * len(blocks) + 10
+    assert counter.chars <= 2 * sum(len(block["content"]) for block in blocks)
+
+
+def _report_context(anchor=None):
+    filler = "Background material about the study area and its history. " * 20
+    return {
+        "sections": [{"id": "intro", "title": "Introduction"}, {"id": "end", "title": "Conclusion"}],
+        "blocks": [
+            {"id": f"intro-{i}", "type": "paragraph", "content": filler, "section_id": "intro"}
+            for i in range(20)
+        ] + [
+            {"id": "end-1", "type": "paragraph", "content": "Richness declined overall.", "section_id": "end"},
+        ],
+        "artifacts": [],
+        "anchor_section_id": anchor,
+    }
+
+
+def test_select_context_packs_relevant_blocks_first():
+    result = select_context(_report_context(), "Summarise the conclusion", max_tokens=600)
+
+    ids = [block["id"] for block in result["blocks"]]
+    assert "end-1" in ids
+    assert len(ids) < 21
+    assert ids[-1] == "end-1"
+
+
+def test_select_context_puts_anchor_section_first():
+    result = select_context(_report_context(anchor="end"), "history of the study area", max_tokens=300)
+
+    assert "end-1" in [block["id"] for block in result["blocks"]]
+
+
+def test_build_agent_prompt_selects_context_for_latest_user_message():
+    messages = build_agent_prompt(
+        [{"role": "user", "content": "Tighten the conclusion"}],
+        _report_context(),
+        max_context_tokens=600,
+    )
+
+    selection = messages[-2]["content"]
+    assert "end-1" in selection
+    assert "intro-19" not in selection
+    assert "end-1" not in messages[1]["content"]
+    assert messages[-1]["content"] == "Tighten the conclusion"
+
+
+def test_selected_blocks_stay_out_of_the_cached_prefix():
+    first_turn = [{"role": "user", "content": "Tighten the conclusion"}]
+    second_turn = first_turn + [
+        {"role": "assistant", "content": "Done."},
+        {"role": "user", "content": "Expand the introduction history"},
+    ]
+
+    first = build_agent_prompt(first_turn, _report_context(), max_context_tokens=600)
+    second = build_agent_prompt(second_turn, _report_context(), max_context_tokens=600)
+
+    assert [m.get("cache", False) for m in first] == [True, True, False, False]
+    assert [m.get("cache", False) for m in second] == [True, True, False, True, False, False]
+    assert [m["content"] for m in second[:3]] == [m["content"] for m in first[:2]] + [first[3]["content"]]
+    assert first[2]["content"] != second[4]["content"]
+
+
+def test_select_context_blends_dense_scores():
+    context = {
+        "sections": [],
+        "blocks": [
+            {"id": "a", "type": "paragraph", "content": "Budget allocations for the next fiscal year."},
+            {"id": "b", "type": "paragraph", "content": "The decline in species richness was seen at every site."},
+        ],
+        "artifacts": [],
+    }
+
+    result = select_context(
+        context, "richness declining", max_tokens=30, dense_index=DenseIndex(), token_counter=ApproximateTokenCounter()
+    )
+
+    assert [block["id"] for block in result["blocks"]] == ["b"]
+
+
+def test_prompt_prefix_is_stable_across_turns():
+    context = {
+        "sections": [{"id": "intro", "title": "Introduction"}],
+        "blocks": [{"id": "b1", "type": "paragraph", "content": "Intro text.", "section_id": "intro"}],
+        "artifacts": [],
+        "revision": "rev-1",
+    }
+    first_turn = [{"role": "user", "content": "Shorten the intro"}]
+    second_turn = first_turn + [
+        {"role": "assistant", "content": "Done."},
+        {"role": "user", "content": "Now make it formal"},
+    ]
+
+    first = build_agent_prompt(first_turn, context, max_context_tokens=1000)
+    second = build_agent_prompt(second_turn, context, max_context_tokens=1000)
+
+    assert [m["content"] for m in second[:3]] == [m["content"] for m in first]
+    assert [m.get("cache", False) for m in second] == [True, True, False, False, True]
+
+
+def test_context_prompt_is_memoized_per_revision():
+    context = {
+        "sections": [],
+        "blocks": [{"id": "b1", "type": "paragraph", "content": "Text"}],
+        "artifacts": [],
+        "revision": "rev-memo",
+    }
+
+    first = build_agent_prompt([], context)[1]["content"]
+    second = build_agent_prompt([], dict(context))[1]["content"]
+
+    assert first is second
+
+
+def test_context_prompt_memo_sees_same_length_edits_at_one_revision():
+    context = {
+        "sections": [{"id": "s1", "title": "Results"}],
+        "blocks": [{"id": "b1", "type": "paragraph", "content": "Teh results.", "section_id": "s1"}],
+        "artifacts": [],
+        "revision": "rev-same-length",
+    }
+    fixed = {**context, "blocks": [{**context["blocks"][0], "content": "The results."}]}
+    renamed = {**fixed, "sections": [{"id": "s1", "title": "Findings"}]}
+
+    assert "Teh results." in build_agent_prompt([], context)[1]["content"]
+    assert "The results." in build_agent_prompt([], fixed)[1]["content"]
+    assert "Findings" in build_agent_prompt([], renamed)[1]["content"]
+    assert build_agent_prompt([], fixed, cache_scope="p1")[1]["content"] is not (
+        build_agent_prompt([], fixed, cache_scope="p2")[1]["content"]
+    )
+
+
+def _convex_context():
+    return {
+        "sections": [
+            {"id": "k17ab9m2x4q8r5t6w3y7z1c0d2e4f6g8", "title": "Introduction"},
+            {"id": "k17cd3n5p7s9u1v3x5z7b9d1f3h5j7l9", "title": "Results"},
+        ],
+        "blocks": [
+            {"id": "j97aa1b2c3d4e5f6g7h8i9j0k1l2m3n4", "type": "markdown", "content": "Intro text.",
+             "section_id": "k17ab9m2x4q8r5t6w3y7z1c0d2e4f6g8"},
+            {"id": "j97bb1b2c3d4e5f6g7h8i9j0k1l2m3n4", "type": "table", "content": "| a | b |",
+             "section_id": "k17cd3n5p7s9u1v3x5z7b9d1f3h5j7l9"},
+            {"id": "j97cc1b2c3d4e5f6g7h8i9j0k1l2m3n4", "type": "markdown", "content": "Richness declined.",
+             "section_id": "k17cd3n5p7s9u1v3x5z7b9d1f3h5j7l9"},
+        ],
+        "artifacts": [],
+    }
+
+
+def test_compact_prompt_uses_aliases_grouped_by_section():
+    messages = build_agent_prompt([{"role": "user", "content": "Edit"}], _convex_context(), compact=True)
+
+    assert "[s1]" in messages[0]["content"]
+    assert messages[1]["content"] == (
+        "Current report context:\n"
+        "\n## [s1] Introduction\n[b1]\nIntro text.\n"
+        "\n## [s2] Results\n[b2 table]\n| a | b |\n[b3]\nRichness declined."
+    )
+
+
+def test_compact_prompt_uses_fewer_tokens():
+    context = _convex_context()
+    counter = ApproximateTokenCounter()
+
+    full = build_agent_prompt([], context)[1]["content"]
+    compact = build_agent_prompt([], context, compact=True)[1]["content"]
+
+    assert counter.count(compact) < counter.count(full) / 2
+
+
+def test_expand_aliases_maps_edit_ids_back():
+    aliases = compact_aliases(_convex_context())
+    edits = [
+        {"type": "block", "id": "b3", "action": "update", "content": "x"},
+        {"type": "section", "id": "s2", "action": "update", "content": "y"},
+        {"type": "section", "id": "conclusion", "action": "create", "content": "z"},
+    ]
+
+    assert [edit["id"] for edit in expand_aliases(edits, aliases)] == [
+        "j97cc1b2c3d4e5f6g7h8i9j0k1l2m3n4",
+        "k17cd3n5p7s9u1v3x5z7b9d1f3h5j7l9",
+        "conclusion",
+    ]
+
+
+def test_compact_budget_fits_more_blocks():
+    context = _convex_context()
+    context["blocks"] = [
+        {**context["blocks"][0], "id": f"j97{i:029d}", "content": "Short."} for i in range(40)
+    ]
+    counter = ApproximateTokenCounter()
+
+    full = truncate_context(context, max_tokens=200, token_counter=counter)
+    compact = truncate_context(context, max_tokens=200, token_counter=counter, aliases=compact_aliases(context))
+
+    assert len(compact["blocks"]) > len(full["blocks"])
+
+
+def test_truncate_context_cuts_at_markdown_boundaries():
+    table = "| site | count |\n| --- | --- |\n" + "| A | 4 |\n" * 200
+    context = {
+        "sections": [],
+        "blocks": [{"id": "b1", "type": "markdown", "content": "Counts by site:\n\n" + table}],
+        "artifacts": [],
+    }
+
+    result = truncate_context(context, max_tokens=60, token_counter=ApproximateTokenCounter())
+
+    assert result["blocks"][0]["content"] == "Counts by site:\n...[truncated]"
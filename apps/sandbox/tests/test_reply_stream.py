@@ -0,0 +1,91 @@
+import json
+
+import pytest
+from sandbox.core.reply_stream import AgentReplyParser
+
+REPLY = {
+    "message": 'Tightened "all" sections: café \U0001f600 {braces} and \\ backslash.',
+    "proposedEdits": [
+        {"type": "block", "id": "b1", "action": "patch", "patches": [{"search": "a}", "replace": "b]"}]},
+        {"type": "block", "id": "b2", "action": "update", "content": "line\nnext"},
+        "not an edit",
+    ],
+}
+
+
+def _feed(text, size):
+    parser = AgentReplyParser()
+    message, edits = [], []
+    for start in range(0, len(text), size):
+        for event in parser.feed(text[start:start + size]):
+            (message if event.kind == "message" else edits).append(event.value)
+    return parser, "".join(message), edits
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 10_000])
+@pytest.mark.parametrize("text", [
+    json.dumps(REPLY),
+    "```json\n" + json.dumps(REPLY, indent=2, ensure_ascii=False) + "\n```",
+    json.dumps({"proposedEdits": REPLY["proposedEdits"], "message": REPLY["message"]}),
+])
+def test_parser_matches_full_parse_for_any_chunking(text, size):
+    parser, message, edits = _feed(text, size)
+
+    assert message == REPLY["message"]
+    assert edits == REPLY["proposedEdits"][:2]
+    assert parser.text == text
+
+
+def test_long_message_is_scanned_once(monkeypatch):
+    from sandbox.core import reply_stream
+
+    scanned = []
+
+    class CountingPattern:
+        def search(self, text, pos, endpos):
+            scanned.append(endpos - pos)
+            return held_escape.search(text, pos, endpos)
+
+    held_escape = reply_stream._HELD_ESCAPE
+    monkeypatch.setattr(reply_stream, "_HELD_ESCAPE", CountingPattern())
+    text = json.dumps({"message": REPLY["message"] * 500, "proposedEdits": []})
+
+    _, message, _ = _feed(text, 7)
+
+    assert message == REPLY["message"] * 500
+    # Only the tail of each chunk is searched for an escape to hold back.
+    assert max(scanned) <= reply_stream._HELD_ESCAPE_CHARS
+
+
+def test_edit_is_emitted_when_its_brace_closes():
+    text = json.dumps(REPLY)
+    second_edit = text.index('{"type": "block", "id": "b2"')
+    parser = AgentReplyParser()
+
+    events = parser.feed(text[:second_edit])
+
+    assert [event.value["id"] for event in events if event.kind == "edit"] == ["b1"]
+    assert [event.kind for event in parser.feed(text[second_edit:])] == ["edit"]
+
+
+def test_message_streams_before_the_string_closes():
+    parser = AgentReplyParser()
+
+    assert parser.feed('{"message": "Hel') == [("message", "Hel")]
+    assert parser.feed('lo\\') == [("message", "lo")]
+    assert parser.feed('n world", "proposedEdits": []}') == [("message", "\n world")]
+
+
+def test_plain_text_reply_is_streamed_as_message():
+    parser = AgentReplyParser()
+
+    assert parser.feed("  Sorry, ") == [("message", "  Sorry, ")]
+    assert parser.feed("no edits.") == [("message", "no edits.")]
+
+
+def test_text_after_the_object_is_ignored():
+    parser = AgentReplyParser()
+
+    parser.feed('{"message": "Done", "proposedEdits": []}')
+
+    assert parser.feed(' {"message": "again"}') == []
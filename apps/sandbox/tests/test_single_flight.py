@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from sandbox.core import single_flight
+from sandbox.core.single_flight import (
+    IdempotencyKeyReused,
+    IdempotencyStore,
+    SingleFlight,
+    SingleFlightLLMClient,
+)
+from sandbox.test_doubles.fake_llm import FakeLLM
+
+MESSAGES = [{"role": "user", "content": "Rewrite the intro"}]
+
+
+class SlowLLM(FakeLLM):
+    async def complete(self, messages):
+        await asyncio.sleep(0.01)
+        return await super().complete(messages)
+
+    async def stream(self, messages):
+        async for chunk in super().stream(messages):
+            await asyncio.sleep(0)
+            yield chunk
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "done"
+
+    results = await asyncio.gather(*(flights.do("k", work) for _ in range(3)))
+    again = await flights.do("k", work)
+
+    assert results == ["done"] * 3
+    assert again == "done"
+    assert len(calls) == 2
+    assert flights.stats() == {"in_flight": 0, "calls": 2, "shared": 2}
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_failures():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(flights.do("k", fail), flights.do("k", fail), return_exceptions=True)
+
+    assert [type(result) for result in results] == [ValueError, ValueError]
+    assert flights.stats()["calls"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_call():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    first = asyncio.ensure_future(flights.do("k", work))
+    second = asyncio.ensure_future(flights.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "done"
+    assert first.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_client_coalesces_identical_completions():
+    llm = SlowLLM()
+    client = SingleFlightLLMClient(llm)
+
+    results = await asyncio.gather(
+        client.complete(MESSAGES), client.complete([dict(m) for m in MESSAGES]), client.complete([])
+    )
+
+    assert results[0] == results[1]
+    assert llm.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_stream_shares_its_text_with_concurrent_callers():
+    llm = SlowLLM(chunk_size=4)
+    client = SingleFlightLLMClient(llm)
+
+    async def collect():
+        return [chunk async for chunk in client.stream(MESSAGES)]
+
+    leader = asyncio.ensure_future(collect())
+    await asyncio.sleep(0)
+    follower, completed = await asyncio.gather(collect(), client.complete(MESSAGES))
+    streamed = await leader
+
+    assert len(streamed) > 1
+    assert follower == ["".join(streamed)]
+    assert completed == "".join(streamed)
+    assert llm.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_lets_waiters_run_again():
+    llm = SlowLLM(chunk_size=4)
+    client = SingleFlightLLMClient(llm)
+    stream = client.stream(MESSAGES)
+    await stream.__anext__()
+
+    waiter = asyncio.ensure_future(client.complete(MESSAGES))
+    await asyncio.sleep(0)
+    await stream.aclose()
+
+    assert await waiter == await llm.complete(MESSAGES)
+    assert llm.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_reserves_keys_on_arrival(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(single_flight.time, "time", lambda: now[0])
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite3"), ttl=60, lease=10)
+
+    assert await store.reserve("thread", "key", "fingerprint") == ("reserved", None)
+    assert await store.reserve("thread", "key", "fingerprint") == ("pending", None)
+    assert await store.reserve("other thread", "key", "fingerprint") == ("reserved", None)
+    with pytest.raises(IdempotencyKeyReused):
+        await store.reserve("thread", "key", "another fingerprint")
+
+    await store.finish("thread", "key", '{"agent_message": "done"}')
+    store.close()
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite3"), ttl=60, lease=10)
+    assert await store.reserve("thread", "key", "fingerprint") == ("done", '{"agent_message": "done"}')
+    assert store.stats() == {"entries": 2, "pending": 1, "replays": 1}
+
+    now[0] += 10  # the unfinished reservation has lapsed
+    assert await store.reserve("other thread", "key", "fingerprint") == ("reserved", None)
+    now[0] += 50
+    assert await store.reserve("thread", "key", "fingerprint") == ("reserved", None)
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_releases_failed_runs():
+    store = IdempotencyStore()
+    await store.reserve("thread", "key", "fingerprint")
+
+    await store.release("thread", "key")
+
+    assert await store.reserve("thread", "key", "another fingerprint") == ("reserved", None)
+    store.close()
@@ -0,0 +1,82 @@
+import pytest
+from sandbox.core.token_counter import (
+    TOKEN_COUNT_CACHE,
+    ApproximateTokenCounter,
+    BaseTokenCounter,
+    count_tokens,
+    get_token_counter,
+)
+
+
+class CharCounter(BaseTokenCounter):
+    name = "chars"
+
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text):
+        self.calls += 1
+        return len(text)
+
+    def truncate(self, text, max_tokens):
+        return text[:max_tokens]
+
+
+def test_approximate_counter_counts_words_and_punctuation():
+    counter = ApproximateTokenCounter()
+
+    assert counter.count("") == 0
+    assert counter.count("The cat sat.") == 4
+    assert counter.count("**bold**") == 3
+    assert counter.count("A" * 400) == 100
+    assert counter.count("12345678901234") == 5
+
+
+def test_approximate_counter_is_close_for_prose():
+    text = "The results show a significant increase in species richness across all sampled sites. " * 20
+
+    # 14 words and punctuation marks per sentence; "significant" is split.
+    assert ApproximateTokenCounter().count(text) == 16 * 20
+
+
+def test_approximate_truncate_fits_budget():
+    counter = ApproximateTokenCounter()
+    text = "word " * 100 + "A" * 400
+
+    for budget in (0, 1, 50, 100, 150, 1000):
+        prefix = counter.truncate(text, budget)
+        assert text.startswith(prefix)
+        assert counter.count(prefix) <= budget
+    assert counter.truncate(text, 150).endswith("A" * 200)
+    assert counter.truncate(text, 1000) == text
+
+
+def test_count_tokens_caches_by_content():
+    TOKEN_COUNT_CACHE.clear()
+    counter = CharCounter()
+    text = "x" * 100
+
+    assert count_tokens(text, counter) == 100
+    assert count_tokens("x" * 100, counter) == 100
+    assert counter.calls == 1
+
+
+def test_get_token_counter():
+    assert isinstance(get_token_counter("approximate"), ApproximateTokenCounter)
+    assert get_token_counter("approximate") is get_token_counter("approximate")
+    with pytest.raises(ValueError, match="Unknown token counter"):
+        get_token_counter("nope")
+
+
+def test_auto_counter_falls_back_when_the_encoding_cannot_load(monkeypatch):
+    from sandbox.core import token_counter
+
+    def offline(self, encoding="cl100k_base"):
+        raise OSError("could not download the encoding")
+
+    monkeypatch.setattr(token_counter.TiktokenCounter, "__init__", offline)
+    get_token_counter.cache_clear()
+    try:
+        assert isinstance(get_token_counter("auto"), ApproximateTokenCounter)
+    finally:
+        get_token_counter.cache_clear()
@@ -0,0 +1,171 @@
+import json
+
+from fastapi.testclient import TestClient
+from sandbox.main import app
+from sandbox.core.version_diff import diff_snapshots
+
+
+client = TestClient(app)
+
+
+def _snapshot(*sections):
+    return {
+        "sections": [
+            {
+                "sectionId": section_id,
+                "headingText": heading,
+                "headingLevel": 2,
+                "order": index,
+                "blocks": [
+                    {"blockId": block_id, "blockType": "paragraph", "order": k, "markdownText": text}
+                    for k, (block_id, text) in enumerate(blocks)
+                ],
+            }
+            for index, (section_id, heading, blocks) in enumerate(sections)
+        ]
+    }
+
+
+BASE = _snapshot(
+    ("s1", "Introduction", [("b1", "Intro paragraph one."), ("b2", "Intro paragraph two.")]),
+    ("s2", "Methods", [("b3", "We sampled forty sites."), ("b4", "Counts were repeated yearly.")]),
+)
+
+
+def test_identical_snapshots_are_unchanged():
+    results = list(diff_snapshots(BASE, BASE))
+
+    assert [r["status"] for r in results] == ["unchanged", "unchanged"]
+    assert [r["unchanged_blocks"] for r in results] == [2, 2]
+    assert all(r["blocks"] == [] for r in results)
+
+
+def test_changed_block_is_diffed():
+    new = _snapshot(
+        ("s1", "Introduction", [("b1", "Intro paragraph one."), ("b2", "Intro paragraph 2.")]),
+        ("s2", "Methods", [("b3", "We sampled forty sites."), ("b4", "Counts were repeated yearly.")]),
+    )
+
+    results = list(diff_snapshots(BASE, new))
+
+    assert [r["status"] for r in results] == ["changed", "unchanged"]
+    [entry] = results[0]["blocks"]
+    assert entry["status"] == "changed"
+    assert entry["block_id"] == "b2"
+    assert entry["diff"]["spans"] == [["=", 16], ["-", 4], ["+", 2]]
+    assert results[0]["unchanged_blocks"] == 1
+
+
+def test_added_removed_and_moved_blocks():
+    new = _snapshot(
+        ("s1", "Introduction", [("b1", "Intro paragraph one."), ("b3", "We sampled forty sites.")]),
+        ("s2", "Methods", [("b4", "Counts were repeated yearly."), ("b5", "A brand new block.")]),
+    )
+
+    results = list(diff_snapshots(BASE, new, output="operations"))
+
+    intro = {entry["status"]: entry for entry in results[0]["blocks"]}
+    assert intro["moved"]["block_id"] == "b3"
+    assert intro["removed"]["old_block_id"] == "b2"
+    methods = results[1]["blocks"]
+    assert [entry["status"] for entry in methods] == ["added"]
+    assert all(op["type"] == "add" for op in methods[0]["diff"]["operations"])
+
+
+def test_added_and_removed_sections():
+    new = _snapshot(
+        ("s1", "Introduction", [("b1", "Intro paragraph one."), ("b2", "Intro paragraph two.")]),
+        ("s9", "Discussion", [("b9", "Discussion text.")]),
+    )
+
+    results = list(diff_snapshots(BASE, new))
+
+    assert [(r["section_id"], r["status"]) for r in results] == [
+        ("s1", "unchanged"),
+        ("s9", "added"),
+        ("s2", "removed"),
+    ]
+    assert [entry["old_block_id"] for entry in results[2]["blocks"]] == ["b3", "b4"]
+
+
+def test_restored_snapshot_aligns_by_content():
+    restored = _snapshot(
+        ("r1", "Introduction", [("x1", "Intro paragraph one."), ("x2", "Intro paragraph two.")]),
+        ("r2", "Methods", [("x3", "We sampled forty sites."), ("x4", "Counts were repeated yearly.")]),
+    )
+
+    results = list(diff_snapshots(BASE, restored))
+
+    assert [r["old_section_id"] for r in results] == ["s1", "s2"]
+    assert [r["status"] for r in results] == ["unchanged", "unchanged"]
+
+
+def test_content_hash_short_circuits_comparison():
+    old = _snapshot(("s1", "Intro", [("b1", "Old text")]))
+    new = _snapshot(("s1", "Intro", [("b1", "New text")]))
+    old["sections"][0]["blocks"][0]["contentHash"] = "same"
+    new["sections"][0]["blocks"][0]["contentHash"] = "same"
+
+    results = list(diff_snapshots(old, new))
+
+    assert results[0]["status"] == "unchanged"
+
+
+def test_content_hash_on_one_side_falls_back_to_local_hash():
+    new = _snapshot(
+        ("s1", "Introduction", [("b1", "Intro paragraph one."), ("b2", "Intro paragraph two.")]),
+        ("s2", "Methods", [("b3", "We sampled forty sites."), ("b4", "Counts were repeated yearly.")]),
+    )
+    new["sections"][0]["blocks"][0]["contentHash"] = "client-hash"
+
+    results = list(diff_snapshots(BASE, new))
+
+    assert [r["status"] for r in results] == ["unchanged", "unchanged"]
+
+
+def test_reordered_blocks_within_a_section_are_moved():
+    old = _snapshot(("s1", "Intro", [("a", "Alpha."), ("b", "Beta."), ("c", "Gamma."), ("d", "Delta.")]))
+    new = _snapshot(("s1", "Intro", [("a", "Alpha."), ("c", "Gamma."), ("d", "Delta!"), ("b", "Beta.")]))
+
+    [result] = diff_snapshots(old, new)
+
+    assert [(e["block_id"], e["status"], e["moved"]) for e in result["blocks"]] == [
+        ("d", "changed", False),
+        ("b", "moved", True),
+    ]
+    assert result["unchanged_blocks"] == 2
+
+
+def test_heading_change_marks_section_changed():
+    new = _snapshot(
+        ("s1", "Overview", [("b1", "Intro paragraph one."), ("b2", "Intro paragraph two.")]),
+        ("s2", "Methods", [("b3", "We sampled forty sites."), ("b4", "Counts were repeated yearly.")]),
+    )
+
+    results = list(diff_snapshots(BASE, new))
+
+    assert results[0]["status"] == "changed"
+    assert results[0]["old_heading_text"] == "Introduction"
+
+
+def test_diff_versions_endpoint_streams_sections():
+    new = _snapshot(
+        ("s1", "Introduction", [("b1", "Intro paragraph one."), ("b2", "Intro paragraph 2.")]),
+        ("s2", "Methods", [("b3", "We sampled forty sites."), ("b4", "Counts were repeated yearly.")]),
+    )
+
+    response = client.post("/v1/diff/versions", json={"old_snapshot": BASE, "new_snapshot": new})
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["status"] for line in lines] == ["changed", "unchanged"]
+    assert lines[0]["blocks"][0]["block_id"] == "b2"
+
+
+def test_diff_versions_endpoint_validates_snapshot_shape():
+    response = client.post(
+        "/v1/diff/versions",
+        json={"old_snapshot": {"sections": [{"headingText": "x"}]}, "new_snapshot": BASE},
+    )
+
+    assert response.status_code == 422